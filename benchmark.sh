@@ -0,0 +1,6 @@
+which python3
+python3 -m benchmarks.run_benchmarks \
+	--num_prosumers 10 49 \
+	--num_steps 30 \
+	--data_folder ./benchmark_data \
+	--output "benchmark_results.json"
@@ -0,0 +1,545 @@
+"""
+Benchmarks of the data generation hot paths, run offline on synthetic building data
+
+Cases:
+    environment: building the environment from CSV, compiling it and loading it from the compiled cache
+    dispatch: latency of every prosumer dispatch solve, for each dispatch solver
+    reward: per step reward calls and the batched reward over a whole run
+    simulate: end to end simulation steps per second and simulation data bytes, for each writer backend
+    batch_writer: batch data transitions per second and bytes, of the RLlib json format and of each shard format
+        on its own, so shard formats are benchmarked without ray
+    population: generating synthetic prosumer populations and simulating them, per prosumer step rates
+        should stay flat and peak RSS should grow about linearly with the population size
+    imports: import time of the command line entry points, which must stay within a budget and must not
+        load optional backends (wandb, ray, gym) or scipy
+
+Every case runs in its own process, so its peak RSS is its own. Results are written as JSON which
+two commits can be compared with:
+
+    python -m benchmarks.run_benchmarks --output before.json
+    python -m benchmarks.run_benchmarks --output after.json
+    python -m benchmarks.run_benchmarks --compare before.json after.json
+
+Run from the repository root.
+"""
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.synthetic_building_data import generate_building_data
+from src.data_generation.profiling import Profiler
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+CASES = ("environment", "dispatch", "reward", "simulate", "batch_writer", "population", "imports")
+# modules that importing an entry point must not load, they are loaded by the features that use them
+HEAVY_MODULES = ("wandb", "ray", "gym", "scipy")
+# command line entry points checked by the imports case, and the seconds each may take to import
+ENTRY_POINTS = ("runner", "sweep", "create_batch")
+IMPORT_BUDGET_SECONDS = 1.5
+DAY_START = 1
+YEAR = 2016
+
+
+def get_percentiles(latencies, prefix: str, scale: float = 1000.0) -> Dict[str, float]:
+    latencies = np.asarray(latencies, dtype=np.float64) * scale
+    return {
+        f"{prefix}_mean": float(latencies.mean()),
+        f"{prefix}_p50": float(np.percentile(latencies, 50)),
+        f"{prefix}_p90": float(np.percentile(latencies, 90)),
+        f"{prefix}_p99": float(np.percentile(latencies, 99)),
+    }
+
+
+def get_folder_bytes(folder_path) -> int:
+    return sum(file_path.stat().st_size for file_path in Path(folder_path).rglob("*") if file_path.is_file())
+
+
+def get_descriptor(num_prosumers: int, dispatch_solver: str = "slsqp"):
+    from src.data_generation.environment import EnvironmentDataDescriptor
+    # runner's descriptor, for any number of prosumers
+    return EnvironmentDataDescriptor(
+        time_col_idx=1,
+        day_of_week_col_idx=None,
+        price_col_idx=3,
+        solar_gen_col_idx=2,
+        temp_col_idx=None,
+        prosumer_col_idx_list=list(range(4, 4 + num_prosumers)),
+        battery_nums=[50] * num_prosumers,
+        pv_sizes=None,
+        prosumer_noise_scale=0.1,
+        generation_noise_scale=0.1,
+        dispatch_solver=dispatch_solver,
+    )
+
+
+def load_benchmark_environment(building_data_folder, num_prosumers: int, dispatch_solver: str = "slsqp", cache_dir="default"):
+    from src.data_generation.environment_cache import load_environment
+    building_data_folder = Path(building_data_folder)
+    return load_environment(
+        building_data_folder.joinpath(f"building_demand_{YEAR}.csv"),
+        building_data_folder.joinpath("building_metadata.csv"),
+        get_descriptor(num_prosumers, dispatch_solver),
+        cache_dir=building_data_folder.joinpath("compiled") if cache_dir == "default" else cache_dir,
+    )
+
+
+def get_benchmark_prices_generation_function():
+    from src.data_generation import price_generation_functions
+    return price_generation_functions.get_constant_peak_day_prices_generation_function(
+        offset_multiplier=0.1,
+        off_peak_offset_multiplier=0.01,
+    )
+
+
+def benchmark_environment(building_data_folder, num_prosumers: int) -> Dict[str, float]:
+    build_start = time.perf_counter()
+    load_benchmark_environment(building_data_folder, num_prosumers, cache_dir=None)
+    build_seconds = time.perf_counter() - build_start
+    with tempfile.TemporaryDirectory() as cache_dir:
+        compile_start = time.perf_counter()
+        load_benchmark_environment(building_data_folder, num_prosumers, cache_dir=cache_dir)
+        compile_seconds = time.perf_counter() - compile_start
+        load_start = time.perf_counter()
+        mock_environment = load_benchmark_environment(building_data_folder, num_prosumers, cache_dir=cache_dir)
+        load_seconds = time.perf_counter() - load_start
+        compiled_bytes = get_folder_bytes(cache_dir)
+    return {
+        "csv_build_seconds": build_seconds,
+        "compile_seconds": compile_seconds,
+        "compiled_load_seconds": load_seconds,
+        "compiled_bytes": compiled_bytes,
+        "num_days": len(mock_environment.arrays.days),
+    }
+
+
+def benchmark_dispatch(building_data_folder, num_prosumers: int, dispatch_solver: str, num_days: int) -> Dict[str, float]:
+    mock_environment = load_benchmark_environment(building_data_folder, num_prosumers, dispatch_solver)
+    prosumer_fleet = mock_environment.prosumer_fleet
+    prices_generation_function = get_benchmark_prices_generation_function()
+    solve_latencies = []
+    day_latencies = []
+
+    for day in range(DAY_START, DAY_START + num_days):
+        buy_prices, sell_prices = prices_generation_function(day, YEAR, *mock_environment.get_utility_prices(day))
+
+        def solve_chunks(prosumer_slices, chunk_x0s):
+            chunk_solutions = []
+            for prosumer_slice, x0 in zip(prosumer_slices, chunk_x0s):
+                chunk_start = time.perf_counter()
+                chunk_solutions.append(prosumer_fleet.get_chunk_dispatch(prosumer_slice, day, buy_prices, sell_prices, dispatch_solver=dispatch_solver, x0=x0))
+                # batched solvers solve a chunk at once, its latency is shared by the chunk's prosumers
+                num_chunk_prosumers = len(range(*prosumer_slice.indices(num_prosumers)))
+                solve_latencies.extend([(time.perf_counter() - chunk_start) / num_chunk_prosumers] * num_chunk_prosumers)
+            return chunk_solutions
+
+        day_start = time.perf_counter()
+        prosumer_fleet.get_optimal_nets(day, buy_prices, sell_prices, dispatch_solver=dispatch_solver, solve_chunks=solve_chunks)
+        day_latencies.append(time.perf_counter() - day_start)
+
+    dispatch_stats = prosumer_fleet.dispatch_stats
+    return {
+        **get_percentiles(solve_latencies, "solve_ms"),
+        **get_percentiles(day_latencies, "day_ms"),
+        "solves_per_second": len(solve_latencies) / sum(day_latencies),
+        "iterations_per_solve": dispatch_stats["iterations"] / max(dispatch_stats["solves"], 1),
+        "failed_chunks": dispatch_stats["failures"],
+    }
+
+
+def benchmark_reward(building_data_folder, num_prosumers: int, num_steps: int) -> Dict[str, float]:
+    mock_environment = load_benchmark_environment(building_data_folder, num_prosumers)
+    rng = np.random.default_rng(0)
+    days = mock_environment.arrays.days[np.arange(num_steps) % len(mock_environment.arrays.days)]
+    utility_buy_prices, utility_sell_prices = mock_environment.get_utility_prices(days)
+    buy_prices = utility_buy_prices * rng.uniform(0.8, 1.0, utility_buy_prices.shape)
+    sell_prices = utility_sell_prices * rng.uniform(1.0, 1.2, utility_sell_prices.shape)
+    demand = rng.normal(50, 30, (num_steps, num_prosumers, utility_buy_prices.shape[1]))
+
+    call_latencies = []
+    for step_idx, day in enumerate(days):
+        energy_consumptions = dict(zip(mock_environment.prosumer_fleet.names, demand[step_idx]))
+        energy_consumptions["Total"] = demand[step_idx].sum(axis=0)
+        call_start = time.perf_counter()
+        mock_environment.get_reward_twoprices(energy_consumptions, day, buy_prices[step_idx], sell_prices[step_idx])
+        call_latencies.append(time.perf_counter() - call_start)
+
+    batched_start = time.perf_counter()
+    mock_environment.get_rewards_twoprices(demand, days, buy_prices, sell_prices)
+    batched_seconds = time.perf_counter() - batched_start
+    return {
+        **get_percentiles(call_latencies, "call_us", scale=1e6),
+        "calls_per_second": num_steps / sum(call_latencies),
+        "batched_seconds": batched_seconds,
+        "batched_steps_per_second": num_steps / batched_seconds,
+    }
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised by a case whose metrics are over their budget
+    """
+
+    def __init__(self, message: str, metrics: Dict[str, float]):
+        super().__init__(message)
+        self.metrics = metrics
+
+
+class StepTimingProfiler(Profiler):
+    """
+    Marks the start of every simulation step, on top of the usual phase timings
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.step_starts: List[float] = []
+
+    def start_step(self):
+        self.step_starts.append(time.perf_counter())
+        super().start_step()
+
+
+def benchmark_simulate(building_data_folder, num_prosumers: int, num_steps: int, dispatch_solver: str, writer_backend: str) -> Dict[str, float]:
+    from src.data_generation.simulate import SimulationConfig, simulate
+    from src.data_generation.writers import SimulationDataWriter, get_simulation_data_writer
+    mock_environment = load_benchmark_environment(building_data_folder, num_prosumers, dispatch_solver)
+    simulation_config = SimulationConfig(
+        num_simulation_steps=num_steps,
+        day_start=DAY_START,
+        year_start=YEAR,
+        prices_generation_function=get_benchmark_prices_generation_function(),
+        seed=0,
+    )
+    profiler = StepTimingProfiler()
+    with tempfile.TemporaryDirectory() as output_folder:
+        if writer_backend == "per_prosumer_csv":
+            import runner
+            runner.get_simulation_folder_path = lambda folder_name=None: Path(output_folder)
+            write_data = runner.get_save_simulation_data_function()
+        else:
+            write_data = get_simulation_data_writer(writer_backend, output_folder)
+        simulate_start = time.perf_counter()
+        simulate(mock_environment, simulation_config, write_data, accumulate=False, profiler=profiler)
+        if isinstance(write_data, SimulationDataWriter):
+            write_data.close()
+        simulate_end = time.perf_counter()
+        output_bytes = get_folder_bytes(output_folder)
+
+    step_latencies = np.diff(profiler.step_starts + [simulate_end])
+    return {
+        "steps_per_second": num_steps / (simulate_end - simulate_start),
+        **get_percentiles(step_latencies, "step_ms"),
+        "output_bytes": output_bytes,
+        "output_bytes_per_step": output_bytes / num_steps,
+        **{f"phase_{phase_name}_seconds": seconds for phase_name, seconds in profiler.timings.items()},
+    }
+
+
+def benchmark_batch_writer(num_transitions: int, shard_format) -> Dict[str, float]:
+    from src.data_generation.convert_batch import BatchWriter
+    from src.data_generation.utils.constants import DAY_LENGTH
+    rng = np.random.default_rng(0)
+    actions = rng.random((num_transitions, 2 * DAY_LENGTH))
+    observations = rng.random((num_transitions, 3 * DAY_LENGTH))
+    rewards = rng.normal(size=num_transitions)
+    with tempfile.TemporaryDirectory() as output_folder:
+        write_start = time.perf_counter()
+        # shard formats are measured on their own rather than on top of the json format
+        with BatchWriter(output_folder, shard_format=shard_format, write_json=shard_format is None) as batch_writer:
+            for step_idx in range(num_transitions):
+                batch_writer.write_batch(step_idx, actions[step_idx], observations[step_idx], rewards[step_idx])
+        write_seconds = time.perf_counter() - write_start
+        output_bytes = batch_writer.bytes_written
+    return {
+        "transitions_per_second": num_transitions / write_seconds,
+        "output_bytes": output_bytes,
+    }
+
+
+def benchmark_population(building_data_folder, base_prosumers: int, population_size: int, num_steps: int, dispatch_solver: str) -> Dict[str, float]:
+    from src.data_generation.population import generate_prosumer_population
+    from src.data_generation.simulate import SimulationConfig, simulate
+    mock_environment = load_benchmark_environment(building_data_folder, base_prosumers, dispatch_solver)
+    generate_start = time.perf_counter()
+    population_environment = generate_prosumer_population(mock_environment, population_size, seed=0)
+    generate_seconds = time.perf_counter() - generate_start
+    simulation_config = SimulationConfig(
+        num_simulation_steps=num_steps,
+        day_start=DAY_START,
+        year_start=YEAR,
+        prices_generation_function=get_benchmark_prices_generation_function(),
+        seed=0,
+    )
+    profiler = StepTimingProfiler()
+    write_data = lambda simulation_row, prosumer_name, simulation_step_idx: None
+    simulate_start = time.perf_counter()
+    simulate(population_environment, simulation_config, write_data, accumulate=False, profiler=profiler)
+    simulate_end = time.perf_counter()
+
+    step_latencies = np.diff(profiler.step_starts + [simulate_end])
+    return {
+        "generate_seconds": generate_seconds,
+        "steps_per_second": num_steps / (simulate_end - simulate_start),
+        "prosumer_steps_per_second": population_size * num_steps / (simulate_end - simulate_start),
+        **get_percentiles(step_latencies, "step_ms"),
+    }
+
+
+def benchmark_imports(module_name: str, repeats: int, budget_seconds: float) -> Dict[str, float]:
+    """
+    Time importing module_name in fresh interpreters, keeping the fastest of repeats
+    """
+    import_code = (
+        "import json, sys, time\n"
+        "import_start = time.perf_counter()\n"
+        f"import {module_name}\n"
+        "import_seconds = time.perf_counter() - import_start\n"
+        f"print(json.dumps([import_seconds, [name for name in {HEAVY_MODULES!r} if name in sys.modules]]))\n"
+    )
+    import_runs = []
+    for _ in range(repeats):
+        completed = subprocess.run([sys.executable, "-c", import_code], cwd=REPO_PATH, capture_output=True, text=True, check=True)
+        import_runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    import_seconds = [seconds for seconds, _ in import_runs]
+    heavy_modules = sorted({name for _, loaded_names in import_runs for name in loaded_names})
+    metrics = {
+        "import_seconds": min(import_seconds),
+        "import_seconds_max": max(import_seconds),
+        "heavy_modules_loaded": len(heavy_modules),
+    }
+    if heavy_modules:
+        raise BudgetExceeded(f"importing {module_name} loads {', '.join(heavy_modules)}", metrics)
+    if metrics["import_seconds"] > budget_seconds:
+        raise BudgetExceeded(f"importing {module_name} takes {metrics['import_seconds']:.2f}s, over the {budget_seconds:.2f}s budget", metrics)
+    return metrics
+
+
+def get_case_specs(args, data_folders: Dict[int, str]) -> List[Dict]:
+    case_specs = []
+    for num_prosumers in args.num_prosumers:
+        prosumer_case_specs = []
+        if "environment" in args.cases:
+            prosumer_case_specs.append({"case": "environment", "params": {"num_prosumers": num_prosumers}})
+        if "dispatch" in args.cases:
+            prosumer_case_specs.extend(
+                {"case": "dispatch", "params": {"num_prosumers": num_prosumers, "dispatch_solver": dispatch_solver, "num_days": args.dispatch_days}}
+                for dispatch_solver in args.dispatch_solvers
+            )
+        if "reward" in args.cases:
+            prosumer_case_specs.append({"case": "reward", "params": {"num_prosumers": num_prosumers, "num_steps": args.reward_steps}})
+        if "simulate" in args.cases:
+            prosumer_case_specs.extend(
+                {"case": "simulate", "params": {"num_prosumers": num_prosumers, "num_steps": args.num_steps, "dispatch_solver": args.simulate_solver, "writer_backend": writer_backend}}
+                for writer_backend in args.writer_backends
+            )
+        # options such as the data folder are not part of params, so results of different runs can be matched
+        case_specs.extend({**case_spec, "options": {"building_data_folder": data_folders[num_prosumers]}} for case_spec in prosumer_case_specs)
+    if "batch_writer" in args.cases:
+        case_specs.extend(
+            {"case": "batch_writer", "params": {"num_transitions": args.batch_transitions, "shard_format": shard_format}}
+            for shard_format in [None, *args.shard_formats]
+        )
+    if "population" in args.cases:
+        base_prosumers = max(args.num_prosumers)
+        case_specs.extend(
+            {"case": "population", "params": {"base_prosumers": base_prosumers, "population_size": population_size, "num_steps": args.population_steps, "dispatch_solver": args.simulate_solver}, "options": {"building_data_folder": data_folders[base_prosumers]}}
+            for population_size in args.population_sizes
+        )
+    if "imports" in args.cases:
+        case_specs.extend(
+            {"case": "imports", "params": {"module_name": module_name}, "options": {"repeats": args.import_repeats, "budget_seconds": args.import_budget}}
+            for module_name in args.import_modules
+        )
+    return case_specs
+
+
+def run_case(case_spec: Dict) -> Dict:
+    """
+    Run one case in this process, skipping it when an optional dependency it needs is missing
+    """
+    case_functions = {
+        "environment": benchmark_environment,
+        "dispatch": benchmark_dispatch,
+        "reward": benchmark_reward,
+        "simulate": benchmark_simulate,
+        "batch_writer": benchmark_batch_writer,
+        "population": benchmark_population,
+        "imports": benchmark_imports,
+    }
+    case_kwargs = {**case_spec["params"], **case_spec.get("options", {})}
+    case_result = {"case": case_spec["case"], "params": case_spec["params"]}
+    start_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    case_start = time.perf_counter()
+    try:
+        case_result["metrics"] = case_functions[case_spec["case"]](**case_kwargs)
+        case_result["status"] = "ok"
+    except BudgetExceeded as budget_exceeded:
+        case_result["metrics"] = budget_exceeded.metrics
+        case_result["status"] = "over_budget"
+        case_result["reason"] = str(budget_exceeded)
+    except ImportError as import_error:
+        case_result["status"] = "skipped"
+        case_result["reason"] = f"missing dependency: {import_error}"
+    case_result["wall_seconds"] = time.perf_counter() - case_start
+    # ru_maxrss is in kilobytes on Linux
+    case_result["start_rss_mb"] = start_rss_mb
+    case_result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return case_result
+
+
+def run_case_process(case_spec: Dict, timeout=None) -> Dict:
+    with tempfile.NamedTemporaryFile(suffix=".json") as case_output:
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmarks.run_benchmarks", "--case_spec", json.dumps(case_spec), "--case_output", case_output.name],
+            cwd=REPO_PATH,
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+        if completed.returncode != 0:
+            return {
+                "case": case_spec["case"],
+                "params": case_spec["params"],
+                "status": "failed",
+                "reason": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit code {completed.returncode}",
+            }
+        with open(case_output.name) as case_output_file:
+            return json.load(case_output_file)
+
+
+def get_git_commit() -> str:
+    completed = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_PATH, capture_output=True, text=True)
+    return completed.stdout.strip() if completed.returncode == 0 else None
+
+
+def get_environment_info() -> Dict:
+    import pandas as pd
+    import scipy
+    return {
+        "commit": get_git_commit(),
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scipy": scipy.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+def format_case(case_result: Dict) -> str:
+    params = ", ".join(f"{param_name}={value}" for param_name, value in case_result["params"].items())
+    return f"{case_result['case']}({params})"
+
+
+def run_benchmarks(args) -> Dict:
+    with tempfile.TemporaryDirectory() as temp_folder:
+        data_root = Path(args.data_folder or temp_folder)
+        data_folders = {}
+        for num_prosumers in args.num_prosumers:
+            building_data_folder = data_root.joinpath(f"{num_prosumers}_prosumers")
+            if not building_data_folder.joinpath(f"building_demand_{YEAR}.csv").is_file():
+                generate_building_data(building_data_folder, num_prosumers, YEAR)
+            data_folders[num_prosumers] = str(building_data_folder)
+
+        case_results = []
+        for case_spec in get_case_specs(args, data_folders):
+            case_result = run_case_process(case_spec, args.timeout)
+            case_results.append(case_result)
+            if case_result["status"] == "ok":
+                print(f"{format_case(case_result)}: {case_result['wall_seconds']:.2f}s, peak RSS {case_result['peak_rss_mb']:.0f} MB")
+            else:
+                print(f"{format_case(case_result)}: {case_result['status']}, {case_result['reason']}")
+    return {**get_environment_info(), "results": case_results}
+
+
+def is_higher_better(metric_name: str) -> bool:
+    return metric_name.endswith("_per_second")
+
+
+def compare_results(baseline: Dict, current: Dict, threshold: float = 0.1) -> List[str]:
+    """
+    Print every metric of cases present in both results, marking changes beyond threshold
+
+    Returns:
+        the regressed metrics, as "case: metric" strings
+    """
+    print(f"baseline {baseline.get('commit')} ({baseline.get('timestamp')}), current {current.get('commit')} ({current.get('timestamp')})")
+    case_key = lambda case_result: (case_result["case"], json.dumps(case_result["params"], sort_keys=True))
+    baseline_cases = {case_key(case_result): case_result for case_result in baseline["results"] if "metrics" in case_result}
+    regressions = []
+    for case_result in current["results"]:
+        baseline_case = baseline_cases.get(case_key(case_result))
+        if baseline_case is None or "metrics" not in case_result:
+            continue
+        print(format_case(case_result))
+        metrics = {**case_result["metrics"], "peak_rss_mb": case_result["peak_rss_mb"]}
+        baseline_metrics = {**baseline_case["metrics"], "peak_rss_mb": baseline_case["peak_rss_mb"]}
+        for metric_name, value in metrics.items():
+            baseline_value = baseline_metrics.get(metric_name)
+            if baseline_value is None or baseline_value == 0:
+                continue
+            ratio = value / baseline_value
+            change = ratio - 1 if is_higher_better(metric_name) else 1 - ratio
+            if change < -threshold:
+                marker = "REGRESSION"
+                regressions.append(f"{format_case(case_result)}: {metric_name}")
+            elif change > threshold:
+                marker = "improved"
+            else:
+                marker = ""
+            print(f"  {metric_name:<36} {baseline_value:>14.6g} {value:>14.6g} {ratio:>8.3f}x {marker}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=str, nargs="+", default=list(CASES), choices=CASES)
+    parser.add_argument("--num_prosumers", type=int, nargs="+", default=[10, 49])
+    parser.add_argument("--num_steps", type=int, default=30, help="Simulation steps of the simulate case")
+    parser.add_argument("--dispatch_solvers", type=str, nargs="+", default=["lp", "slsqp_warm", "slsqp"])
+    parser.add_argument("--dispatch_days", type=int, default=3, help="Days solved by the dispatch case")
+    parser.add_argument("--simulate_solver", type=str, default="lp", help="Dispatch solver of the simulate case")
+    parser.add_argument("--writer_backends", type=str, nargs="+", default=["csv", "per_prosumer_csv"])
+    parser.add_argument("--reward_steps", type=int, default=1000, help="Steps of the reward case")
+    parser.add_argument("--batch_transitions", type=int, default=1000, help="Transitions written by the batch_writer case")
+    parser.add_argument("--shard_formats", type=str, nargs="*", default=["npy"])
+    parser.add_argument("--population_sizes", type=int, nargs="*", default=[500, 5000], help="Prosumers generated from the largest --num_prosumers by the population case")
+    parser.add_argument("--population_steps", type=int, default=5, help="Simulation steps of the population case")
+    parser.add_argument("--import_modules", type=str, nargs="+", default=list(ENTRY_POINTS), help="Entry points timed by the imports case")
+    parser.add_argument("--import_budget", type=float, default=IMPORT_BUDGET_SECONDS, help="Seconds an entry point may take to import")
+    parser.add_argument("--import_repeats", type=int, default=3)
+    parser.add_argument("--data_folder", type=str, default=None, help="Keeps the synthetic building data between runs, a temporary folder by default")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds after which a case is stopped")
+    parser.add_argument("--output", type=str, default=None, help="JSON file the results are written to")
+    parser.add_argument("--compare", type=str, nargs=2, default=None, metavar=("BASELINE", "CURRENT"), help="Compare two results files instead of running")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported as a regression by --compare")
+    parser.add_argument("--case_spec", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--case_output", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case_spec is not None:
+        with open(args.case_output, "w") as case_output_file:
+            json.dump(run_case(json.loads(args.case_spec)), case_output_file)
+    elif args.compare is not None:
+        with open(args.compare[0]) as baseline_file, open(args.compare[1]) as current_file:
+            regressions = compare_results(json.load(baseline_file), json.load(current_file), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.threshold:.0%}:")
+            print("\n".join(regressions))
+            sys.exit(1)
+    else:
+        benchmark_results = run_benchmarks(args)
+        if args.output is not None:
+            with open(args.output, "w") as output_file:
+                json.dump(benchmark_results, output_file, indent=2)
+            print(f"Results written to {args.output}")
+        if any(case_result["status"] in ("failed", "over_budget") for case_result in benchmark_results["results"]):
+            sys.exit(1)
@@ -0,0 +1,64 @@
+"""
+Synthetic building data in the layout of building_data/building_demand_2016.csv and
+building_data/building_metadata.csv, for any number of prosumers
+
+    python -m benchmarks.synthetic_building_data --out_folder /tmp/building_data --num_prosumers 49
+"""
+import argparse
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+
+def generate_building_data(out_folder, num_prosumers: int, year: int = 2016, seed: int = 0, missing_share: float = 0.001):
+    """
+    Write hourly demand, solar and price data for a year, and building metadata
+
+    Columns follow the real file: an unnamed index, the timestamp, solar generation, the utility price
+    and one "Bldg{i} (kWh)" column per prosumer, so runner's EnvironmentDataDescriptor applies unchanged.
+    A small share of demand values is left missing, as the real data has gaps to interpolate.
+
+    Returns:
+        paths of the demand and metadata csv files
+    """
+    rng = np.random.default_rng(seed)
+    out_folder = Path(out_folder)
+    out_folder.mkdir(parents=True, exist_ok=True)
+    timestamps = pd.date_range(f"{year}-01-01", f"{year}-12-31 23:00", freq="h")
+    hours = timestamps.hour.to_numpy()
+    num_hours = len(timestamps)
+
+    daylight = np.clip(np.sin((hours - 6) / 12 * np.pi), 0, None)
+    solar = daylight * rng.uniform(0.3, 1, num_hours)
+    price = 0.1 + 0.1 * ((hours >= 15) & (hours < 20)) + 0.01 * rng.random(num_hours)
+
+    prosumer_names = [f"Bldg{prosumer_idx} (kWh)" for prosumer_idx in range(num_prosumers)]
+    base_loads = rng.uniform(20, 200, num_prosumers)
+    daily_shape = 1 + 0.3 * np.sin((hours - 8) / 24 * 2 * np.pi)
+    demand = base_loads[None, :] * daily_shape[:, None] + rng.normal(0, 5, (num_hours, num_prosumers))
+    demand[rng.random(demand.shape) < missing_share] = np.nan
+
+    building_data_df = pd.concat([
+        pd.DataFrame({"": np.arange(num_hours), "timestamp": timestamps.astype(str), "solar": solar, "price": price}),
+        pd.DataFrame(demand, columns=prosumer_names),
+    ], axis=1)
+    building_data_path = out_folder.joinpath(f"building_demand_{year}.csv")
+    building_data_df.to_csv(building_data_path, index=False)
+
+    building_metadata_path = out_folder.joinpath("building_metadata.csv")
+    pd.DataFrame({
+        "building_id": prosumer_names,
+        "sqm": rng.uniform(1000, 20000, num_prosumers),
+    }).to_csv(building_metadata_path, index=False)
+    return building_data_path, building_metadata_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out_folder", type=str, required=True)
+    parser.add_argument("--num_prosumers", type=int, default=49)
+    parser.add_argument("--year", type=int, default=2016)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for file_path in generate_building_data(args.out_folder, args.num_prosumers, args.year, args.seed):
+        print(f"Wrote {file_path}")
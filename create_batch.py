@@ -5,50 +5,72 @@ import argparse
 import pandas as pd
 import numpy as np
 from src.data_generation.environment import EnvironmentDataDescriptor, MockEnvironment
+from src.data_generation.environment_cache import load_environment
 from src.data_generation.utils.constants import BATTERY_NUMS, DAY_LENGTH, DAY_START, NUM_PROSUMERS, YEAR_LENGTH
-from src.data_generation.convert_batch import BatchWriter
-from src.data_generation.simulate import get_observation
+from src.data_generation.convert_batch import BatchWriter, SHARD_FORMATS
+from src.data_generation.writers import SimulationDataWriter, read_simulation_data
 
 
-def create_batch(dfs : list[pd.DataFrame],  mock_environment : MockEnvironment, batch_writer : BatchWriter):
-    
-    
-    # Extract and normalize the buy, sell, and prosumer cols
-    sentinel_df = dfs[0]
-    sentinel_cols = sentinel_df.columns.to_list()
-    
-    buy_price_cols = [x for x in sentinel_cols if "agent_buy" in x]
-    sell_price_cols = [x for x in sentinel_cols if "agent_sell" in x]
-    prosumer_demand_cols = [x for x in sentinel_cols if "prosumer_response" in x]
-    for simulation_step_idx in range(sentinel_df.shape[0]):
-        
-        if simulation_step_idx != sentinel_df.loc[simulation_step_idx, "step"]:
-            print("misaligned batch data generation")
-        
-        simulate_day = sentinel_df.loc[simulation_step_idx, "day"]
-        
-        microgrid_buy_prices = sentinel_df.loc[simulation_step_idx, buy_price_cols].values
-        microgrid_sell_prices = sentinel_df.loc[simulation_step_idx, sell_price_cols].values
-
-        total_demand = np.zeros(DAY_LENGTH, dtype=np.float64)
-        for df in dfs:
-            prosumer_demand = np.array(df.loc[simulation_step_idx, prosumer_demand_cols], dtype=np.float64)
-            total_demand+=prosumer_demand
-        
-        step_reward = sentinel_df.loc[simulation_step_idx, "reward"]
-        
-        batch_writer.write_batch(
-            simulation_step_idx, 
-            np.concatenate([microgrid_buy_prices, microgrid_sell_prices]),
-            get_observation(
-                total_demand,
-                mock_environment.hourly_solar_constants.loc[simulate_day, :].values,
-                mock_environment.utility_hourly_buy_prices.loc[simulate_day, :].values,  
-            ),
-            step_reward,
-        )
-
-def setup():
+def get_run_arrays(simulation_data_df : pd.DataFrame):
+    """
+    Reshape a consolidated simulation table into arrays
+
+    Returns:
+        steps: (steps,), days: (steps,), buy_prices and sell_prices: (steps, DAY_LENGTH),
+        rewards: (steps,), prosumer_demand: (num_prosumers, steps, DAY_LENGTH)
+    """
+    columns = simulation_data_df.columns.to_list()
+    buy_price_cols = [x for x in columns if "agent_buy" in x]
+    sell_price_cols = [x for x in columns if "agent_sell" in x]
+    prosumer_demand_cols = [x for x in columns if "prosumer_response" in x]
+
+    simulation_data_df = simulation_data_df.sort_values(["prosumer_name", "step"], kind="stable")
+    num_prosumers = simulation_data_df["prosumer_name"].nunique()
+    num_steps = len(simulation_data_df) // num_prosumers
+
+    # every prosumer shares prices, days and rewards, so take them from the first prosumer
+    sentinel_df = simulation_data_df.iloc[:num_steps]
+    steps = sentinel_df["step"].to_numpy()
+    if not np.array_equal(steps, np.arange(num_steps)):
+        print("misaligned batch data generation")
+
+    prosumer_demand = simulation_data_df[prosumer_demand_cols].to_numpy(dtype=np.float64).reshape(num_prosumers, num_steps, DAY_LENGTH)
+    return (
+        steps,
+        sentinel_df["day"].to_numpy(),
+        sentinel_df[buy_price_cols].to_numpy(dtype=np.float64),
+        sentinel_df[sell_price_cols].to_numpy(dtype=np.float64),
+        sentinel_df["reward"].to_numpy(dtype=np.float64),
+        prosumer_demand,
+    )
+
+
+def create_batch(simulation_data_df : pd.DataFrame,  mock_environment : MockEnvironment, batch_writer : BatchWriter, step_rewards=None, utility_hourly_buy_prices=None):
+    """
+    Write the run's steps as batch data, with step_rewards in place of the stored rewards when given
+
+    Args:
+        utility_hourly_buy_prices: (steps, DAY_LENGTH) utility buy prices observed at each step, such as those of the
+            tariff step_rewards were computed with, defaults to the environment's
+    """
+    steps, days, microgrid_buy_prices, microgrid_sell_prices, stored_rewards, prosumer_demand = get_run_arrays(simulation_data_df)
+    if step_rewards is None:
+        step_rewards = stored_rewards
+    total_demand = prosumer_demand.sum(axis=0)
+
+    day_rows = mock_environment.arrays.get_day_rows(days)
+    hourly_solar_constants = mock_environment.arrays.hourly_solar_constants[day_rows]
+    if utility_hourly_buy_prices is None:
+        utility_hourly_buy_prices = mock_environment.arrays.utility_hourly_buy_prices[day_rows]
+
+    batch_writer.write_batches(
+        steps,
+        np.concatenate([microgrid_buy_prices, microgrid_sell_prices], axis=1),
+        np.concatenate([total_demand, hourly_solar_constants, utility_hourly_buy_prices], axis=1).astype(np.float32),
+        step_rewards,
+    )
+
+def setup(environment_cache_dir="./building_data/compiled"):
     
     # build environment
     environment_data_descriptor = EnvironmentDataDescriptor(
@@ -63,35 +85,50 @@ def setup():
         prosumer_noise_scale=None,
         generation_noise_scale=None,
     )
-    building_data_df = pd.read_csv("./building_data/building_demand_2016.csv").interpolate().fillna(0)
-    building_metadata_df =  pd.read_csv("./building_data/building_metadata.csv", index_col="building_id")
-    mock_environment = MockEnvironment(
-        building_data_df=building_data_df,
-        building_metadata_df=building_metadata_df,
-        environment_data_descriptor=environment_data_descriptor,
+    mock_environment = load_environment(
+        "./building_data/building_demand_2016.csv",
+        "./building_data/building_metadata.csv",
+        environment_data_descriptor,
+        cache_dir=environment_cache_dir,
     )
+    print(mock_environment.timing_report())
     return mock_environment
 
-def get_dataframes(folder_name, run_folder_name):
-    # Get all dataframes
+def get_simulation_data(folder_name, run_folder_name):
+    # Read the whole run as one table
     folder_path = Path("simulated_data").joinpath(folder_name).joinpath(run_folder_name)
     data_files = [p for p in folder_path.iterdir() if p.is_file()]
-    dfs = [pd.read_csv(data_file) for data_file in data_files]
-    return dfs
+    consolidated_files = [p for p in data_files if p.stem == SimulationDataWriter.file_name]
+    if consolidated_files:
+        return read_simulation_data(consolidated_files[0])
+    # older runs wrote one csv per prosumer, next to the checkpoint files of checkpointed runs
+    return pd.concat([pd.read_csv(data_file, index_col=0) for data_file in data_files if data_file.suffix == ".csv"], ignore_index=True)
+
+def get_dataframes(folder_name, run_folder_name):
+    # Get all dataframes, one per prosumer
+    simulation_data_df = get_simulation_data(folder_name, run_folder_name)
+    return [
+        prosumer_df.reset_index(drop=True)
+        for _, prosumer_df in simulation_data_df.groupby("prosumer_name", sort=False)
+    ]
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--folder_name", type=str)
     parser.add_argument("--run_folder_name", type=str)
+    parser.add_argument("--transitions_per_batch", type=int, default=1)
+    parser.add_argument("--environment_cache_dir", type=lambda path: None if path == "None" else path, default="./building_data/compiled")
+    parser.add_argument("--shard_format", type=str, default=None, choices=SHARD_FORMATS)
 
     args = parser.parse_args()
     
-    dfs = get_dataframes(args.folder_name, args.run_folder_name)
+    simulation_data_df = get_simulation_data(args.folder_name, args.run_folder_name)
     
-    mock_environment = setup()
-    
-    batch_writer = BatchWriter(
-        f"./batch_data/{args.folder_name}"
-    )
+    mock_environment = setup(args.environment_cache_dir)
     
-    create_batch(dfs, mock_environment, batch_writer)
+    with BatchWriter(
+        f"./batch_data/{args.folder_name}",
+        transitions_per_batch=args.transitions_per_batch,
+        shard_format=args.shard_format,
+    ) as batch_writer:
+        create_batch(simulation_data_df, mock_environment, batch_writer)
@@ -0,0 +1,91 @@
+# Recompute the rewards of an existing run under another reward formula or utility tariff, without simulating it again
+from pathlib import Path
+import argparse
+import pandas as pd
+from create_batch import create_batch, get_run_arrays, get_simulation_data, setup
+from runner import explicit_bool
+from src.data_generation.environment import MockEnvironment
+from src.data_generation.convert_batch import BatchWriter, SHARD_FORMATS
+from src.data_generation.rewards import REWARD_COMPONENTS, REWARD_FORMULAS, get_twoprices_rewards, get_utility_tariff
+from src.data_generation.utils.constants import UTILITY_SELL_RATIO
+
+REWARDS_FOLDER_NAME = "reevaluated_rewards"
+
+
+def get_run_tariff(mock_environment: MockEnvironment, days, utility_buy_price_multiplier=1.0, utility_sell_ratio=UTILITY_SELL_RATIO):
+    """
+    (steps, DAY_LENGTH) utility buy and sell prices of the tariff on each of days
+    """
+    return get_utility_tariff(
+        mock_environment.arrays.utility_hourly_buy_prices[mock_environment.arrays.get_day_rows(days)],
+        utility_buy_price_multiplier,
+        utility_sell_ratio,
+    )
+
+
+def reevaluate_rewards(simulation_data_df: pd.DataFrame, mock_environment: MockEnvironment, reward_formula="twoprices", utility_buy_price_multiplier=1.0, utility_sell_ratio=UTILITY_SELL_RATIO) -> pd.DataFrame:
+    """
+    Rewards of every step of a run, recomputed from its stored prices and prosumer responses in one vectorized pass
+
+    Returns:
+        table of step, day, the stored reward, the new reward and the reward components it was computed from
+    """
+    steps, days, microgrid_buy_prices, microgrid_sell_prices, stored_rewards, prosumer_demand = get_run_arrays(simulation_data_df)
+    buyprice_grid, sellprice_grid = get_run_tariff(mock_environment, days, utility_buy_price_multiplier, utility_sell_ratio)
+    reward_components = dict(zip(REWARD_COMPONENTS, get_twoprices_rewards(
+        prosumer_demand.transpose(1, 0, 2),
+        buyprice_grid,
+        sellprice_grid,
+        microgrid_buy_prices,
+        microgrid_sell_prices,
+    )))
+    return pd.DataFrame({
+        "step": steps,
+        "day": days,
+        "stored_reward": stored_rewards,
+        "reward": REWARD_FORMULAS[reward_formula](**reward_components),
+        **reward_components,
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folder_name", type=str)
+    parser.add_argument("--run_folder_name", type=str)
+    parser.add_argument("--reward_formula", type=str, default="twoprices", choices=list(REWARD_FORMULAS))
+    parser.add_argument("--utility_buy_price_multiplier", type=float, default=1.0, help="Scales the utility buy prices of the building data")
+    parser.add_argument("--utility_sell_ratio", type=float, default=UTILITY_SELL_RATIO, help="Utility sell prices as a share of its buy prices")
+    parser.add_argument("--output_name", type=str, default=None, help="Name of the rewards file written to the run's reevaluated_rewards folder, defaults to the reward formula")
+    parser.add_argument("--generate_batch_data", type=lambda bool_arg: explicit_bool(parser, bool_arg, nonable=False), default=False, help="Also write the run's batch data with the new rewards")
+    parser.add_argument("--transitions_per_batch", type=int, default=1)
+    parser.add_argument("--shard_format", type=str, default=None, choices=SHARD_FORMATS)
+    parser.add_argument("--environment_cache_dir", type=lambda path: None if path == "None" else path, default="./building_data/compiled")
+
+    args = parser.parse_args()
+    output_name = args.output_name or args.reward_formula
+
+    simulation_data_df = get_simulation_data(args.folder_name, args.run_folder_name)
+
+    mock_environment = setup(args.environment_cache_dir)
+
+    rewards_df = reevaluate_rewards(
+        simulation_data_df,
+        mock_environment,
+        args.reward_formula,
+        args.utility_buy_price_multiplier,
+        args.utility_sell_ratio,
+    )
+    rewards_path = Path("simulated_data").joinpath(args.folder_name, args.run_folder_name, REWARDS_FOLDER_NAME, f"{output_name}.csv")
+    rewards_path.parent.mkdir(parents=True, exist_ok=True)
+    rewards_df.to_csv(rewards_path, index=False)
+    print(f"Wrote {len(rewards_df)} rewards to {rewards_path}, total reward {rewards_df['reward'].sum():.6g} (stored {rewards_df['stored_reward'].sum():.6g})")
+
+    if args.generate_batch_data:
+        with BatchWriter(
+            f"./batch_data/{args.folder_name}-{output_name}",
+            transitions_per_batch=args.transitions_per_batch,
+            shard_format=args.shard_format,
+        ) as batch_writer:
+            # observations show the tariff the new rewards were computed with
+            buyprice_grid, _ = get_run_tariff(mock_environment, rewards_df["day"].to_numpy(), args.utility_buy_price_multiplier, args.utility_sell_ratio)
+            create_batch(simulation_data_df, mock_environment, batch_writer, rewards_df["reward"].to_numpy(), buyprice_grid)
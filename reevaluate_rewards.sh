@@ -0,0 +1,6 @@
+which python3
+python3 reevaluate_rewards.py \
+	--folder_name reward_evaluation_new \
+	--run_folder_name "2023-01-21 00h 54m 12s" \
+	--reward_formula twoprices \
+	--utility_sell_ratio 0.6
@@ -1,24 +1,37 @@
-import wandb
 import argparse
+import json
 import pandas as pd
 from typing import Callable
-from data_generation.utils.constants import BATTERY_NUMS, DAY_START, NUM_PROSUMERS, YEAR_START
+from src.data_generation.utils.constants import BATTERY_NUMS, DAY_START, NUM_PROSUMERS, YEAR_START
 from src.data_generation.environment import EnvironmentDataDescriptor, MockEnvironment
+from src.data_generation.environment_cache import load_environment
+from src.data_generation.population import generate_prosumer_population
 from src.data_generation.simulate import SimulationConfig, simulate
 from src.data_generation import price_generation_functions
-from src.data_generation.convert_batch import BatchWriter
+from src.data_generation.dispatch import DISPATCH_SOLVERS
+from src.data_generation.convert_batch import BatchWriter, SHARD_FORMATS
+from src.data_generation.response_cache import ResponseCache
+from src.data_generation.profiling import NULL_PROFILER, Profiler
+from src.data_generation.checkpoint import CHECKPOINT_NAME, SimulationCheckpointer
+from src.data_generation.step_logger import AsyncStepLogger, LOG_POLICIES, get_active_wandb
+from src.data_generation.writers import SimulationDataWriter, WRITER_BACKENDS, get_simulation_data_writer
 
 from os.path import exists
 
 from typing import Dict
 from pathlib import Path
 import time
+import cProfile
 
+RUN_ARGS_NAME = "run_args.json"
 
-def get_save_simulation_data_function(no_save=False, folder_name=None):
+def get_simulation_folder_path(folder_name=None):
     timestr = time.strftime("%Y-%m-%d %Hh %Mm %Ss")
     specific_folder_path = f"{folder_name}/{timestr}" if folder_name else timestr
-    folder_path = Path(f"./simulated_data/{specific_folder_path}")
+    return Path(f"./simulated_data/{specific_folder_path}")
+
+def get_save_simulation_data_function(no_save=False, folder_name=None, folder_path=None):
+    folder_path = get_simulation_folder_path(folder_name) if folder_path is None else Path(folder_path)
     if not no_save:
         folder_path.mkdir(parents=True, exist_ok=True)
     
@@ -35,9 +48,8 @@ def get_save_simulation_data_function(no_save=False, folder_name=None):
     return save_simulation_data
         
 
-def run(folder_name: str, price_generation_function: Callable, no_save=False, generate_batch_data=False, prosumer_noise_scale=0.1, generation_noise_scale=0.1, num_simulation_steps=1000):
-    # build environment
-    environment_data_descriptor = EnvironmentDataDescriptor(
+def get_environment_data_descriptor(prosumer_noise_scale=0.1, generation_noise_scale=0.1, dispatch_solver="slsqp"):
+    return EnvironmentDataDescriptor(
         time_col_idx=1,
         day_of_week_col_idx=None,
         price_col_idx=3,
@@ -48,14 +60,29 @@ def run(folder_name: str, price_generation_function: Callable, no_save=False, ge
         pv_sizes=None,
         prosumer_noise_scale=prosumer_noise_scale,
         generation_noise_scale=generation_noise_scale,
+        dispatch_solver=dispatch_solver,
     )
-    building_data_df = pd.read_csv("./building_data/building_demand_2016.csv").interpolate().fillna(0)
-    building_metadata_df =  pd.read_csv("./building_data/building_metadata.csv", index_col="building_id")
-    mock_environment = MockEnvironment(
-        building_data_df=building_data_df,
-        building_metadata_df=building_metadata_df,
-        environment_data_descriptor=environment_data_descriptor,
+
+def load_building_environment(environment_data_descriptor: EnvironmentDataDescriptor, environment_cache_dir="./building_data/compiled") -> MockEnvironment:
+    return load_environment(
+        "./building_data/building_demand_2016.csv",
+        "./building_data/building_metadata.csv",
+        environment_data_descriptor,
+        cache_dir=environment_cache_dir,
     )
+
+def run(folder_name: str, price_generation_function: Callable, no_save=False, generate_batch_data=False, prosumer_noise_scale=0.1, generation_noise_scale=0.1, num_simulation_steps=1000, dispatch_solver="slsqp", workers=1, backend="serial", response_cache_size=0, response_cache_path=None, writer_backend="csv", writer_chunk_size=4096, transitions_per_batch=1, shard_format=None, environment_cache_dir="./building_data/compiled", seed=None, profile=False, profile_output=None, log_policy="block", log_queue_size=1024, checkpoint_every=0, resume_path=None, run_args=None, num_prosumers=None, population_seed=0):
+    # build environment
+    mock_environment = load_building_environment(
+        get_environment_data_descriptor(prosumer_noise_scale, generation_noise_scale, dispatch_solver),
+        environment_cache_dir,
+    )
+    if num_prosumers is not None:
+        mock_environment = generate_prosumer_population(mock_environment, num_prosumers, seed=population_seed)
+    print(mock_environment.timing_report())
+    profiler = Profiler() if profile or profile_output is not None else NULL_PROFILER
+    for phase_name, seconds in mock_environment.construction_timings.items():
+        profiler.add_time(f"setup/{phase_name}", seconds)
     
     # build simulation
     simulation_config = SimulationConfig(
@@ -63,22 +90,100 @@ def run(folder_name: str, price_generation_function: Callable, no_save=False, ge
         day_start=DAY_START,
         year_start=YEAR_START,
         prices_generation_function=price_generation_function,
+        seed=seed,
     )
     
+    # a resumed run continues writing into its own folder
+    folder_path = Path(resume_path) if resume_path is not None else get_simulation_folder_path(folder_name)
+    batch_data_path = Path(f"./batch_data/{folder_name}")
+    if resume_path is not None and not folder_path.joinpath(CHECKPOINT_NAME).is_file():
+        raise ValueError(f"No checkpoint to resume from in {folder_path}, runs are only checkpointed with --checkpoint_every")
+    if checkpoint_every > 0:
+        if no_save:
+            raise ValueError("Checkpointed runs must save their simulation data")
+        # created before the writers, see SimulationCheckpointer
+        checkpointer = SimulationCheckpointer(
+            folder_path.joinpath(CHECKPOINT_NAME),
+            [folder_path] + ([batch_data_path] if generate_batch_data else []),
+            checkpoint_every,
+        )
+        if run_args is not None and resume_path is None:
+            # the arguments a resumed run is continued with
+            folder_path.mkdir(parents=True, exist_ok=True)
+            with open(folder_path.joinpath(RUN_ARGS_NAME), "w") as run_args_file:
+                json.dump(run_args, run_args_file, indent=2)
+    else:
+        checkpointer = None
+    
     print(f"Is generating batch data: {generate_batch_data}")
     if generate_batch_data:
         batch_writer = BatchWriter(
-            f"./batch_data/{folder_name}"
+            batch_data_path,
+            transitions_per_batch=transitions_per_batch,
+            shard_format=shard_format,
         )
     else:
         batch_writer = None
     
-    simulate(
-        mock_environment=mock_environment,
-        simulation_config=simulation_config,
-        write_data=get_save_simulation_data_function(folder_name=folder_name, no_save=no_save),
-        batch_writer=batch_writer,
-    )
+    if response_cache_size > 0 or response_cache_path is not None:
+        response_cache = ResponseCache(max_entries=response_cache_size, disk_path=response_cache_path)
+        mock_environment.prosumer_fleet.set_response_cache(response_cache)
+    else:
+        response_cache = None
+    
+    if no_save:
+        write_data = lambda simulation_row, prosumer_name, simulation_step_idx: None
+    elif writer_backend == "per_prosumer_csv":
+        write_data = get_save_simulation_data_function(folder_path=folder_path)
+    else:
+        folder_path.mkdir(parents=True, exist_ok=True)
+        write_data = get_simulation_data_writer(writer_backend, folder_path, writer_chunk_size)
+    
+    wandb = get_active_wandb()
+    if wandb is not None:
+        step_logger = AsyncStepLogger(wandb.log, max_queue_size=log_queue_size, policy=log_policy)
+    else:
+        step_logger = None
+    
+    cprofile = cProfile.Profile() if profile_output is not None else None
+    try:
+        if cprofile is not None:
+            cprofile.enable()
+        simulate(
+            mock_environment=mock_environment,
+            simulation_config=simulation_config,
+            write_data=write_data,
+            batch_writer=batch_writer,
+            workers=workers,
+            backend=backend,
+            accumulate=False,
+            profiler=profiler,
+            step_logger=step_logger,
+            checkpointer=checkpointer,
+        )
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+        with profiler.phase("close_writers"):
+            if isinstance(write_data, SimulationDataWriter):
+                write_data.close()
+                profiler.count("simulation_data_bytes", write_data.bytes_written)
+            if batch_writer is not None:
+                batch_writer.close()
+                profiler.count("batch_data_bytes", batch_writer.bytes_written)
+        if step_logger is not None:
+            with profiler.phase("close_step_logger"):
+                step_logger.close()
+            print(step_logger.report())
+        if response_cache is not None:
+            print(response_cache.report())
+            response_cache.close()
+        if profiler is not NULL_PROFILER:
+            print(mock_environment.prosumer_fleet.dispatch_report())
+            print(profiler.report())
+        if cprofile is not None:
+            cprofile.dump_stats(profile_output)
+            print(f"cProfile stats written to {profile_output}, inspect them with python -m pstats")
 
 def explicit_bool(parser, arg, nonable=False):
     if arg == "None" and nonable:
@@ -110,6 +215,25 @@ if __name__ == "__main__":
     parser.add_argument("--prosumer_noise_scale", type=float, default=0.1)
     parser.add_argument("--generation_noise_scale", type=float, default=0.1)
     parser.add_argument("--num_simulation_steps", type=int, default=1000)
+    parser.add_argument("--dispatch_solver", type=str, default="slsqp", choices=list(DISPATCH_SOLVERS))
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--backend", type=str, default="serial", choices=["serial", "process"])
+    parser.add_argument("--response_cache_size", type=int, default=0, help="Entries kept in the in-memory response cache, 0 disables it")
+    parser.add_argument("--response_cache_path", type=str, default=None, help="sqlite file persisting prosumer responses across runs")
+    parser.add_argument("--writer_backend", type=str, default="csv", choices=["per_prosumer_csv", *WRITER_BACKENDS])
+    parser.add_argument("--writer_chunk_size", type=int, default=4096, help="Rows buffered before the writer flushes to disk")
+    parser.add_argument("--environment_cache_dir", type=lambda path: None if path == "None" else path, default="./building_data/compiled", help="Folder of compiled building data, None to always parse the CSVs")
+    parser.add_argument("--transitions_per_batch", type=int, default=1, help="Transitions per SampleBatch written as batch data")
+    parser.add_argument("--shard_format", type=str, default=None, choices=SHARD_FORMATS, help="Also write batch data as binary shards")
+    parser.add_argument("--seed", type=int, default=None, help="Seeds prices and noise of the run, results then match for any workers or backend")
+    parser.add_argument("--profile", type=lambda bool_arg: explicit_bool(parser, bool_arg, nonable=False), default=False, help="Print a table of time spent per phase and dispatch counters")
+    parser.add_argument("--profile_output", type=str, default=None, help="Also write cProfile stats of the simulation to this file")
+    parser.add_argument("--log_policy", type=str, default="block", choices=LOG_POLICIES, help="What wandb step logging does when its queue is full: wait for room, or drop the step")
+    parser.add_argument("--log_queue_size", type=int, default=1024, help="Steps queued for wandb logging before --log_policy applies")
+    parser.add_argument("--checkpoint_every", type=int, default=0, help="Steps between checkpoints of the run's state, 0 disables checkpoints. Needs the csv or per_prosumer_csv writer")
+    parser.add_argument("--num_prosumers", type=int, default=None, help="Simulate this many prosumers, resampled from the real buildings, instead of the real buildings alone")
+    parser.add_argument("--population_seed", type=int, default=0, help="Seeds the prosumers generated for --num_prosumers")
+    parser.add_argument("--resume", type=str, default=None, help="Folder of a checkpointed run to continue from its last checkpoint, with the arguments it was started with")
     # Logging Arguments
     parser.add_argument(
         "-w",
@@ -119,8 +243,13 @@ if __name__ == "__main__":
         default=False,
     )
     args = parser.parse_args()
+    if args.resume is not None:
+        with open(Path(args.resume).joinpath(RUN_ARGS_NAME)) as run_args_file:
+            # defaults cover arguments added after the run was started
+            args = argparse.Namespace(**{**vars(parser.parse_args([])), **json.load(run_args_file), "resume": args.resume})
     # Uploading logs to wandb
     if args.wandb:
+        import wandb
         wandb.init(project="data-generation", entity="market-maker")
         wandb.run.name = f"({args.offset_multiplier},{args.num_simulation_steps}){args.price_generation_function}-{wandb.run.name}--{args.folder_name}"
         wandb.config.update(args)
@@ -133,4 +262,24 @@ if __name__ == "__main__":
         args.prosumer_noise_scale,
         args.generation_noise_scale,
         args.num_simulation_steps,
+        args.dispatch_solver,
+        args.workers,
+        args.backend,
+        args.response_cache_size,
+        args.response_cache_path,
+        args.writer_backend,
+        args.writer_chunk_size,
+        args.transitions_per_batch,
+        args.shard_format,
+        args.environment_cache_dir,
+        args.seed,
+        args.profile,
+        args.profile_output,
+        args.log_policy,
+        args.log_queue_size,
+        args.checkpoint_every,
+        args.resume,
+        vars(args),
+        args.num_prosumers,
+        args.population_seed,
     )
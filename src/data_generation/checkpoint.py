@@ -0,0 +1,137 @@
+import os
+import pickle
+import numpy as np
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+CHECKPOINT_NAME = "checkpoint.pkl"
+
+
+@dataclass
+class SimulationCheckpoint:
+    next_step: int # first step not yet simulated
+    seed: Optional[int] # SimulationConfig.seed of the run
+    rng_entropy: Optional[int] # SimulationRNG.seed of the run, drawn from np.random for runs without a seed
+    total_reward: float
+    np_random_state: Tuple # global np.random state, drawn from by price functions without an rng parameter
+    fleet_state: Dict
+    write_data_state: Optional[Dict]
+    batch_writer_state: Optional[Dict]
+    file_sizes: Dict[str, int] # size of every output file
+
+
+def get_file_sizes(output_paths) -> Dict[str, int]:
+    return {
+        str(file_path): file_path.stat().st_size
+        for output_path in output_paths
+        for file_path in Path(output_path).rglob("*")
+        if file_path.is_file() and not file_path.name.startswith(CHECKPOINT_NAME)
+    }
+
+
+def truncate_output(output_paths, file_sizes: Dict[str, int], stale_files):
+    """
+    Return output files to file_sizes, removing the stale_files missing from it and folders left empty
+    """
+    for output_path in output_paths:
+        for file_path in Path(output_path).rglob("*"):
+            if not file_path.is_file() or file_path.name.startswith(CHECKPOINT_NAME):
+                continue
+            if str(file_path) in file_sizes:
+                os.truncate(file_path, file_sizes[str(file_path)])
+            elif str(file_path) in stale_files:
+                file_path.unlink()
+        # deepest first, so that folders emptied by removing their subfolders are removed too
+        for folder_path in sorted(Path(output_path).rglob("*"), key=lambda path: len(path.parts), reverse=True):
+            if folder_path.is_dir() and not any(folder_path.iterdir()):
+                folder_path.rmdir()
+
+
+def get_write_data_state(write_data) -> Optional[Dict]:
+    """
+    State of a SimulationDataWriter, None for write_data functions that write every row as it comes
+    """
+    if not hasattr(write_data, "get_state"):
+        return None
+    if not write_data.supports_resume:
+        raise ValueError(f"{type(write_data).__name__} files cannot be truncated, checkpointed runs need the csv writer backend")
+    return write_data.get_state()
+
+
+class SimulationCheckpointer:
+    """
+    Saves the state of a simulate run every checkpoint_every steps, and restores it to resume the run
+
+    A checkpoint holds everything later steps depend on: the entropy of the run's random streams, the global
+    np.random state, the fleet's warm starts, the running total reward, the buffered rows of write_data and the
+    pending transitions of the batch writer, along with the size of every file in output_paths. Restoring truncates those files to their checkpointed
+    size and removes files created after the checkpoint, so a resumed run writes the same output as a run
+    that was never interrupted. Only files that already existed when the checkpointer was created are removed,
+    so it must be created before the run's writers, which may open their files right away.
+
+    Args:
+        checkpoint_path: file the checkpoint is written to, replaced atomically
+        output_paths: folders written by the run's write_data and batch writer
+        checkpoint_every: steps between checkpoints, the last step of a run is always checkpointed
+    """
+
+    def __init__(self, checkpoint_path, output_paths: List, checkpoint_every: int = 100):
+        self.checkpoint_path = Path(checkpoint_path)
+        self.output_paths = [Path(output_path) for output_path in output_paths]
+        self.checkpoint_every = checkpoint_every
+        # files left by an interrupted run, the only files restore may remove
+        self.stale_files = set(get_file_sizes(self.output_paths))
+
+    def load(self) -> Optional[SimulationCheckpoint]:
+        if not self.checkpoint_path.is_file():
+            return None
+        with open(self.checkpoint_path, "rb") as checkpoint_file:
+            return pickle.load(checkpoint_file)
+
+    def is_due(self, next_step: int, num_simulation_steps: int) -> bool:
+        return next_step % self.checkpoint_every == 0 or next_step == num_simulation_steps
+
+    def save(self, next_step: int, seed: Optional[int], total_reward: float, mock_environment, write_data, batch_writer=None, simulation_rng=None):
+        checkpoint = SimulationCheckpoint(
+            next_step=next_step,
+            seed=seed,
+            rng_entropy=simulation_rng.seed if simulation_rng is not None else None,
+            total_reward=total_reward,
+            np_random_state=np.random.get_state(),
+            fleet_state=mock_environment.prosumer_fleet.get_state(),
+            write_data_state=get_write_data_state(write_data),
+            batch_writer_state=batch_writer.get_state() if batch_writer is not None else None,
+            file_sizes=get_file_sizes(self.output_paths),
+        )
+        # replace atomically, a run killed while checkpointing must leave the previous checkpoint behind
+        tmp_path = self.checkpoint_path.with_name(f"{self.checkpoint_path.name}.tmp")
+        with open(tmp_path, "wb") as checkpoint_file:
+            pickle.dump(checkpoint, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def restore(self, seed: Optional[int], mock_environment, write_data, batch_writer=None, simulation_rng=None) -> Tuple[int, float]:
+        """
+        Return the run's output and state to the last checkpoint, write_data and batch_writer must be fresh,
+        simulation_rng continues with the checkpointed run's entropy
+
+        Returns:
+            the step to continue from and the total reward so far, (0, 0) when there is no checkpoint yet
+        """
+        # fails before anything is truncated when write_data cannot be resumed
+        get_write_data_state(write_data)
+        checkpoint = self.load()
+        if checkpoint is None:
+            return 0, 0
+        if checkpoint.seed != seed:
+            raise ValueError(f"Checkpoint was taken with seed {checkpoint.seed}, cannot resume with seed {seed}")
+        truncate_output(self.output_paths, checkpoint.file_sizes, self.stale_files)
+        np.random.set_state(checkpoint.np_random_state)
+        if simulation_rng is not None and checkpoint.rng_entropy is not None:
+            simulation_rng.seed = checkpoint.rng_entropy
+        mock_environment.prosumer_fleet.set_state(checkpoint.fleet_state)
+        if checkpoint.write_data_state is not None:
+            write_data.set_state(checkpoint.write_data_state)
+        if batch_writer is not None and checkpoint.batch_writer_state is not None:
+            batch_writer.set_state(checkpoint.batch_writer_state)
+        return checkpoint.next_step, checkpoint.total_reward
@@ -1,20 +1,186 @@
-import gym
 import numpy as np
 import os
+from pathlib import Path
+from typing import Dict, Iterator, List
 
-import ray._private.utils
+from .utils.constants import DAY_LENGTH
 
-from ray.rllib.models.preprocessors import get_preprocessor
-from ray.rllib.evaluation.sample_batch_builder import SampleBatchBuilder
-from ray.rllib.offline.json_writer import JsonWriter
+# dtype of every column stored in binary shards
+SHARD_COLUMN_DTYPES = {
+    "t": np.int64,
+    "eps_id": np.int64,
+    "agent_index": np.int64,
+    "obs": np.float32,
+    "actions": np.float32,
+    "action_prob": np.float32,
+    "action_logp": np.float32,
+    "rewards": np.float32,
+    "prev_actions": np.float32,
+    "prev_rewards": np.float32,
+    "dones": np.bool_,
+    "new_obs": np.float32,
+}
+SHARD_FORMATS = ("npy", "npz", "parquet")
+
+
+class ShardWriter:
+    """
+    Writes transitions as columnar binary shards, starting a new shard once max_shard_bytes are buffered
+
+    Formats:
+        npy: one directory per shard holding a .npy file per column, memory-mappable by read_shards
+        npz: one compressed .npz file per shard
+        parquet: one parquet file per shard, vector columns flattened into float32 columns
+    """
+
+    def __init__(self, out_path, shard_format="npy", max_shard_bytes=64 * 1024 * 1024):
+        if shard_format not in SHARD_FORMATS:
+            raise ValueError(f"Unknown shard format {shard_format}, expected one of {SHARD_FORMATS}")
+        self.out_path = Path(out_path)
+        self.out_path.mkdir(parents=True, exist_ok=True)
+        self.shard_format = shard_format
+        self.max_shard_bytes = max_shard_bytes
+        self.shard_index = len(get_shard_paths(self.out_path))
+        self.columns = {name: [] for name in SHARD_COLUMN_DTYPES}
+        self.buffered_bytes = 0
+        self.bytes_written = 0
+
+    def get_state(self) -> Dict:
+        return {
+            "shard_index": self.shard_index,
+            "columns": {name: list(values) for name, values in self.columns.items()},
+            "buffered_bytes": self.buffered_bytes,
+            "bytes_written": self.bytes_written,
+        }
+
+    def set_state(self, state: Dict):
+        self.shard_index = state["shard_index"]
+        self.columns = {name: list(values) for name, values in state["columns"].items()}
+        self.buffered_bytes = state["buffered_bytes"]
+        self.bytes_written = state["bytes_written"]
+
+    def add(self, transition):
+        for name, value in transition.items():
+            if name in self.columns:
+                self.columns[name].append(value)
+                self.buffered_bytes += np.size(value) * np.dtype(SHARD_COLUMN_DTYPES[name]).itemsize
+        if self.buffered_bytes >= self.max_shard_bytes:
+            self.flush()
+
+    def flush(self):
+        if len(self.columns["t"]) == 0:
+            return
+        arrays = {
+            name: np.asarray(values, dtype=SHARD_COLUMN_DTYPES[name])
+            for name, values in self.columns.items()
+        }
+        shard_path = self.out_path.joinpath(f"shard-{self.shard_index:05d}")
+        if self.shard_format == "npy":
+            shard_path.mkdir()
+            for name, array in arrays.items():
+                np.save(shard_path.joinpath(f"{name}.npy"), array)
+            self.bytes_written += sum(p.stat().st_size for p in shard_path.iterdir())
+        elif self.shard_format == "npz":
+            shard_path = shard_path.with_suffix(".npz")
+            np.savez_compressed(shard_path, **arrays)
+            self.bytes_written += shard_path.stat().st_size
+        else:
+            import pyarrow
+            import pyarrow.parquet
+            flat_columns = {}
+            for name, array in arrays.items():
+                if array.ndim == 1:
+                    flat_columns[name] = array
+                else:
+                    for idx in range(array.shape[1]):
+                        flat_columns[f"{name}_{idx}"] = array[:, idx]
+            shard_path = shard_path.with_suffix(".parquet")
+            pyarrow.parquet.write_table(pyarrow.table(flat_columns), shard_path)
+            self.bytes_written += shard_path.stat().st_size
+        self.shard_index += 1
+        self.columns = {name: [] for name in SHARD_COLUMN_DTYPES}
+        self.buffered_bytes = 0
+
+
+def get_shard_paths(path) -> List[Path]:
+    return sorted(Path(path).glob("shard-*"))
+
+
+def read_shard(shard_path) -> Dict[str, np.ndarray]:
+    """
+    Columns of one shard, npy shards are memory-mapped rather than read into memory
+    """
+    shard_path = Path(shard_path)
+    if shard_path.is_dir():
+        return {
+            column_path.stem: np.load(column_path, mmap_mode="r")
+            for column_path in shard_path.glob("*.npy")
+        }
+    if shard_path.suffix == ".npz":
+        with np.load(shard_path) as shard:
+            return dict(shard)
+    import pyarrow.parquet
+    flat_columns = pyarrow.parquet.read_table(shard_path).to_pydict()
+    columns = {}
+    for name in SHARD_COLUMN_DTYPES:
+        if name in flat_columns:
+            columns[name] = np.asarray(flat_columns[name], dtype=SHARD_COLUMN_DTYPES[name])
+        else:
+            idx = 0
+            vector_columns = []
+            while f"{name}_{idx}" in flat_columns:
+                vector_columns.append(flat_columns[f"{name}_{idx}"])
+                idx += 1
+            columns[name] = np.asarray(vector_columns, dtype=SHARD_COLUMN_DTYPES[name]).T
+    return columns
+
+
+def read_shards(path) -> Iterator[Dict[str, np.ndarray]]:
+    for shard_path in get_shard_paths(path):
+        yield read_shard(shard_path)
+
+
+def load_shards(path) -> Dict[str, np.ndarray]:
+    """
+    All shards written to path, concatenated column by column
+    """
+    shards = list(read_shards(path))
+    return {
+        name: np.concatenate([shard[name] for shard in shards])
+        for name in SHARD_COLUMN_DTYPES
+    }
 
-from .utils.constants import DAY_LENGTH
 
 class BatchWriter:
-    def __init__(self, out_path):
-        self.batch_builder = SampleBatchBuilder()  # or MultiAgentSampleBatchBuilder
-        self.writer = JsonWriter(out_path)
+    """
+    Writes (observation, action, reward) steps as offline RL transitions
+
+    Args:
+        out_path: folder for the RLlib json files and binary shards
+        transitions_per_batch: transitions collected in each written SampleBatch
+        shard_format: one of SHARD_FORMATS to also write binary shards, None to skip them
+        max_shard_bytes: approximate size at which a new shard is started
+        write_json: whether to write the RLlib json format
+    """
+    def __init__(self, out_path, transitions_per_batch=1, shard_format=None, max_shard_bytes=64 * 1024 * 1024, write_json=True):
+        self.out_path = Path(out_path)
+        if write_json:
+            # RLlib takes seconds to import, so it is only loaded when its json format is written
+            from ray.rllib.evaluation.sample_batch_builder import SampleBatchBuilder
+            from ray.rllib.offline.json_writer import JsonWriter
+            self.batch_builder = SampleBatchBuilder()  # or MultiAgentSampleBatchBuilder
+            self.writer = JsonWriter(out_path)
+        else:
+            self.batch_builder = None
+            self.writer = None
+        self.shard_writer = ShardWriter(out_path, shard_format, max_shard_bytes) if shard_format is not None else None
+        self.transitions_per_batch = transitions_per_batch
+        self.num_pending_transitions = 0
+        # transitions added to batch_builder since the last written batch, kept for checkpoints
+        self.pending_transitions = []
         self.step_data = {}
+        # json files this writer wrote to, out_path may also hold files of earlier runs
+        self.json_paths = set()
   
     def write_batch(self, episode_and_step, action, observation, reward):
         self.step_data[episode_and_step] = (action, observation, reward)
@@ -26,20 +192,115 @@ class BatchWriter:
             prev_observation is not None and
             prev_reward is not None
         ):
-            self.batch_builder.add_values(
-                t=episode_and_step,
-                eps_id=episode_and_step,
-                agent_index=0,
-                obs=prev_observation,
-                actions=action,
-                action_prob=1.0,  # put the true action probability here
-                action_logp=0.0,
-                rewards=reward,
-                prev_actions=prev_action,
-                prev_rewards=prev_reward,
-                dones=True,
-                infos={},
-                new_obs=observation
+            self.write_transition(episode_and_step, prev_action, prev_observation, prev_reward, action, observation, reward)
+
+    def write_batches(self, episode_and_steps, actions, observations, rewards):
+        """
+        Bulk version of write_batch, pairing every step with the step before it
+
+        Args:
+            episode_and_steps: (steps,) increasing step indices
+            actions, observations: (steps, ...) arrays
+            rewards: (steps,) array
+        """
+        episode_and_steps = np.asarray(episode_and_steps)
+        if len(episode_and_steps) == 0:
+            return
+        # a step pending from an earlier write_batch call can pair with the first step
+        prev_action, prev_observation, prev_reward = self.step_data.pop(
+            (episode_and_steps[0] - 1),
+            (None, None, None),
+        )
+        if (prev_action is not None and
+            prev_observation is not None and
+            prev_reward is not None
+        ):
+            self.write_transition(episode_and_steps[0], prev_action, prev_observation, prev_reward, actions[0], observations[0], rewards[0])
+
+        has_prev_step = np.flatnonzero(episode_and_steps[1:] == episode_and_steps[:-1] + 1) + 1
+        for step_idx in has_prev_step:
+            self.write_transition(
+                episode_and_steps[step_idx],
+                actions[step_idx - 1],
+                observations[step_idx - 1],
+                rewards[step_idx - 1],
+                actions[step_idx],
+                observations[step_idx],
+                rewards[step_idx],
             )
+        self.step_data[episode_and_steps[-1]] = (actions[-1], observations[-1], rewards[-1])
+
+    def write_transition(self, episode_and_step, prev_action, prev_observation, prev_reward, action, observation, reward):
+        transition = dict(
+            t=episode_and_step,
+            eps_id=episode_and_step,
+            agent_index=0,
+            obs=prev_observation,
+            actions=action,
+            action_prob=1.0,  # put the true action probability here
+            action_logp=0.0,
+            rewards=reward,
+            prev_actions=prev_action,
+            prev_rewards=prev_reward,
+            dones=True,
+            infos={},
+            new_obs=observation
+        )
+        if self.writer is not None:
+            self.batch_builder.add_values(**transition)
+            self.pending_transitions.append(transition)
+            self.num_pending_transitions += 1
+            if self.num_pending_transitions >= self.transitions_per_batch:
+                self.flush_batch()
+        if self.shard_writer is not None:
+            self.shard_writer.add(transition)
+
+    def flush_batch(self):
+        if self.num_pending_transitions > 0:
             self.writer.write(self.batch_builder.build_and_reset())
-  
\ No newline at end of file
+            self.json_paths.add(self.writer.cur_file.name)
+            self.pending_transitions = []
+            self.num_pending_transitions = 0
+
+    def get_state(self) -> Dict:
+        """
+        The step waiting for its successor, the transitions of the unwritten batch and the shard writer's buffer
+        """
+        return {
+            "step_data": dict(self.step_data),
+            "pending_transitions": list(self.pending_transitions),
+            "shard_writer": self.shard_writer.get_state() if self.shard_writer is not None else None,
+            "json_paths": set(self.json_paths),
+        }
+
+    def set_state(self, state: Dict):
+        """
+        Restore a fresh writer to state, once its out_path is back to what it held when state was taken
+        """
+        self.step_data = dict(state["step_data"])
+        if self.writer is not None:
+            for transition in state["pending_transitions"]:
+                self.batch_builder.add_values(**transition)
+            self.pending_transitions = list(state["pending_transitions"])
+            self.num_pending_transitions = len(self.pending_transitions)
+            self.json_paths = set(state["json_paths"])
+        if self.shard_writer is not None:
+            self.shard_writer.set_state(state["shard_writer"])
+
+    @property
+    def bytes_written(self) -> int:
+        json_bytes = sum(os.path.getsize(json_path) for json_path in self.json_paths if os.path.isfile(json_path))
+        return json_bytes + (self.shard_writer.bytes_written if self.shard_writer is not None else 0)
+
+    def close(self):
+        # the step pending in step_data has no successor yet and is not written
+        if self.writer is not None:
+            self.flush_batch()
+        if self.shard_writer is not None:
+            self.shard_writer.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
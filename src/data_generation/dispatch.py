@@ -0,0 +1,321 @@
+import functools
+import time
+import numpy as np
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+from .utils.constants import DAY_LENGTH
+
+
+@dataclass
+class DispatchResult:
+    x: np.ndarray # hourly battery charge (+) / discharge (-), (num_prosumers, DAY_LENGTH) when batched
+    success: bool
+    nit: int = 0 # solver iterations, summed over prosumers when batched
+    seconds: float = 0.0 # wall time of the solve
+
+
+def get_net_load(load, gen, x, eta):
+    return load - gen + (-eta + 1 / eta) * abs(x) / 2 + (eta + 1 / eta) * x / 2
+
+
+def get_clipped_net_load(load, gen, x, eta, max_rate):
+    """
+    Net load for battery schedule x, bounded by the battery's hourly charge rate
+    """
+    net = get_net_load(load, gen, x, eta)
+    upper_bound = load - gen + max_rate
+    lower_bound = load - gen - max_rate
+    net = np.minimum(net, upper_bound)  # upper bound
+    net = np.maximum(net, lower_bound)  # lower bound
+    return net
+
+
+def get_dispatch_cost(net, buyprices, sellprices):
+    return np.sum(np.maximum(net, 0) * buyprices) + np.sum(
+        np.minimum(net, 0) * sellprices
+    )
+
+
+def slsqp_dispatch(load, gen, buyprices, sellprices, battery_num, capacity, eta, c_rate, num_optim_steps=10000) -> DispatchResult:
+    """
+    Original SLSQP formulation, minimizing the non-smooth daily cost directly
+    """
+    # scipy is imported by the solvers, so that importing the package does not load it
+    from scipy.optimize import minimize
+    solve_start = time.perf_counter()
+    Ltri = np.tril(np.ones((DAY_LENGTH, DAY_LENGTH)))
+
+    def dailyobjective(x):
+        net = get_net_load(load, gen, x, eta)
+        return get_dispatch_cost(net, buyprices, sellprices)
+
+    def hourly_con_charge_max(x):
+        # Shouldn't charge or discharge too fast
+        return c_rate * capacity * battery_num - x
+
+    def hourly_con_charge_min(x):
+        # Shouldn't charge or discharge too fast
+        return c_rate * capacity * battery_num + x
+
+    def hourly_con_cap_max(x):
+        # x should respect the initial state of charge
+        return capacity * battery_num - np.matmul(Ltri, x)
+
+    def hourly_con_cap_min(x):
+        # x should respect the initial state of charge
+        return np.matmul(Ltri, x)
+
+    con1_hourly = {"type": "ineq", "fun": hourly_con_charge_min}
+    con2_hourly = {"type": "ineq", "fun": hourly_con_charge_max}
+    con3_hourly = {"type": "ineq", "fun": hourly_con_cap_min}
+    con4_hourly = {"type": "ineq", "fun": hourly_con_cap_max}
+    cons_hourly = (con1_hourly, con2_hourly, con3_hourly, con4_hourly)
+
+    x0 = [battery_num * capacity] * DAY_LENGTH
+    # x0 = [0]*DAY_LENGTH
+
+    sol = minimize(
+        dailyobjective,
+        x0,
+        constraints=cons_hourly,
+        method="SLSQP",
+        options={"maxiter": num_optim_steps},
+    )
+    return DispatchResult(x=sol["x"], success=sol.success, nit=sol.nit, seconds=time.perf_counter() - solve_start)
+
+
+@functools.lru_cache(maxsize=1024)
+def get_slsqp_constraints(battery_num, capacity, c_rate):
+    """
+    The four hourly constraints of slsqp_dispatch stacked as A @ x + b >= 0, A is also their Jacobian
+    """
+    identity = np.identity(DAY_LENGTH)
+    Ltri = np.tril(np.ones((DAY_LENGTH, DAY_LENGTH)))
+    max_rate = c_rate * capacity * battery_num
+    A = np.vstack([identity, -identity, Ltri, -Ltri])
+    b = np.concatenate([
+        np.full(DAY_LENGTH, max_rate), # charge no faster than max_rate
+        np.full(DAY_LENGTH, max_rate), # discharge no faster than max_rate
+        np.zeros(DAY_LENGTH), # never below empty
+        np.full(DAY_LENGTH, capacity * battery_num), # never above capacity
+    ])
+    A.setflags(write=False)
+    b.setflags(write=False)
+    return A, b
+
+
+def get_smoothed_dispatch_cost(x, load, gen, buyprices, sellprices, eta, smoothing):
+    """
+    Daily cost with |x| and max(net, 0) replaced by sqrt(v**2 + smoothing**2) based approximations,
+    which tend to get_dispatch_cost as smoothing goes to 0
+
+    Returns:
+        (cost, gradient of the cost with respect to x)
+    """
+    smoothed_abs_x = np.sqrt(x * x + smoothing * smoothing)
+    net = load - gen + (-eta + 1 / eta) * smoothed_abs_x / 2 + (eta + 1 / eta) * x / 2
+    smoothed_abs_net = np.sqrt(net * net + smoothing * smoothing)
+    positive_net = (net + smoothed_abs_net) / 2
+    # share of each hour's net load priced at the buy price
+    buy_share = (1 + net / smoothed_abs_net) / 2
+    cost = np.sum(positive_net * buyprices) + np.sum((net - positive_net) * sellprices)
+    net_gradient = buyprices * buy_share + sellprices * (1 - buy_share)
+    x_gradient = net_gradient * ((-eta + 1 / eta) * x / smoothed_abs_x / 2 + (eta + 1 / eta) / 2)
+    return cost, x_gradient
+
+
+def warm_slsqp_dispatch(load, gen, buyprices, sellprices, battery_num, capacity, eta, c_rate, num_optim_steps=10000, x0: Optional[np.ndarray] = None, smoothing=0.1, ftol=1e-9) -> DispatchResult:
+    """
+    SLSQP on the smoothed daily cost, with an analytic gradient and the cached constraint Jacobian
+
+    The schedule is optimized in units of the battery's hourly charge rate and the cost relative to
+    the day's unbatteried energy bill, which keeps SLSQP's identity start Hessian well scaled.
+
+    Args:
+        x0: starting schedule, usually a previous solution of the same battery. Defaults to an idle
+            battery, which unlike the start of slsqp_dispatch satisfies every constraint
+        smoothing: kWh scale below which the kinks of the cost are rounded off, must be positive
+        ftol: SLSQP's precision goal on the scaled cost
+    """
+    from scipy.optimize import minimize
+    solve_start = time.perf_counter()
+    load = np.asarray(load, dtype=np.float64)
+    gen = np.asarray(gen, dtype=np.float64)
+    buyprices = np.asarray(buyprices, dtype=np.float64)
+    sellprices = np.asarray(sellprices, dtype=np.float64)
+    max_rate = c_rate * capacity * battery_num
+    if max_rate <= 0:
+        # without a battery idling is the only schedule
+        return DispatchResult(x=np.zeros(DAY_LENGTH), success=True, seconds=time.perf_counter() - solve_start)
+
+    A, b = get_slsqp_constraints(battery_num, capacity, c_rate)
+    scaled_A = A * max_rate
+    cost_scale = np.abs(load - gen).sum() * np.abs(buyprices).max()
+    cost_scale = 1 / cost_scale if cost_scale > 0 else 1.0
+
+    def scaled_objective(y):
+        cost, x_gradient = get_smoothed_dispatch_cost(y * max_rate, load, gen, buyprices, sellprices, eta, smoothing)
+        return cost * cost_scale, x_gradient * (max_rate * cost_scale)
+
+    y0 = np.zeros(DAY_LENGTH) if x0 is None else np.asarray(x0, dtype=np.float64) / max_rate
+    sol = minimize(
+        scaled_objective,
+        y0,
+        jac=True,
+        constraints={"type": "ineq", "fun": lambda y: scaled_A @ y + b, "jac": lambda y: scaled_A},
+        method="SLSQP",
+        options={"maxiter": num_optim_steps, "ftol": ftol},
+    )
+    return DispatchResult(x=sol.x * max_rate, success=sol.success, nit=sol.nit, seconds=time.perf_counter() - solve_start)
+
+
+@functools.lru_cache(maxsize=8)
+def get_lp_constraints(battery_nums: Tuple[float], capacities: Tuple[float], etas: Tuple[float], c_rates: Tuple[float]):
+    """
+    Block diagonal constraints of the dispatch LP, one block of DAY_LENGTH hours per prosumer
+    """
+    from scipy import sparse
+    identity = sparse.identity(DAY_LENGTH, format="csr")
+    zeros = sparse.csr_matrix((DAY_LENGTH, DAY_LENGTH))
+    Ltri = sparse.csr_matrix(np.tril(np.ones((DAY_LENGTH, DAY_LENGTH))))
+    A_ub_blocks, b_ub_blocks, A_eq_blocks, bounds_blocks = [], [], [], []
+    for battery_num, capacity, eta, c_rate in zip(battery_nums, capacities, etas, c_rates):
+        # variable order: [c, d, p, q]
+        A_eq_blocks.append(sparse.hstack([-identity / eta, eta * identity, identity, -identity]))
+        # 0 <= cumulative charge <= battery capacity
+        A_ub_blocks.append(sparse.bmat([
+            [Ltri, -Ltri, zeros, zeros],
+            [-Ltri, Ltri, zeros, zeros],
+        ], format="csr"))
+        b_ub_blocks.append(np.concatenate([
+            np.full(DAY_LENGTH, capacity * battery_num),
+            np.zeros(DAY_LENGTH),
+        ]))
+        block_bounds = np.zeros((4 * DAY_LENGTH, 2))
+        block_bounds[:2 * DAY_LENGTH, 1] = c_rate * capacity * battery_num
+        block_bounds[2 * DAY_LENGTH:, 1] = np.inf
+        bounds_blocks.append(block_bounds)
+    return (
+        sparse.block_diag(A_ub_blocks, format="csr"),
+        np.concatenate(b_ub_blocks),
+        sparse.block_diag(A_eq_blocks, format="csr"),
+        np.vstack(bounds_blocks),
+    )
+
+
+def batched_lp_dispatch(loads, gens, buyprices, sellprices, battery_nums, capacities, etas, c_rates, num_optim_steps=10000) -> DispatchResult:
+    """
+    Exact linear program for the daily dispatch of several prosumers facing the same prices
+
+    Variables are split into charge c, discharge d, import p and export q (all >= 0) so that
+        net = load - gen + c / eta - eta * d = p - q
+    and the cost is buyprices . p - sellprices . q. This is only exact when buying never pays
+    less than selling, otherwise the objective is non-convex and we fall back to SLSQP.
+
+    Args:
+        loads, gens: (num_prosumers, DAY_LENGTH) arrays
+        battery_nums, capacities, etas, c_rates: (num_prosumers,) arrays
+    Returns:
+        DispatchResult with x of shape (num_prosumers, DAY_LENGTH)
+    """
+    from scipy.optimize import linprog
+    solve_start = time.perf_counter()
+    loads = np.asarray(loads, dtype=np.float64)
+    gens = np.asarray(gens, dtype=np.float64)
+    buyprices = np.asarray(buyprices, dtype=np.float64)
+    sellprices = np.asarray(sellprices, dtype=np.float64)
+    num_prosumers = loads.shape[0]
+
+    if np.any(sellprices > buyprices):
+        results = [
+            slsqp_dispatch(loads[idx], gens[idx], buyprices, sellprices, battery_nums[idx], capacities[idx], etas[idx], c_rates[idx], num_optim_steps)
+            for idx in range(num_prosumers)
+        ]
+        return DispatchResult(
+            x=np.stack([result.x for result in results]),
+            success=all(result.success for result in results),
+            nit=sum(result.nit for result in results),
+            seconds=time.perf_counter() - solve_start,
+        )
+
+    A_ub, b_ub, A_eq, bounds = get_lp_constraints(
+        tuple(battery_nums), tuple(capacities), tuple(etas), tuple(c_rates)
+    )
+    cost = np.tile(np.concatenate([np.zeros(2 * DAY_LENGTH), buyprices, -sellprices]), num_prosumers)
+    sol = linprog(
+        cost,
+        A_ub=A_ub,
+        b_ub=b_ub,
+        A_eq=A_eq,
+        b_eq=(loads - gens).ravel(),
+        bounds=bounds,
+        method="highs",
+        options={"maxiter": num_optim_steps},
+    )
+    if not sol.success:
+        return DispatchResult(x=np.zeros((num_prosumers, DAY_LENGTH)), success=False, nit=sol.nit, seconds=time.perf_counter() - solve_start)
+    variables = sol.x.reshape(num_prosumers, 4, DAY_LENGTH)
+    return DispatchResult(x=variables[:, 0] - variables[:, 1], success=True, nit=sol.nit, seconds=time.perf_counter() - solve_start)
+
+
+def lp_dispatch(load, gen, buyprices, sellprices, battery_num, capacity, eta, c_rate, num_optim_steps=10000) -> DispatchResult:
+    """
+    Exact linear program for the daily dispatch of a single prosumer, see batched_lp_dispatch
+    """
+    result = batched_lp_dispatch(
+        np.asarray(load, dtype=np.float64)[None],
+        np.asarray(gen, dtype=np.float64)[None],
+        buyprices,
+        sellprices,
+        [battery_num], [capacity], [eta], [c_rate],
+        num_optim_steps,
+    )
+    return DispatchResult(x=result.x[0], success=result.success, nit=result.nit, seconds=result.seconds)
+
+
+DISPATCH_SOLVERS: Dict[str, Callable[..., DispatchResult]] = {
+    "slsqp": slsqp_dispatch,
+    "lp": lp_dispatch,
+    "slsqp_warm": warm_slsqp_dispatch,
+}
+
+
+# solvers taking a starting schedule x0, the fleet hands them the previous solution of each prosumer
+WARM_STARTED_DISPATCH_SOLVERS = ("slsqp_warm",)
+
+
+# solvers able to dispatch a whole fleet at once, taking per prosumer parameter arrays
+BATCHED_DISPATCH_SOLVERS: Dict[str, Callable[..., DispatchResult]] = {
+    "lp": batched_lp_dispatch,
+}
+
+
+def get_dispatch_solver(name: str) -> Callable[..., DispatchResult]:
+    if name not in DISPATCH_SOLVERS:
+        raise ValueError(f"Unknown dispatch solver {name}, expected one of {list(DISPATCH_SOLVERS)}")
+    return DISPATCH_SOLVERS[name]
+
+
+def check_dispatch_regression(prosumer, day, buyprices, sellprices, candidate="lp", reference="slsqp", tolerance=1e-6):
+    """
+    Compare the daily cost reached by two dispatch solvers for one prosumer
+
+    Returns:
+        (candidate_cost, reference_cost, passed) where passed is False when the candidate
+        ends up more expensive than the reference by more than tolerance
+    """
+    load = prosumer.yearlongdemand.loc[day, :]
+    gen = prosumer.pv_size * prosumer.yearlonggeneration.loc[day, :]
+    costs = []
+    for solver_name in (candidate, reference):
+        result = get_dispatch_solver(solver_name)(
+            load, gen, buyprices, sellprices,
+            battery_num=prosumer.battery_num,
+            capacity=prosumer.capacity,
+            eta=prosumer.eta,
+            c_rate=prosumer.c_rate,
+        )
+        net = prosumer.clip_net_load(load, gen, result.x)
+        costs.append(get_dispatch_cost(np.asarray(net), buyprices, sellprices))
+    candidate_cost, reference_cost = costs
+    return candidate_cost, reference_cost, candidate_cost <= reference_cost + tolerance
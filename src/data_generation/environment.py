@@ -1,9 +1,14 @@
+import contextlib
+import time
 import numpy as np
 import pandas as pd
 from dataclasses import dataclass
 from .real_prosumer import RealProsumer
-from .utils.constants import DAY_LENGTH, YEAR_LENGTH, SOLAR_CONSTANT_INSTALLMENT_AREA
-from typing import Callable, List, Tuple, Optional
+from .fleet import ProsumerFleet
+from .profiling import NULL_PROFILER, Profiler
+from .rewards import get_twoprices_rewards
+from .utils.constants import DAY_LENGTH, YEAR_LENGTH, SOLAR_CONSTANT_INSTALLMENT_AREA, UTILITY_SELL_RATIO
+from typing import Callable, Dict, List, Tuple, Optional
 
 @dataclass
 class EnvironmentDataDescriptor:
@@ -18,9 +23,63 @@ class EnvironmentDataDescriptor:
     prosumer_noise_scale: float
     generation_noise_scale: float
     
-    sell_price_function : Callable[[float, int, int], float] = lambda buy_price, day, year : buy_price * 0.6
+    sell_price_function : Callable[[float, int, int], float] = lambda buy_price, day, year : buy_price * UTILITY_SELL_RATIO
+    dispatch_solver: str = "slsqp" # one of dispatch.DISPATCH_SOLVERS
     
+@dataclass
+class EnvironmentArrays:
+    """
+    Contiguous float64 arrays of the environment's pivoted tables, row i of every table holds day days[i]
+    """
+    days: np.ndarray # (num_days,) day of the year of each row
+    day_rows: np.ndarray # day of the year -> row, -1 for days without data
+    utility_hourly_buy_prices: np.ndarray # (num_days, DAY_LENGTH)
+    utility_hourly_sell_prices: np.ndarray # (num_days, DAY_LENGTH)
+    hourly_solar_constants: np.ndarray # (num_days, DAY_LENGTH)
+    prosumer_demand: np.ndarray # (num_prosumers, num_days, DAY_LENGTH)
+    is_weekday: np.ndarray # (num_days,)
+
+    def get_day_rows(self, days):
+        """
+        Row of a day, or rows of an array of days
+        """
+        days_array = np.asarray(days)
+        # negative days would silently index from the end, and days past the table raise a bare IndexError
+        is_missing = (days_array < 0) | (days_array >= len(self.day_rows))
+        if not np.any(is_missing):
+            day_rows = self.day_rows[days]
+            is_missing = day_rows < 0
+        if np.any(is_missing):
+            raise KeyError(f"No environment data for day(s) {days_array[is_missing].tolist()}")
+        return day_rows
+
+    def from_dataframes(
+        utility_hourly_buy_prices: pd.DataFrame,
+        utility_hourly_sell_prices: pd.DataFrame,
+        hourly_solar_constants: pd.DataFrame,
+        prosumer_demand: np.ndarray,
+        weekday_dict: Dict[int, bool],
+    ) -> "EnvironmentArrays":
+        """
+        prosumer_demand rows must follow the day index of the price DataFrames
+        """
+        days = utility_hourly_buy_prices.index.to_numpy()
+        day_rows = np.full(days.max() + 1, -1, dtype=np.int64)
+        day_rows[days] = np.arange(len(days))
+        as_array = lambda df: np.ascontiguousarray(df.reindex(days).to_numpy(dtype=np.float64))
+        return EnvironmentArrays(
+            days=days,
+            day_rows=day_rows,
+            utility_hourly_buy_prices=as_array(utility_hourly_buy_prices),
+            utility_hourly_sell_prices=as_array(utility_hourly_sell_prices),
+            hourly_solar_constants=as_array(hourly_solar_constants),
+            prosumer_demand=np.ascontiguousarray(prosumer_demand, dtype=np.float64),
+            is_weekday=np.array([weekday_dict[day] for day in days], dtype=bool),
+        )
+
 class MockEnvironment:
+    # environments are also built with __new__, so the default lives on the class
+    profiler: Profiler = NULL_PROFILER
     
     def __init__(
         self,
@@ -28,10 +87,94 @@ class MockEnvironment:
         building_metadata_df: pd.DataFrame,
         environment_data_descriptor: EnvironmentDataDescriptor, 
     ):
+        # seconds spent in each construction phase
+        self.construction_timings: Dict[str, float] = {}
+        phase_start = time.perf_counter()
+        def end_phase(phase_name):
+            nonlocal phase_start
+            phase_end = time.perf_counter()
+            self.construction_timings[phase_name] = phase_end - phase_start
+            phase_start = phase_end
+
         building_data_df = MockEnvironment.add_time_info(building_data_df, environment_data_descriptor)
-        self.prosumer_list, self.hourly_solar_constants = MockEnvironment.create_prosumers(building_data_df, building_metadata_df, environment_data_descriptor)
+        end_phase("add_time_info")
+        self.prosumer_list, self.hourly_solar_constants, prosumer_demand = MockEnvironment.create_prosumers(building_data_df, building_metadata_df, environment_data_descriptor)
+        end_phase("create_prosumers")
         self.utility_hourly_buy_prices, self.utility_hourly_sell_prices, self.weekday_dict = MockEnvironment.get_environment_constants(building_data_df, environment_data_descriptor)
-    
+        end_phase("get_environment_constants")
+        # the DataFrames above are kept for compatibility, the simulation path reads these arrays
+        self.arrays = EnvironmentArrays.from_dataframes(
+            self.utility_hourly_buy_prices,
+            self.utility_hourly_sell_prices,
+            self.hourly_solar_constants,
+            prosumer_demand,
+            self.weekday_dict,
+        )
+        self.prosumer_fleet = ProsumerFleet(self.prosumer_list, self.arrays, environment_data_descriptor.dispatch_solver)
+        end_phase("build_arrays")
+
+    def from_environment_arrays(
+        environment_arrays: EnvironmentArrays,
+        prosumer_names: List[str],
+        pv_sizes: np.ndarray,
+        environment_data_descriptor: EnvironmentDataDescriptor,
+    ) -> "MockEnvironment":
+        """
+        Build the environment from already compiled arrays, skipping building data parsing
+        """
+        phase_start = time.perf_counter()
+        mock_environment = MockEnvironment.__new__(MockEnvironment)
+        to_df = lambda values: pd.DataFrame(
+            values,
+            index=pd.Index(environment_arrays.days, name="day"),
+            columns=pd.Index(np.arange(DAY_LENGTH), name="hour"),
+            copy=False,
+        )
+        mock_environment.hourly_solar_constants = to_df(environment_arrays.hourly_solar_constants)
+        mock_environment.utility_hourly_buy_prices = to_df(environment_arrays.utility_hourly_buy_prices)
+        mock_environment.utility_hourly_sell_prices = to_df(environment_arrays.utility_hourly_sell_prices)
+        mock_environment.weekday_dict = dict(zip(environment_arrays.days.tolist(), environment_arrays.is_weekday.tolist()))
+        mock_environment.prosumer_list = MockEnvironment.create_prosumers_from_arrays(
+            prosumer_names,
+            pv_sizes,
+            mock_environment.hourly_solar_constants,
+            environment_arrays.prosumer_demand,
+            environment_data_descriptor,
+        )
+        mock_environment.arrays = environment_arrays
+        mock_environment.prosumer_fleet = ProsumerFleet(mock_environment.prosumer_list, environment_arrays, environment_data_descriptor.dispatch_solver)
+        mock_environment.construction_timings = {"from_environment_arrays": time.perf_counter() - phase_start}
+        return mock_environment
+
+    def timing_report(self) -> str:
+        total = sum(self.construction_timings.values())
+        phase_reports = ", ".join(f"{phase_name} {seconds:.3f}s" for phase_name, seconds in self.construction_timings.items())
+        return f"Environment setup took {total:.3f}s ({phase_reports})"
+
+    @contextlib.contextmanager
+    def use_profiler(self, profiler: Profiler):
+        """
+        Time rewards and the dispatch of single prosumers with profiler until the block exits
+        """
+        self.set_profiler(profiler)
+        try:
+            yield profiler
+        finally:
+            self.set_profiler(NULL_PROFILER)
+
+    def set_profiler(self, profiler: Profiler):
+        self.profiler = profiler
+        for prosumer in self.prosumer_list:
+            prosumer.profiler = profiler
+
+    def set_noise_scales(self, prosumer_noise_scale: float, generation_noise_scale: float):
+        """
+        Change the noise scales of every prosumer, noise is drawn per step so this takes effect on the next step
+        """
+        for prosumer in self.prosumer_list:
+            prosumer.noise_scale = prosumer_noise_scale
+            prosumer.generation_noise_scale = generation_noise_scale
+
     def add_time_info(
         building_data_df: pd.DataFrame,
         environment_data_descriptor: EnvironmentDataDescriptor,
@@ -51,7 +194,7 @@ class MockEnvironment:
     ):
 
         utility_hourly_buy_prices = building_data_df.pivot(index='day', columns='hour', values=building_data_df.columns[environment_data_descriptor.price_col_idx])
-        utility_hourly_sell_prices = utility_hourly_buy_prices * 0.6
+        utility_hourly_sell_prices = utility_hourly_buy_prices * UTILITY_SELL_RATIO
         
         weekday_dict = dict(zip(building_data_df['day'], building_data_df['is_weekday']))
         
@@ -62,108 +205,116 @@ class MockEnvironment:
         building_data_df: pd.DataFrame,
         building_metadata_df: pd.DataFrame,
         environment_data_descriptor: EnvironmentDataDescriptor, 
-    ) -> Tuple[List[RealProsumer], np.ndarray]:
-        prosumer_list : List[RealProsumer] = []
-        
+    ) -> Tuple[List[RealProsumer], pd.DataFrame, np.ndarray]:
+        """
+        Returns:
+            prosumers, hourly solar constants and the (num_prosumers, num_days, DAY_LENGTH) demand of all prosumers
+        """
         column_labels = building_data_df.columns
+        prosumer_names = [column_labels[prosumer_col_idx] for prosumer_col_idx in environment_data_descriptor.prosumer_col_idx_list]
 
         hourly_solar_constants = building_data_df.pivot(index='day', columns='hour', values=building_data_df.columns[environment_data_descriptor.solar_gen_col_idx]).interpolate()
-        for prosumer_idx, prosumer_col_idx in enumerate(environment_data_descriptor.prosumer_col_idx_list):
-            prosumer_name = column_labels[prosumer_col_idx]
-            prosumer_demand = building_data_df.pivot(index='day', columns='hour', values=building_data_df.columns[prosumer_col_idx]).interpolate()
-            
-            # calculate pv_size
-            if environment_data_descriptor.pv_sizes is None:
-                prosumer_building_sqm = building_metadata_df.loc[prosumer_name, "sqm"]
-                pv_size = prosumer_building_sqm / SOLAR_CONSTANT_INSTALLMENT_AREA * 1/2
-            else:
-                pv_size = environment_data_descriptor.pv_sizes[prosumer_idx]
-            
-            
+        # one pivot for every prosumer column, interpolating along days for each (prosumer, hour) column
+        all_prosumer_demand = building_data_df.pivot(index='day', columns='hour', values=prosumer_names).interpolate()
+        all_prosumer_demand = all_prosumer_demand.reindex(hourly_solar_constants.index)
+        days = all_prosumer_demand.index
+        hours = all_prosumer_demand.columns.levels[1]
+        prosumer_demand = all_prosumer_demand.to_numpy(dtype=np.float64).reshape(len(days), len(prosumer_names), len(hours)).transpose(1, 0, 2)
+
+        # calculate pv_size
+        if environment_data_descriptor.pv_sizes is None:
+            prosumer_building_sqm = building_metadata_df.loc[prosumer_names, "sqm"].to_numpy(dtype=np.float64)
+            pv_sizes = prosumer_building_sqm / SOLAR_CONSTANT_INSTALLMENT_AREA * 1/2
+        else:
+            pv_sizes = environment_data_descriptor.pv_sizes
+
+        prosumer_list = MockEnvironment.create_prosumers_from_arrays(prosumer_names, pv_sizes, hourly_solar_constants, prosumer_demand, environment_data_descriptor)
+        return prosumer_list, hourly_solar_constants, prosumer_demand
+
+    def create_prosumers_from_arrays(
+        prosumer_names: List[str],
+        pv_sizes: np.ndarray,
+        hourly_solar_constants: pd.DataFrame,
+        prosumer_demand: np.ndarray,
+        environment_data_descriptor: EnvironmentDataDescriptor,
+    ) -> List[RealProsumer]:
+        prosumer_list : List[RealProsumer] = []
+        days = hourly_solar_constants.index
+        hours = hourly_solar_constants.columns
+
+        # maximum hourly generation over the year, scaled by each prosumer's pv_size
+        max_solar_constants = MockEnvironment.get_max_solar_constants(days.to_numpy(), hourly_solar_constants.to_numpy(dtype=np.float64))
+
+        for prosumer_idx, prosumer_name in enumerate(prosumer_names):
             prosumer = RealProsumer(
                 name=prosumer_name,
-                yearlongdemand=prosumer_demand,
+                yearlongdemand=pd.DataFrame(prosumer_demand[prosumer_idx], index=days, columns=hours, copy=False),
                 yearlonggeneration= hourly_solar_constants,
                 battery_num=environment_data_descriptor.battery_nums[prosumer_idx],
-                pv_size=pv_size,
+                pv_size=pv_sizes[prosumer_idx],
                 noise_scale=environment_data_descriptor.prosumer_noise_scale,
                 generation_noise_scale=environment_data_descriptor.generation_noise_scale,
+                dispatch_solver=environment_data_descriptor.dispatch_solver,
+                maxgeneration=pv_sizes[prosumer_idx] * max_solar_constants,
             )
             prosumer_list.append(prosumer)
-        return prosumer_list, hourly_solar_constants
+        return prosumer_list
+
+    def get_max_solar_constants(days: np.ndarray, solar_constants: np.ndarray) -> np.ndarray:
+        """
+        Maximum solar constant of every hour over days [0, YEAR_LENGTH), never below 0
+        """
+        in_year = (days >= 0) & (days < YEAR_LENGTH)
+        return np.nan_to_num(solar_constants[in_year], nan=0).max(axis=0, initial=0)
+
+    def get_utility_prices(self, for_days):
+        """
+        Utility buy and sell prices for a day, or (days, DAY_LENGTH) prices for an array of days
+        """
+        day_rows = self.arrays.get_day_rows(for_days)
+        return (
+            self.arrays.utility_hourly_buy_prices[day_rows],
+            self.arrays.utility_hourly_sell_prices[day_rows],
+        )
+
+    def get_rewards_twoprices(self, energy_consumptions, for_days, buy_prices, sell_prices, total_consumption=None):
+        """
+        Purpose: Vectorized reward for one or many days given grid prices, transactive prices and prosumer energy consumption
+
+        Args:
+            energy_consumptions: (num_prosumers, DAY_LENGTH) demand matrix, or (steps, num_prosumers, DAY_LENGTH) for many days
+            for_days: day of the year, or (steps,) days
+            buy_prices, sell_prices: (DAY_LENGTH,) transactive prices, or (steps, DAY_LENGTH)
+            total_consumption: summed consumption, computed from energy_consumptions when None
+        Returns:
+            total_reward, money_from_prosumers, money_to_utility, total_prosumer_cost
+            each a float, or a (steps,) array when given many days
+        """
+        with self.profiler.phase("reward"):
+            # external prices to buy from and sell to the grid
+            buyprice_grid, sellprice_grid = self.get_utility_prices(for_days)
+            return get_twoprices_rewards(energy_consumptions, buyprice_grid, sellprice_grid, buy_prices, sell_prices, total_consumption)
 
     def get_reward_twoprices(self, for_energy_consumptions, for_day, buy_prices, sell_prices):
         """
         Purpose: Compute reward given grid prices, transactive price set ahead of time, and energy consumption of the participants
 
+        Args:
+            for_energy_consumptions: prosumer name to demand vector, with the summed demand under "Total"
         Returns:
             Reward for RL agent (- |net money flow|): in order to get close to market equilibrium
             Reward for profit maximization is amount of money it generates (prices dot demand)
         """
-        # external prices to buy from the grid
-        buyprice_grid = self.utility_hourly_buy_prices.loc[for_day, :]
-        # external prices to sell to the grid
-        sellprice_grid = self.utility_hourly_sell_prices.loc[for_day, :]
-        
-        total_consumption = for_energy_consumptions["Total"]
-
-        # entry true if purchase from microgrid, false if purchase from utility
-        # buyprice_grid is the external grid, self.buyprice is prices for "agent"
-        # ! forcing agent to strictly be different than the utility price
-        # Bool vector containing when prosumers buy from microgrid
-        test_buy_from_grid = buy_prices < buyprice_grid
-        # Bool vector containing when prosumers sell to microgrid
-        test_sell_to_grid = sell_prices > sellprice_grid
-        # If buyprice from grid and buyprice from market equal (at all times?, why not only at any time) splits seal of electricity between the market and grid evenly
-        # if np.all(buy_prices == buyprice_grid):
-        #     # CONSTANT
-        #     test_buy_from_grid = np.repeat(0.5, buyprice_grid.shape)
-        # if np.all(sell_prices == sellprice_grid):
-        #     # CONSTANT
-        #     test_sell_to_grid = np.repeat(0.5, sellprice_grid.shape)
-
-        # cost associated with net consumption of entire microgrid (from the perspective of the microgrid)
-        # when prosumers are purchasing power from microgrid, if more power is consumed than is being produced on the grid, the grid must purchase from utility
-        # alternately if more power is produced than is being consumed on the microgridgrid, the microgrid must sell back to utility
-        # ! money_to_utility bug resolved
-        money_to_utility = np.dot(
-            np.maximum(0, total_consumption * test_buy_from_grid), buyprice_grid
-        ) + np.dot(np.minimum(0, total_consumption * test_sell_to_grid), sellprice_grid)
-
-        money_from_prosumers = 0
-        grid_money_from_prosumers = 0
-        for prosumerName in for_energy_consumptions:
-            if prosumerName != "Total":
-                # Net money to microgrid from prosumers
-                money_from_prosumers += (
-                    # money agent gains, selling E energy to prosumer
-                    np.dot(
-                        np.maximum(0, for_energy_consumptions[prosumerName])
-                        * test_buy_from_grid,
-                        buy_prices,
-                    )
-                    + np.dot(
-                        np.minimum(0, for_energy_consumptions[prosumerName])
-                        * test_sell_to_grid,
-                        sell_prices,
-                    )
-                )  # money agent loses, to sell E energy to prosumer
-                # Net money to external grid from prosumers (not including microgrid transactions w utility)
-                grid_money_from_prosumers += np.dot(
-                    np.maximum(0, for_energy_consumptions[prosumerName])
-                    * np.logical_not(test_buy_from_grid),
-                    buyprice_grid,
-                ) + np.dot(
-                    np.minimum(0, for_energy_consumptions[prosumerName])
-                    * np.logical_not(test_sell_to_grid),
-                    sellprice_grid,
-                )
-
-        total_prosumer_cost = (
-            grid_money_from_prosumers + money_from_prosumers
-        )  # money leaving the prosumers
-
-        # profit maximizing
-        total_reward = money_from_prosumers - money_to_utility
-
-        return total_reward #, money_from_prosumers, money_to_utility, total_prosumer_cost
\ No newline at end of file
+        energy_consumptions = np.stack([
+            energy_consumption
+            for prosumer_name, energy_consumption in for_energy_consumptions.items()
+            if prosumer_name != "Total"
+        ])
+        total_reward, _, _, _ = self.get_rewards_twoprices(
+            energy_consumptions,
+            for_day,
+            buy_prices,
+            sell_prices,
+            total_consumption=np.asarray(for_energy_consumptions["Total"], dtype=np.float64),
+        )
+        return total_reward #, money_from_prosumers, money_to_utility, total_prosumer_cost
@@ -0,0 +1,101 @@
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Optional
+from .environment import EnvironmentArrays, EnvironmentDataDescriptor, MockEnvironment
+
+# bump when the compiled layout or the parsing in MockEnvironment changes
+ENVIRONMENT_CACHE_VERSION = 1
+# descriptor fields that change the compiled arrays, the others are applied when loading
+COMPILED_DESCRIPTOR_FIELDS = ("time_col_idx", "price_col_idx", "solar_gen_col_idx", "prosumer_col_idx_list", "pv_sizes")
+NUMERIC_ARRAY_FIELDS = [field.name for field in dataclasses.fields(EnvironmentArrays)]
+
+
+def get_environment_cache_key(building_data_path, building_metadata_path, environment_data_descriptor: EnvironmentDataDescriptor) -> str:
+    environment_hash = hashlib.sha256()
+    for file_path in (building_data_path, building_metadata_path):
+        with open(file_path, "rb") as data_file:
+            for block in iter(lambda: data_file.read(1 << 20), b""):
+                environment_hash.update(block)
+    descriptor_fields = {
+        field_name: getattr(environment_data_descriptor, field_name)
+        for field_name in COMPILED_DESCRIPTOR_FIELDS
+    }
+    environment_hash.update(json.dumps([ENVIRONMENT_CACHE_VERSION, descriptor_fields], default=list).encode())
+    return environment_hash.hexdigest()[:32]
+
+
+def save_compiled_environment(cache_path: Path, mock_environment: MockEnvironment):
+    """
+    Write the environment's arrays as one .npy file per field, so they can be memory-mapped when loading
+    """
+    cache_path = Path(cache_path)
+    # write next to the final folder and rename, so concurrent runs never see a partial artifact
+    tmp_path = cache_path.with_name(f"{cache_path.name}.tmp-{os.getpid()}")
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    for field_name in NUMERIC_ARRAY_FIELDS:
+        np.save(tmp_path.joinpath(f"{field_name}.npy"), getattr(mock_environment.arrays, field_name))
+    np.save(tmp_path.joinpath("pv_sizes.npy"), np.array([prosumer.pv_size for prosumer in mock_environment.prosumer_list], dtype=np.float64))
+    with open(tmp_path.joinpath("prosumer_names.json"), "w") as names_file:
+        json.dump([prosumer.name for prosumer in mock_environment.prosumer_list], names_file)
+    try:
+        tmp_path.rename(cache_path)
+    except OSError:
+        # another process compiled the same environment first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_compiled_environment(cache_path: Path, environment_data_descriptor: EnvironmentDataDescriptor, mmap_mode: Optional[str] = "r") -> MockEnvironment:
+    cache_path = Path(cache_path)
+    environment_arrays = EnvironmentArrays(**{
+        field_name: np.load(cache_path.joinpath(f"{field_name}.npy"), mmap_mode=mmap_mode)
+        for field_name in NUMERIC_ARRAY_FIELDS
+    })
+    pv_sizes = np.load(cache_path.joinpath("pv_sizes.npy"))
+    with open(cache_path.joinpath("prosumer_names.json")) as names_file:
+        prosumer_names = json.load(names_file)
+    return MockEnvironment.from_environment_arrays(environment_arrays, prosumer_names, pv_sizes, environment_data_descriptor)
+
+
+def load_environment(
+    building_data_path,
+    building_metadata_path,
+    environment_data_descriptor: EnvironmentDataDescriptor,
+    cache_dir: Optional[str] = None,
+) -> MockEnvironment:
+    """
+    Build the MockEnvironment for the building data, reusing a compiled artifact from cache_dir when
+    the CSV contents and the relevant descriptor fields are unchanged. cache_dir None disables caching.
+    """
+    if cache_dir is not None:
+        hash_start = time.perf_counter()
+        environment_cache_key = get_environment_cache_key(building_data_path, building_metadata_path, environment_data_descriptor)
+        cache_path = Path(cache_dir).joinpath(environment_cache_key)
+        hash_seconds = time.perf_counter() - hash_start
+        if cache_path.is_dir():
+            mock_environment = load_compiled_environment(cache_path, environment_data_descriptor)
+            mock_environment.construction_timings = {"hash_inputs": hash_seconds, **mock_environment.construction_timings}
+            # the inputs are already hashed, so response cache keys reuse the hash
+            mock_environment.prosumer_fleet.data_fingerprint = environment_cache_key
+            return mock_environment
+
+    read_start = time.perf_counter()
+    building_data_df = pd.read_csv(building_data_path).interpolate().fillna(0)
+    building_metadata_df =  pd.read_csv(building_metadata_path, index_col="building_id")
+    read_seconds = time.perf_counter() - read_start
+    mock_environment = MockEnvironment(
+        building_data_df=building_data_df,
+        building_metadata_df=building_metadata_df,
+        environment_data_descriptor=environment_data_descriptor,
+    )
+    mock_environment.construction_timings = {"read_csv": read_seconds, **mock_environment.construction_timings}
+    if cache_dir is not None:
+        save_compiled_environment(cache_path, mock_environment)
+        mock_environment.prosumer_fleet.data_fingerprint = environment_cache_key
+    return mock_environment
@@ -0,0 +1,333 @@
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from .dispatch import BATCHED_DISPATCH_SOLVERS, WARM_STARTED_DISPATCH_SOLVERS, DispatchResult, get_clipped_net_load, get_dispatch_solver
+from .real_prosumer import RealProsumer
+from .response_cache import ResponseCache, hash_arrays, hash_prices
+from .rng import SimulationRNG
+from .utils.constants import DAY_LENGTH
+
+# prosumers per batched solve, fixed so that the serial and process backends solve the same problems
+DEFAULT_DISPATCH_CHUNK_SIZE = 16
+
+
+@dataclass
+class ProsumerPopulation:
+    """
+    Demand of prosumers that copy a base profile of EnvironmentArrays.prosumer_demand, so that any number of
+    them share the base profiles instead of each holding a year of demand
+    """
+    demand_rows: np.ndarray # (num_prosumers,) base profile row copied by each prosumer
+    demand_scales: np.ndarray # (num_prosumers,) factor applied to the copied demand
+    day_shifts: np.ndarray # (num_prosumers,) day rows between the simulated day and the copied day
+
+    def get_fingerprints(self, data_fingerprint: str) -> List[str]:
+        """
+        data_fingerprint of the base profiles, extended with the row, scale and shift of every prosumer
+        """
+        return [
+            f"{data_fingerprint}:{demand_row}:{demand_scale!r}:{day_shift}"
+            for demand_row, demand_scale, day_shift in zip(self.demand_rows.tolist(), self.demand_scales.tolist(), self.day_shifts.tolist())
+        ]
+
+    def get_copied_day_rows(self, day_rows, num_days: int, prosumer_slice=slice(None)) -> np.ndarray:
+        """
+        Rows copied on day_rows by the prosumers in prosumer_slice, broadcast against each other
+
+        Shifts that would leave the num_days rows of data are taken the other way instead of wrapping around,
+        which would move a whole week shift by num_days % 7 days, and rows with no copy inside the data copy
+        themselves. A shift by whole weeks therefore always copies the same weekday.
+        """
+        day_shifts = self.day_shifts[prosumer_slice]
+        copied_day_rows = day_rows + day_shifts
+        is_outside = (copied_day_rows < 0) | (copied_day_rows >= num_days)
+        copied_day_rows = np.where(is_outside, day_rows - day_shifts, copied_day_rows)
+        is_outside = (copied_day_rows < 0) | (copied_day_rows >= num_days)
+        return np.where(is_outside, day_rows, copied_day_rows)
+
+    def get_loads(self, prosumer_demand: np.ndarray, day_row, prosumer_slice=slice(None)) -> np.ndarray:
+        """
+        Returns:
+            (num_prosumers, DAY_LENGTH) loads of the prosumers in prosumer_slice on day_row
+        """
+        copied_day_rows = self.get_copied_day_rows(day_row, prosumer_demand.shape[1], prosumer_slice)
+        return prosumer_demand[self.demand_rows[prosumer_slice], copied_day_rows] * self.demand_scales[prosumer_slice, None]
+
+
+class ProsumerFleet:
+    """
+    All prosumers of an environment, stacked into arrays so that a day can be solved for
+    every prosumer at once. Row i of every array belongs to prosumer_list[i].
+
+    Loads are row i of the environment's prosumer_demand, or given by population for fleets of synthetic prosumers.
+    """
+
+    def __init__(self, prosumer_list: List[RealProsumer], environment_arrays, dispatch_solver: Optional[str] = None, dispatch_chunk_size: int = DEFAULT_DISPATCH_CHUNK_SIZE, max_price_warm_starts: int = 64, population: Optional[ProsumerPopulation] = None, data_fingerprint: Optional[str] = None):
+        self.prosumer_list = prosumer_list
+        self.names = [prosumer.name for prosumer in prosumer_list]
+        self.dispatch_solver = dispatch_solver or prosumer_list[0].dispatch_solver
+        # prosumers are always dispatched in the same fixed chunks, whatever the backend or number of workers, so results
+        # do not depend on how chunks are scheduled: batched solvers can pick different optimal schedules when prices tie
+        self.dispatch_chunk_size = dispatch_chunk_size
+        self.response_cache = None
+        # warm starts for WARM_STARTED_DISPATCH_SOLVERS, kept in the parent process so that they do not depend on scheduling:
+        # the latest schedule of every prosumer, and the latest schedules solved under each recent set of prices
+        self.warm_starts = np.zeros((len(prosumer_list), DAY_LENGTH))
+        self.price_warm_starts: OrderedDict = OrderedDict()
+        self.max_price_warm_starts = max_price_warm_starts
+        self.dispatch_stats = {"solves": 0, "iterations": 0, "failures": 0, "seconds": 0.0}
+
+        self.battery_nums = np.array([prosumer.battery_num for prosumer in prosumer_list], dtype=np.float64)
+        self.pv_sizes = np.array([prosumer.pv_size for prosumer in prosumer_list], dtype=np.float64)
+        self.capacities = np.array([prosumer.capacity for prosumer in prosumer_list], dtype=np.float64)
+        self.etas = np.array([prosumer.eta for prosumer in prosumer_list], dtype=np.float64)
+        self.c_rates = np.array([prosumer.c_rate for prosumer in prosumer_list], dtype=np.float64)
+        self.max_rates = self.capacities * self.battery_nums * self.c_rates
+        self.maxgeneration = np.stack([prosumer.maxgeneration for prosumer in prosumer_list])
+
+        # EnvironmentArrays shared with the environment, prosumer_demand rows follow prosumer_list unless there is a population
+        self.environment_arrays = environment_arrays
+        self.population = population
+        # identifies the building data in response cache keys, hashed from environment_arrays when not given
+        self.data_fingerprint = data_fingerprint
+
+    def __len__(self):
+        return len(self.prosumer_list)
+
+    def get_dispatch_chunks(self, dispatch_solver=None) -> List[slice]:
+        dispatch_solver = dispatch_solver or self.dispatch_solver
+        # unbatched solvers handle prosumers one by one, so chunking cannot change their results
+        chunk_size = self.dispatch_chunk_size if dispatch_solver in BATCHED_DISPATCH_SOLVERS else 1
+        return [
+            slice(start, min(start + chunk_size, len(self)))
+            for start in range(0, len(self), chunk_size)
+        ]
+
+    def get_loads_and_generation(self, day, prosumer_slice=slice(None)):
+        """
+        Returns:
+            (num_prosumers, DAY_LENGTH) load and generation arrays for day
+        """
+        day_row = self.environment_arrays.get_day_rows(day)
+        if self.population is None:
+            loads = self.environment_arrays.prosumer_demand[prosumer_slice, day_row]
+        else:
+            loads = self.population.get_loads(self.environment_arrays.prosumer_demand, day_row, prosumer_slice)
+        gens = self.pv_sizes[prosumer_slice, None] * self.environment_arrays.hourly_solar_constants[day_row]
+        return loads, gens
+
+    def get_chunk_dispatch(self, prosumer_slice, day, buyprices, sellprices, num_optim_steps=10000, dispatch_solver=None, x0=None) -> Tuple[np.ndarray, DispatchResult]:
+        """
+        Solve the daily battery dispatch of the prosumers in prosumer_slice
+
+        Args:
+            x0: (chunk size, DAY_LENGTH) starting schedules, only used by WARM_STARTED_DISPATCH_SOLVERS
+        Returns:
+            noise free (chunk size, DAY_LENGTH) net loads, and the chunk's DispatchResult
+        """
+        dispatch_solver = dispatch_solver or self.dispatch_solver
+        loads, gens = self.get_loads_and_generation(day, prosumer_slice)
+        buyprices = np.asarray(buyprices, dtype=np.float64)
+        sellprices = np.asarray(sellprices, dtype=np.float64)
+        battery_nums = self.battery_nums[prosumer_slice]
+        capacities = self.capacities[prosumer_slice]
+        etas = self.etas[prosumer_slice]
+        c_rates = self.c_rates[prosumer_slice]
+
+        if dispatch_solver in BATCHED_DISPATCH_SOLVERS:
+            dispatch_result = BATCHED_DISPATCH_SOLVERS[dispatch_solver](
+                loads, gens, buyprices, sellprices,
+                battery_nums, capacities, etas, c_rates,
+                num_optim_steps,
+            )
+        else:
+            solve_dispatch = get_dispatch_solver(dispatch_solver)
+            warm_start_kwargs = (lambda idx: {"x0": x0[idx]}) if x0 is not None and dispatch_solver in WARM_STARTED_DISPATCH_SOLVERS else (lambda idx: {})
+            results = [
+                solve_dispatch(
+                    loads[idx], gens[idx], buyprices, sellprices,
+                    battery_num=battery_nums[idx],
+                    capacity=capacities[idx],
+                    eta=etas[idx],
+                    c_rate=c_rates[idx],
+                    num_optim_steps=num_optim_steps,
+                    **warm_start_kwargs(idx),
+                )
+                for idx in range(loads.shape[0])
+            ]
+            dispatch_result = DispatchResult(
+                x=np.stack([result.x for result in results]),
+                success=all(result.success for result in results),
+                nit=sum(result.nit for result in results),
+                seconds=sum(result.seconds for result in results),
+            )
+        nets = get_clipped_net_load(loads, gens, dispatch_result.x, etas[:, None], self.max_rates[prosumer_slice, None])
+        return nets, dispatch_result
+
+    def get_chunk_optimal_nets(self, prosumer_slice, day, buyprices, sellprices, num_optim_steps=10000, dispatch_solver=None, x0=None):
+        """
+        Noise free net load of the prosumers in prosumer_slice, after solving their daily battery dispatch
+        """
+        return self.get_chunk_dispatch(prosumer_slice, day, buyprices, sellprices, num_optim_steps, dispatch_solver, x0)[0]
+
+    def record_dispatch(self, prosumer_slice, dispatch_result: DispatchResult, price_hash=None):
+        self.dispatch_stats["solves"] += len(dispatch_result.x)
+        self.dispatch_stats["iterations"] += dispatch_result.nit
+        self.dispatch_stats["failures"] += not dispatch_result.success
+        self.dispatch_stats["seconds"] += dispatch_result.seconds
+        self.warm_starts[prosumer_slice] = dispatch_result.x
+        if price_hash is not None:
+            price_warm_starts = self.price_warm_starts.setdefault(price_hash, self.warm_starts.copy())
+            price_warm_starts[prosumer_slice] = dispatch_result.x
+            self.price_warm_starts.move_to_end(price_hash)
+            while len(self.price_warm_starts) > self.max_price_warm_starts:
+                self.price_warm_starts.popitem(last=False)
+
+    def get_warm_starts(self, price_hash) -> np.ndarray:
+        """
+        Starting schedules for the next solve: those last solved under the same prices, else each prosumer's latest
+        """
+        if price_hash in self.price_warm_starts:
+            return self.price_warm_starts[price_hash]
+        return self.warm_starts
+
+    def dispatch_report(self) -> str:
+        stats = self.dispatch_stats
+        mean_iterations = stats["iterations"] / stats["solves"] if stats["solves"] else 0.0
+        return (
+            f"Dispatch: {stats['solves']} solves, {mean_iterations:.1f} iterations per solve, "
+            f"{stats['failures']} failed chunks, {stats['seconds']:.2f}s solving"
+        )
+
+    def get_state(self) -> Dict:
+        """
+        Warm starts and dispatch counters, the state a resumed run needs to solve exactly as before
+        """
+        return {
+            "warm_starts": self.warm_starts.copy(),
+            "price_warm_starts": OrderedDict((price_hash, x.copy()) for price_hash, x in self.price_warm_starts.items()),
+            "dispatch_stats": dict(self.dispatch_stats),
+        }
+
+    def set_state(self, state: Dict):
+        self.warm_starts = state["warm_starts"].copy()
+        self.price_warm_starts = OrderedDict((price_hash, x.copy()) for price_hash, x in state["price_warm_starts"].items())
+        self.dispatch_stats = dict(state["dispatch_stats"])
+
+    def reset_warm_starts(self):
+        """
+        Forget every schedule solved so far, so the next solves do not depend on what was simulated before
+        """
+        self.warm_starts = np.zeros((len(self), DAY_LENGTH))
+        self.price_warm_starts = OrderedDict()
+
+    def get_data_fingerprint(self) -> str:
+        if self.data_fingerprint is None:
+            self.data_fingerprint = hash_arrays(
+                self.environment_arrays.days,
+                self.environment_arrays.prosumer_demand,
+                self.environment_arrays.hourly_solar_constants,
+            )
+        return self.data_fingerprint
+
+    def set_response_cache(self, response_cache: Optional[ResponseCache]):
+        self.response_cache = response_cache
+        if self.population is None:
+            prosumer_fingerprints = [f"{self.get_data_fingerprint()}:{prosumer_idx}" for prosumer_idx in range(len(self))]
+        else:
+            prosumer_fingerprints = self.population.get_fingerprints(self.get_data_fingerprint())
+        for prosumer, prosumer_fingerprint in zip(self.prosumer_list, prosumer_fingerprints):
+            prosumer.response_cache = response_cache
+            prosumer.data_fingerprint = prosumer_fingerprint
+
+    def get_cache_keys(self, prosumer_slice, day, price_hash, num_optim_steps, dispatch_solver):
+        if dispatch_solver in BATCHED_DISPATCH_SOLVERS:
+            # batched solves depend on the chunk they are solved in
+            dispatch_solver = f"{dispatch_solver}:chunk{self.dispatch_chunk_size}"
+        return [
+            self.response_cache.make_key(
+                prosumer.name, prosumer.battery_num, prosumer.pv_size, day, dispatch_solver, num_optim_steps, price_hash, prosumer.data_fingerprint,
+            )
+            for prosumer in self.prosumer_list[prosumer_slice]
+        ]
+
+    def get_optimal_nets(self, day, buyprices, sellprices, num_optim_steps=10000, dispatch_solver=None, solve_chunks=None):
+        """
+        Noise free net load of every prosumer, after solving the daily battery dispatch
+
+        Chunks whose prosumers are all in the response cache are not solved again. Solutions of
+        WARM_STARTED_DISPATCH_SOLVERS depend on the schedules solved before them, and a cache hit would skip
+        updating the warm starts, so they are never cached. solve_chunks maps
+        a list of prosumer slices and their starting schedules to (net loads, DispatchResult) pairs,
+        defaulting to solving them one after another.
+
+        Returns:
+            (num_prosumers, DAY_LENGTH) array
+        """
+        dispatch_solver = dispatch_solver or self.dispatch_solver
+        if solve_chunks is None:
+            solve_chunks = lambda prosumer_slices, chunk_x0s: [
+                self.get_chunk_dispatch(prosumer_slice, day, buyprices, sellprices, num_optim_steps, dispatch_solver, x0)
+                for prosumer_slice, x0 in zip(prosumer_slices, chunk_x0s)
+            ]
+        prosumer_slices = self.get_dispatch_chunks(dispatch_solver)
+        is_warm_started = dispatch_solver in WARM_STARTED_DISPATCH_SOLVERS
+        response_cache = None if is_warm_started else self.response_cache
+        price_hash = hash_prices(buyprices, sellprices) if is_warm_started or response_cache is not None else None
+        warm_starts = self.get_warm_starts(price_hash) if is_warm_started else None
+
+        def solve_missing_chunks(chunk_idxs):
+            missing_slices = [prosumer_slices[chunk_idx] for chunk_idx in chunk_idxs]
+            chunk_x0s = [warm_starts[prosumer_slice] if is_warm_started else None for prosumer_slice in missing_slices]
+            chunk_solutions = solve_chunks(missing_slices, chunk_x0s)
+            for prosumer_slice, (_, dispatch_result) in zip(missing_slices, chunk_solutions):
+                self.record_dispatch(prosumer_slice, dispatch_result, price_hash if is_warm_started else None)
+            return [nets for nets, _ in chunk_solutions]
+
+        if response_cache is None:
+            return np.concatenate(solve_missing_chunks(range(len(prosumer_slices))))
+
+        chunk_nets = [None] * len(prosumer_slices)
+        chunk_keys = []
+        for chunk_idx, prosumer_slice in enumerate(prosumer_slices):
+            cache_keys = self.get_cache_keys(prosumer_slice, day, price_hash, num_optim_steps, dispatch_solver)
+            chunk_keys.append(cache_keys)
+            cached_nets = [response_cache.get(cache_key) for cache_key in cache_keys]
+            if all(cached_net is not None for cached_net in cached_nets):
+                chunk_nets[chunk_idx] = np.stack(cached_nets)
+
+        missing_chunk_idxs = [chunk_idx for chunk_idx, nets in enumerate(chunk_nets) if nets is None]
+        solved_nets = solve_missing_chunks(missing_chunk_idxs)
+        for chunk_idx, nets in zip(missing_chunk_idxs, solved_nets):
+            chunk_nets[chunk_idx] = nets
+            for cache_key, net in zip(chunk_keys[chunk_idx], nets):
+                response_cache.put(cache_key, net)
+        return np.concatenate(chunk_nets)
+
+    def add_noise(self, calculated_demand, day, year, simulation_rng: Optional[SimulationRNG] = None):
+        """
+        Adds prosumer and generation noise for the whole fleet at once
+
+        Noise comes from the day's streams of simulation_rng, a SimulationRNG with fresh entropy when None, and
+        equals the noise RealProsumer.get_real_response_twoprices adds for each prosumer with the same simulation_rng
+        """
+        if simulation_rng is None:
+            simulation_rng = SimulationRNG()
+        noise_scales = np.array([prosumer.noise_scale for prosumer in self.prosumer_list], dtype=np.float64)
+        generation_noise_scales = np.array([prosumer.generation_noise_scale for prosumer in self.prosumer_list], dtype=np.float64)
+        noise = np.abs(calculated_demand * noise_scales[:, None]) * simulation_rng.get_demand_noise(day, year, self.names)
+        standard_generation_noise = simulation_rng.get_generation_noise(day, year)
+        generation_noise = np.abs(self.maxgeneration * generation_noise_scales[:, None]) * standard_generation_noise
+
+        return calculated_demand + noise + generation_noise
+
+    def get_real_responses_twoprices(self, day, buyprices, sellprices, year = None, num_optim_steps=10000, dispatch_solver=None, simulation_rng: Optional[SimulationRNG] = None):
+        """
+        Determines the net load of every prosumer on a specific day, in response to energy prices
+
+        Returns:
+            (num_prosumers, DAY_LENGTH) demand matrix, rows ordered as prosumer_list
+        """
+        calculated_demand = self.get_optimal_nets(day, buyprices, sellprices, num_optim_steps, dispatch_solver)
+        return self.add_noise(calculated_demand, day, year, simulation_rng)
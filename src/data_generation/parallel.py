@@ -0,0 +1,59 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from .fleet import ProsumerFleet
+
+BACKENDS = ("serial", "process")
+
+# fleet shipped once to every worker process by _initialize_worker
+_worker_fleet: ProsumerFleet = None
+
+
+def _initialize_worker(fleet: ProsumerFleet):
+    global _worker_fleet
+    _worker_fleet = fleet
+
+
+def _solve_chunk(prosumer_slice, day, buyprices, sellprices, num_optim_steps, dispatch_solver, x0):
+    return _worker_fleet.get_chunk_dispatch(prosumer_slice, day, buyprices, sellprices, num_optim_steps, dispatch_solver, x0)
+
+
+class ParallelFleetSolver:
+    """
+    Fans the fleet's dispatch chunks out to a process pool. Each worker receives the fleet once
+    at start up, tasks only carry the day, the prices, the chunk's prosumer slice and its warm starts.
+    Chunks are reassembled in prosumer order, so results match ProsumerFleet.get_optimal_nets,
+    and the response cache and warm starts are only kept in the parent process.
+
+    Chunks are the fleet's fixed dispatch chunks, whatever the number of workers, so batched solvers solve the
+    same problems as on the serial backend and results are bit-identical, even when prices tie.
+    """
+
+    def __init__(self, fleet: ProsumerFleet, workers: int):
+        self.fleet = fleet
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_initialize_worker,
+            initargs=(fleet,),
+        )
+
+    def get_optimal_nets(self, day, buyprices, sellprices, num_optim_steps=10000, dispatch_solver=None):
+        buyprices = np.asarray(buyprices, dtype=np.float64)
+        sellprices = np.asarray(sellprices, dtype=np.float64)
+
+        def solve_chunks(prosumer_slices, chunk_x0s):
+            futures = [
+                self.executor.submit(_solve_chunk, prosumer_slice, day, buyprices, sellprices, num_optim_steps, dispatch_solver, x0)
+                for prosumer_slice, x0 in zip(prosumer_slices, chunk_x0s)
+            ]
+            return [future.result() for future in futures]
+
+        return self.fleet.get_optimal_nets(day, buyprices, sellprices, num_optim_steps, dispatch_solver, solve_chunks)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,131 @@
+import time
+import numpy as np
+import pandas as pd
+from typing import Optional, Sequence
+from .environment import MockEnvironment
+from .fleet import ProsumerFleet, ProsumerPopulation
+from .real_prosumer import RealProsumer
+
+
+class PopulationProsumer(RealProsumer):
+    """
+    Prosumer of a ProsumerPopulation, its year of demand is only built when yearlongdemand is read
+
+    Simulations take loads from the fleet, so only code inspecting single prosumers pays for the DataFrame.
+    """
+
+    def __init__(self, name, population: ProsumerPopulation, population_idx: int, prosumer_demand: np.ndarray, yearlonggeneration, **prosumer_kwargs):
+        self.population = population
+        self.population_idx = population_idx
+        self.prosumer_demand = prosumer_demand
+        super().__init__(name, None, yearlonggeneration, **prosumer_kwargs)
+
+    @property
+    def yearlongdemand(self) -> pd.DataFrame:
+        num_days = self.prosumer_demand.shape[1]
+        copied_day_rows = self.population.get_copied_day_rows(np.arange(num_days), num_days, self.population_idx)
+        demand = self.prosumer_demand[self.population.demand_rows[self.population_idx], copied_day_rows]
+        return pd.DataFrame(
+            demand * self.population.demand_scales[self.population_idx],
+            index=self.yearlonggeneration.index,
+            columns=self.yearlonggeneration.columns,
+        )
+
+    @yearlongdemand.setter
+    def yearlongdemand(self, yearlongdemand):
+        # RealProsumer.__init__ sets it to the None passed above
+        if yearlongdemand is not None:
+            raise AttributeError("Demand of a population prosumer follows its base profile and cannot be set")
+
+
+def generate_prosumer_population(
+    mock_environment: MockEnvironment,
+    num_prosumers: int,
+    seed: Optional[int] = None,
+    size_sigma: float = 0.3,
+    pv_size_sigma: float = 0.2,
+    max_week_shift: int = 2,
+    battery_num_choices: Optional[Sequence[int]] = None,
+    include_base: bool = True,
+) -> MockEnvironment:
+    """
+    Environment of num_prosumers synthetic prosumers resampled from the real prosumers of mock_environment
+
+    Every synthetic prosumer copies the demand of a randomly drawn real prosumer, shifted by whole weeks so that
+    weekdays stay weekdays (near the ends of the data the shift is taken the other way, see
+    ProsumerPopulation.get_copied_day_rows), and scaled by a lognormal building size factor. Its pv size is the real prosumer's,
+    which follows the building's sqm, scaled by the same size factor and a lognormal perturbation of its own.
+    Battery counts are copied from the real prosumer, or drawn from battery_num_choices.
+
+    Demand is never copied, the returned environment shares its arrays and tables with mock_environment and
+    each prosumer only adds a row, a scale and a shift to its ProsumerPopulation.
+
+    Args:
+        seed: seeds the sampling, the same seed always gives the same population
+        size_sigma: sigma of the log of the building size factor
+        pv_size_sigma: sigma of the log of the pv size perturbation
+        max_week_shift: demand is shifted by up to this many weeks, either way
+        battery_num_choices: battery counts drawn uniformly, None copies the real prosumer's
+        include_base: whether the first prosumers are the real prosumers, unchanged
+    """
+    if mock_environment.prosumer_fleet.population is not None:
+        raise ValueError("Populations are generated from real prosumers, not from another population")
+    phase_start = time.perf_counter()
+    base_list = mock_environment.prosumer_list
+    arrays = mock_environment.arrays
+    rng = np.random.default_rng(seed)
+
+    num_kept = min(len(base_list), num_prosumers) if include_base else 0
+    num_synthetic = num_prosumers - num_kept
+    source_rows = np.concatenate([np.arange(num_kept), rng.integers(len(base_list), size=num_synthetic)])
+    size_scales = np.concatenate([np.ones(num_kept), rng.lognormal(0, size_sigma, num_synthetic)])
+    pv_size_scales = np.concatenate([np.ones(num_kept), rng.lognormal(0, pv_size_sigma, num_synthetic)])
+    day_shifts = np.concatenate([np.zeros(num_kept, dtype=np.int64), 7 * rng.integers(-max_week_shift, max_week_shift + 1, num_synthetic)])
+    battery_nums = [base_list[source_row].battery_num for source_row in source_rows]
+    if battery_num_choices is not None:
+        battery_nums[num_kept:] = rng.choice(battery_num_choices, num_synthetic).tolist()
+
+    population = ProsumerPopulation(
+        demand_rows=source_rows,
+        demand_scales=size_scales,
+        day_shifts=day_shifts,
+    )
+    pv_sizes = mock_environment.prosumer_fleet.pv_sizes[source_rows] * size_scales * pv_size_scales
+    max_solar_constants = MockEnvironment.get_max_solar_constants(arrays.days, arrays.hourly_solar_constants)
+    prosumer_list = []
+    for population_idx, source_row in enumerate(source_rows):
+        source = base_list[source_row]
+        prosumer_list.append(PopulationProsumer(
+            name=source.name if population_idx < num_kept else f"{source.name}_{population_idx}",
+            population=population,
+            population_idx=population_idx,
+            prosumer_demand=arrays.prosumer_demand,
+            yearlonggeneration=mock_environment.hourly_solar_constants,
+            battery_num=battery_nums[population_idx],
+            pv_size=pv_sizes[population_idx],
+            noise_scale=source.noise_scale,
+            generation_noise_scale=source.generation_noise_scale,
+            dispatch_solver=source.dispatch_solver,
+            maxgeneration=pv_sizes[population_idx] * max_solar_constants,
+        ))
+
+    population_environment = MockEnvironment.__new__(MockEnvironment)
+    population_environment.hourly_solar_constants = mock_environment.hourly_solar_constants
+    population_environment.utility_hourly_buy_prices = mock_environment.utility_hourly_buy_prices
+    population_environment.utility_hourly_sell_prices = mock_environment.utility_hourly_sell_prices
+    population_environment.weekday_dict = mock_environment.weekday_dict
+    population_environment.prosumer_list = prosumer_list
+    population_environment.arrays = arrays
+    population_environment.prosumer_fleet = ProsumerFleet(
+        prosumer_list,
+        arrays,
+        mock_environment.prosumer_fleet.dispatch_solver,
+        dispatch_chunk_size=mock_environment.prosumer_fleet.dispatch_chunk_size,
+        population=population,
+        data_fingerprint=mock_environment.prosumer_fleet.data_fingerprint,
+    )
+    population_environment.construction_timings = {
+        **mock_environment.construction_timings,
+        "generate_prosumer_population": time.perf_counter() - phase_start,
+    }
+    return population_environment
@@ -1,6 +1,23 @@
 import numpy as np
-import datetime
 from.utils.constants import DAY_LENGTH
+from.utils.dates import get_year_weekdays, is_weekday
+
+# Every get_*_prices_generation_function returns a function generating one day of prices, with a
+# .batched attribute generating many days at once:
+#   batched(days, years, utility_hourly_buy_prices, utility_hourly_sell_prices, rng=None, simulation_rng=None)
+# days and years are (num_days,) arrays and prices (num_days, DAY_LENGTH) matrices. Random functions draw
+# every day at once from rng (np.random when None), or, given a SimulationRNG, from the same per day
+# streams a seeded simulation uses, so the schedule matches the seeded simulation exactly.
+
+PEAK_HOURS = [15, 16, 17, 18, 19]
+# peak hour mask
+PEAK_HOUR_MASK = np.isin(np.arange(DAY_LENGTH), PEAK_HOURS)
+
+
+def with_batched(prices_generation_function, batched_prices_generation_function):
+    prices_generation_function.batched = batched_prices_generation_function
+    return prices_generation_function
+
 
 def get_baseline_prices_generation_function(
     **args,
@@ -12,8 +29,11 @@ def get_baseline_prices_generation_function(
         utility_hourly_sell_price:np.ndarray,
     ):
         return utility_hourly_buy_price, utility_hourly_sell_price
+
+    def batched_baseline_prices_generation_function(days, years, utility_hourly_buy_prices, utility_hourly_sell_prices, rng=None, simulation_rng=None):
+        return np.array(utility_hourly_buy_prices, dtype=np.float64), np.array(utility_hourly_sell_prices, dtype=np.float64)
         
-    return baseline_prices_generation_function
+    return with_batched(baseline_prices_generation_function, batched_baseline_prices_generation_function)
 
 # always uses offset
 def get_constant_prices_generation_function(
@@ -31,7 +51,11 @@ def get_constant_prices_generation_function(
         microgrid_day_buy_prices = utility_hourly_buy_price - offset_multiplier*price_diff
         microgrid_day_sell_prices = utility_hourly_sell_price + offset_multiplier*price_diff
         return microgrid_day_buy_prices, microgrid_day_sell_prices
-    return constant_prices_generation_function
+
+    def batched_constant_prices_generation_function(days, years, utility_hourly_buy_prices, utility_hourly_sell_prices, rng=None, simulation_rng=None):
+        # the same elementwise arithmetic as one day at a time
+        return constant_prices_generation_function(None, None, np.asarray(utility_hourly_buy_prices), np.asarray(utility_hourly_sell_prices))
+    return with_batched(constant_prices_generation_function, batched_constant_prices_generation_function)
 
 # uses offset on weekdays
 def get_constant_peak_day_prices_generation_function(
@@ -45,10 +69,7 @@ def get_constant_peak_day_prices_generation_function(
         utility_hourly_buy_price:np.ndarray, 
         utility_hourly_sell_price:np.ndarray,
     ):
-        date_object = datetime.datetime(year, 1, 1) + datetime.timedelta(day - 1)
-        if year%4 == 0 and day >= 59:
-            date_object+= datetime.timedelta(1)
-        weekday = date_object.weekday()
+        weekday = get_year_weekdays(year)[day]
         if weekday > 4:
             # weekend
             price_diff = utility_hourly_buy_price - utility_hourly_sell_price
@@ -62,7 +83,14 @@ def get_constant_peak_day_prices_generation_function(
             microgrid_day_buy_prices = utility_hourly_buy_price - offset_multiplier*price_diff
             microgrid_day_sell_prices = utility_hourly_sell_price + offset_multiplier*price_diff
         return microgrid_day_buy_prices, microgrid_day_sell_prices
-    return constant_peak_day_prices_generation_function
+
+    def batched_constant_peak_day_prices_generation_function(days, years, utility_hourly_buy_prices, utility_hourly_sell_prices, rng=None, simulation_rng=None):
+        utility_hourly_buy_prices = np.asarray(utility_hourly_buy_prices)
+        utility_hourly_sell_prices = np.asarray(utility_hourly_sell_prices)
+        multipliers = np.where(is_weekday(days, years), offset_multiplier, off_peak_offset_multiplier)[:, None]
+        price_diff = utility_hourly_buy_prices - utility_hourly_sell_prices
+        return utility_hourly_buy_prices - multipliers*price_diff, utility_hourly_sell_prices + multipliers*price_diff
+    return with_batched(constant_peak_day_prices_generation_function, batched_constant_peak_day_prices_generation_function)
 
 # uses offset on peak hours
 def get_constant_peak_hour_prices_generation_function(
@@ -70,16 +98,15 @@ def get_constant_peak_hour_prices_generation_function(
     off_peak_offset_multiplier=0,
     **args,
 ):
+    peak_hour_multipliers = offset_multiplier*PEAK_HOUR_MASK + off_peak_offset_multiplier*(~PEAK_HOUR_MASK)
+
     def constant_peak_hour_prices_generation_function(
         day:int, 
         year:int, 
         utility_hourly_buy_price:np.ndarray, 
         utility_hourly_sell_price:np.ndarray,
     ):
-        date_object = datetime.datetime(year, 1, 1) + datetime.timedelta(day - 1)
-        if year%4 == 0 and day >= 59:
-            date_object+= datetime.timedelta(1)
-        weekday = date_object.weekday()
+        weekday = get_year_weekdays(year)[day]
         if weekday > 4:
             # weekend
             price_diff = utility_hourly_buy_price - utility_hourly_sell_price
@@ -89,16 +116,23 @@ def get_constant_peak_hour_prices_generation_function(
         else:
             # weekday
             price_diff = utility_hourly_buy_price - utility_hourly_sell_price
-
-            # peak hour mask
-            PEAK_HOURS = [15, 16, 17, 18, 19]
-            mask = np.isin(np.arange(24), PEAK_HOURS)
             
-            microgrid_day_buy_prices = utility_hourly_buy_price - price_diff*(offset_multiplier*mask + off_peak_offset_multiplier*(~mask))
-            microgrid_day_sell_prices = utility_hourly_sell_price + price_diff*(offset_multiplier*mask + off_peak_offset_multiplier*(~mask))
+            microgrid_day_buy_prices = utility_hourly_buy_price - price_diff*peak_hour_multipliers
+            microgrid_day_sell_prices = utility_hourly_sell_price + price_diff*peak_hour_multipliers
 
         return microgrid_day_buy_prices, microgrid_day_sell_prices
-    return constant_peak_hour_prices_generation_function
+
+    def batched_constant_peak_hour_prices_generation_function(days, years, utility_hourly_buy_prices, utility_hourly_sell_prices, rng=None, simulation_rng=None):
+        utility_hourly_buy_prices = np.asarray(utility_hourly_buy_prices)
+        utility_hourly_sell_prices = np.asarray(utility_hourly_sell_prices)
+        price_diff = utility_hourly_buy_prices - utility_hourly_sell_prices
+        weekday_mask = is_weekday(days, years)
+        microgrid_buy_prices = utility_hourly_buy_prices - off_peak_offset_multiplier*price_diff
+        microgrid_sell_prices = utility_hourly_sell_prices + off_peak_offset_multiplier*price_diff
+        microgrid_buy_prices[weekday_mask] = (utility_hourly_buy_prices - price_diff*peak_hour_multipliers)[weekday_mask]
+        microgrid_sell_prices[weekday_mask] = (utility_hourly_sell_prices + price_diff*peak_hour_multipliers)[weekday_mask]
+        return microgrid_buy_prices, microgrid_sell_prices
+    return with_batched(constant_peak_hour_prices_generation_function, batched_constant_peak_hour_prices_generation_function)
 
 
 
@@ -113,24 +147,42 @@ def get_random_prices_generation_function(
         year:int, 
         utility_hourly_buy_price:np.ndarray, 
         utility_hourly_sell_price:np.ndarray,
-        
+        rng:np.random.Generator = None,
     ):
+        # draws from the simulation's price stream when given, the global state otherwise
+        random_state = np.random if rng is None else rng
         price_diff = utility_hourly_buy_price - utility_hourly_sell_price
         offset = offset_multiplier*price_diff
         scale = scale_multiplier*price_diff
         
         mean_microgrid_day_buy_prices = utility_hourly_buy_price - offset
-        microgrid_day_buy_prices_noise = np.random.normal(0, scale, DAY_LENGTH)
+        microgrid_day_buy_prices_noise = random_state.normal(0, scale, DAY_LENGTH)
         microgrid_day_buy_prices = mean_microgrid_day_buy_prices + microgrid_day_buy_prices_noise
         
         mean_microgrid_day_sell_prices = utility_hourly_sell_price + offset
-        microgrid_day_sell_prices_noise = np.random.normal(0, scale, DAY_LENGTH)
+        microgrid_day_sell_prices_noise = random_state.normal(0, scale, DAY_LENGTH)
         microgrid_day_sell_prices = mean_microgrid_day_sell_prices + microgrid_day_sell_prices_noise
         
         
         return microgrid_day_buy_prices, microgrid_day_sell_prices
+
+    def batched_random_prices_generation_function(days, years, utility_hourly_buy_prices, utility_hourly_sell_prices, rng=None, simulation_rng=None):
+        if simulation_rng is not None:
+            return stack_day_prices([
+                random_prices_generation_function(day, year, utility_hourly_buy_price, utility_hourly_sell_price, simulation_rng.get_prices_generator(day, year))
+                for day, year, utility_hourly_buy_price, utility_hourly_sell_price in zip(days, years, utility_hourly_buy_prices, utility_hourly_sell_prices)
+            ])
+        random_state = np.random if rng is None else rng
+        utility_hourly_buy_prices = np.asarray(utility_hourly_buy_prices)
+        utility_hourly_sell_prices = np.asarray(utility_hourly_sell_prices)
+        price_diff = utility_hourly_buy_prices - utility_hourly_sell_prices
+        offset = offset_multiplier*price_diff
+        scale = scale_multiplier*price_diff
+        microgrid_buy_prices = utility_hourly_buy_prices - offset + random_state.normal(0, scale)
+        microgrid_sell_prices = utility_hourly_sell_prices + offset + random_state.normal(0, scale)
+        return microgrid_buy_prices, microgrid_sell_prices
     
-    return random_prices_generation_function
+    return with_batched(random_prices_generation_function, batched_random_prices_generation_function)
 
 
 # randomly 
@@ -143,11 +195,12 @@ def get_grouped_random_prices_generation_function(
         year:int, 
         utility_hourly_buy_price:np.ndarray, 
         utility_hourly_sell_price:np.ndarray,
-        
+        rng:np.random.Generator = None,
     ):
+        random_state = np.random if rng is None else rng
         price_diff = utility_hourly_buy_price - utility_hourly_sell_price
         offset = offset_multiplier*price_diff
-        direction = np.random.choice([-1, 0, 1])
+        direction = random_state.choice([-1, 0, 1])
         
         offset_day_buy_prices = utility_hourly_buy_price + offset * (-1 + direction)
         
@@ -155,6 +208,39 @@ def get_grouped_random_prices_generation_function(
         
         
         return offset_day_buy_prices, offset_day_sell_prices
+
+    def batched_grouped_random_prices_generation_function(days, years, utility_hourly_buy_prices, utility_hourly_sell_prices, rng=None, simulation_rng=None):
+        if simulation_rng is not None:
+            return stack_day_prices([
+                grouped_random_prices_generation_function(day, year, utility_hourly_buy_price, utility_hourly_sell_price, simulation_rng.get_prices_generator(day, year))
+                for day, year, utility_hourly_buy_price, utility_hourly_sell_price in zip(days, years, utility_hourly_buy_prices, utility_hourly_sell_prices)
+            ])
+        random_state = np.random if rng is None else rng
+        utility_hourly_buy_prices = np.asarray(utility_hourly_buy_prices)
+        utility_hourly_sell_prices = np.asarray(utility_hourly_sell_prices)
+        offset = offset_multiplier*(utility_hourly_buy_prices - utility_hourly_sell_prices)
+        directions = random_state.choice([-1, 0, 1], size=len(utility_hourly_buy_prices))[:, None]
+        return utility_hourly_buy_prices + offset * (-1 + directions), utility_hourly_sell_prices + offset * (1 + directions)
     
-    return grouped_random_prices_generation_function
-    
\ No newline at end of file
+    return with_batched(grouped_random_prices_generation_function, batched_grouped_random_prices_generation_function)
+
+
+def stack_day_prices(day_prices):
+    buy_prices, sell_prices = zip(*day_prices)
+    return np.stack(buy_prices), np.stack(sell_prices)
+
+
+def generate_price_schedule(prices_generation_function, days, years, utility_hourly_buy_prices, utility_hourly_sell_prices, rng=None, simulation_rng=None):
+    """
+    Prices for many days at once, falling back to one day at a time for functions without a batched form
+
+    Returns:
+        (num_days, DAY_LENGTH) buy and sell price matrices
+    """
+    batched_prices_generation_function = getattr(prices_generation_function, "batched", None)
+    if batched_prices_generation_function is not None:
+        return batched_prices_generation_function(days, years, utility_hourly_buy_prices, utility_hourly_sell_prices, rng=rng, simulation_rng=simulation_rng)
+    return stack_day_prices([
+        prices_generation_function(day, year, utility_hourly_buy_price, utility_hourly_sell_price)
+        for day, year, utility_hourly_buy_price, utility_hourly_sell_price in zip(days, years, utility_hourly_buy_prices, utility_hourly_sell_prices)
+    ])
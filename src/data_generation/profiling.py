@@ -0,0 +1,80 @@
+import contextlib
+import time
+from typing import Dict
+
+
+class Profiler:
+    """
+    Wall time per phase and named counters of a simulation run
+
+    Phases are timed with `with profiler.phase(name):`, their times are summed over the run and also
+    kept for the current step so they can be logged per step.
+    """
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counters: Dict[str, float] = {}
+        self.step_timings: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def phase(self, phase_name: str):
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase_name, time.perf_counter() - phase_start)
+
+    def add_time(self, phase_name: str, seconds: float):
+        self.timings[phase_name] = self.timings.get(phase_name, 0.0) + seconds
+        self.calls[phase_name] = self.calls.get(phase_name, 0) + 1
+        self.step_timings[phase_name] = self.step_timings.get(phase_name, 0.0) + seconds
+
+    def count(self, counter_name: str, value=1):
+        self.counters[counter_name] = self.counters.get(counter_name, 0) + value
+
+    def start_step(self):
+        self.step_timings = {}
+
+    def get_step_metrics(self) -> Dict[str, float]:
+        return {f"profile/{phase_name}_seconds": seconds for phase_name, seconds in self.step_timings.items()}
+
+    def as_dict(self) -> Dict:
+        return {"timings": dict(self.timings), "calls": dict(self.calls), "counters": dict(self.counters)}
+
+    def report(self) -> str:
+        total = sum(self.timings.values())
+        name_width = max([len(name) for name in (*self.timings, *self.counters)] + [len("phase")])
+        lines = [f"{'phase':<{name_width}} {'seconds':>10} {'share':>7} {'calls':>8} {'ms/call':>9}"]
+        for phase_name, seconds in sorted(self.timings.items(), key=lambda item: -item[1]):
+            calls = self.calls[phase_name]
+            lines.append(
+                f"{phase_name:<{name_width}} {seconds:>10.3f} {seconds / total if total else 0:>7.1%} {calls:>8} {1000 * seconds / calls:>9.3f}"
+            )
+        if self.counters:
+            lines.append("")
+            lines.append(f"{'counter':<{name_width}} {'value':>10}")
+            for counter_name, value in self.counters.items():
+                lines.append(f"{counter_name:<{name_width}} {value:>10.6g}")
+        return "\n".join(lines)
+
+
+class NullProfiler(Profiler):
+    """
+    Profiler that records nothing, used when a run is not profiled
+    """
+
+    def phase(self, phase_name: str):
+        return contextlib.nullcontext()
+
+    def add_time(self, phase_name: str, seconds: float):
+        pass
+
+    def count(self, counter_name: str, value=1):
+        pass
+
+    def start_step(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
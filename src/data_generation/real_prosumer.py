@@ -1,18 +1,11 @@
-import contextlib
 import numpy as np
-from .utils.constants import DAY_LENGTH, YEAR_LENGTH
-from scipy.optimize import minimize
+from typing import Optional
+from .utils.constants import YEAR_LENGTH
+from .dispatch import get_clipped_net_load, get_dispatch_solver
+from .profiling import NULL_PROFILER
+from .response_cache import hash_prices
+from .rng import SimulationRNG
 
-
-@contextlib.contextmanager
-def temp_seed(seed):
-    state = np.random.get_state()
-    np.random.seed(seed)
-    try:
-        yield
-    finally:
-        np.random.set_state(state)
-        
 class RealProsumer:
     
     def __init__(
@@ -23,17 +16,19 @@ class RealProsumer:
         battery_num=0,
         pv_size=0,
         noise_scale=0.1,
-        generation_noise_scale=0.1
+        generation_noise_scale=0.1,
+        dispatch_solver="slsqp",
+        maxgeneration=None,
     ):
         self.name = name.replace(" (kWh)", "")
         self.yearlongdemand = yearlongdemand
         self.yearlonggeneration = yearlonggeneration
-        max_gen_by_hour = np.zeros(DAY_LENGTH)
-        for day_number in range(0, YEAR_LENGTH):
-            if day_number in self.yearlonggeneration.index:
-                gen = pv_size * self.yearlonggeneration.loc[day_number, :]
-                max_gen_by_hour = np.maximum(max_gen_by_hour, gen.fillna(0).values)
-        self.maxgeneration = max_gen_by_hour
+        if maxgeneration is None:
+            # maximum hourly generation over days [0, YEAR_LENGTH), never below 0
+            in_year = (self.yearlonggeneration.index >= 0) & (self.yearlonggeneration.index < YEAR_LENGTH)
+            gen = pv_size * self.yearlonggeneration.to_numpy(dtype=np.float64)[in_year]
+            maxgeneration = np.nan_to_num(gen, nan=0).max(axis=0, initial=0)
+        self.maxgeneration = maxgeneration
         self.battery_num = battery_num
         self.pv_size = pv_size
         self.capacity = 13.5  # kW-hour
@@ -44,104 +39,83 @@ class RealProsumer:
         self.battery_discharged_times = 5656
         self.noise_scale=noise_scale
         self.generation_noise_scale=generation_noise_scale
+        self.dispatch_solver=dispatch_solver
+        self.response_cache = None # optional ResponseCache shared across prosumers
+        self.data_fingerprint = "" # identifies the demand data in response cache keys, set with the response cache
+        self.profiler = NULL_PROFILER # times the demand lookups and solves of get_optimal_net, see MockEnvironment.set_profiler
         
-    def get_real_response_twoprices(self, day, buyprices, sellprices, year = None, num_optim_steps=10000):
+    def clip_net_load(self, load, gen, x):
         """
-        Determines the net load of the prosumer on a specific day, in response to energy prices
-
-        Args:
-                day: day of the year. Allowed values: [0,365)
-                buyprices: DAY_LENGTH hour price vector, supplied as an np.array
-                sellprices: DAY_LENGTH hour price vector, supplied as an np.array
+        Net load for battery schedule x, bounded by the battery's hourly charge rate
         """
+        return get_clipped_net_load(load, gen, x, self.eta, self.capacity * self.battery_num * self.c_rate)
 
-        load = self.yearlongdemand.loc[day, :]
-        gen = self.pv_size * self.yearlonggeneration.loc[day, :]
-        
-        eta = self.eta
-        capacity = self.capacity
-        battery_num = self.battery_num
-        c_rate = self.c_rate
-        Ltri = np.tril(np.ones((DAY_LENGTH, DAY_LENGTH)))
-
-        def dailyobjective(x):
-            net = load - gen + (-eta + 1 / eta) * abs(x) / 2 + (eta + 1 / eta) * x / 2
-            return np.sum(np.maximum(net, 0) * buyprices) + np.sum(
-                np.minimum(net, 0) * sellprices
+    def get_optimal_net(self, day, buyprices, sellprices, num_optim_steps=10000, dispatch_solver=None):
+        """
+        Noise free net load of the prosumer on a specific day, after solving the daily battery dispatch
+        """
+        dispatch_solver = dispatch_solver or self.dispatch_solver
+        if self.response_cache is not None:
+            cache_key = self.response_cache.make_key(
+                self.name, self.battery_num, self.pv_size, day, dispatch_solver, num_optim_steps,
+                hash_prices(buyprices, sellprices), self.data_fingerprint,
             )
+            cached_net = self.response_cache.get(cache_key)
+            if cached_net is not None:
+                self.profiler.count("prosumer_cache_hits")
+                return cached_net
 
-        def hourly_con_charge_max(x):
-            # Shouldn't charge or discharge too fast
-            return c_rate * capacity * battery_num - x
-
-        def hourly_con_charge_min(x):
-            # Shouldn't charge or discharge too fast
-            return c_rate * capacity * battery_num + x
-
-        def hourly_con_cap_max(x):
-            # x should respect the initial state of charge
-            return capacity * battery_num - np.matmul(Ltri, x)
+        with self.profiler.phase("prosumer_demand_lookup"):
+            load = self.yearlongdemand.loc[day, :]
+            gen = self.pv_size * self.yearlonggeneration.loc[day, :]
 
-        def hourly_con_cap_min(x):
-            # x should respect the initial state of charge
-            return np.matmul(Ltri, x)
+        solve_dispatch = get_dispatch_solver(dispatch_solver)
+        with self.profiler.phase("prosumer_solve"):
+            dispatch_result = solve_dispatch(
+                load,
+                gen,
+                buyprices,
+                sellprices,
+                battery_num=self.battery_num,
+                capacity=self.capacity,
+                eta=self.eta,
+                c_rate=self.c_rate,
+                num_optim_steps=num_optim_steps,
+            )
+        self.profiler.count("prosumer_solves")
+        self.profiler.count("prosumer_iterations", dispatch_result.nit)
+        if not dispatch_result.success:
+            # per prosumer, so the report shows whose dispatch keeps failing
+            self.profiler.count(f"prosumer_failures/{self.name}")
+        # v1: same behavior whether the solution is reached or not -- still dependent on the battery's behavior.
+        net = np.array(self.clip_net_load(load, gen, dispatch_result.x))
 
-        con1_hourly = {"type": "ineq", "fun": hourly_con_charge_min}
-        con2_hourly = {"type": "ineq", "fun": hourly_con_charge_max}
-        con3_hourly = {"type": "ineq", "fun": hourly_con_cap_min}
-        con4_hourly = {"type": "ineq", "fun": hourly_con_cap_max}
-        cons_hourly = (con1_hourly, con2_hourly, con3_hourly, con4_hourly)
+        if self.response_cache is not None:
+            self.response_cache.put(cache_key, net)
+        return net
 
-        x0 = [battery_num * capacity] * DAY_LENGTH
-        # x0 = [0]*DAY_LENGTH
+    def get_real_response_twoprices(self, day, buyprices, sellprices, year = None, num_optim_steps=10000, dispatch_solver=None, simulation_rng: Optional[SimulationRNG] = None):
+        """
+        Determines the net load of the prosumer on a specific day, in response to energy prices
 
-        sol = minimize(
-            dailyobjective,
-            x0,
-            constraints=cons_hourly,
-            method="SLSQP",
-            options={"maxiter": num_optim_steps},
-        )
+        Args:
+                day: day of the year. Allowed values: [0,365)
+                buyprices: DAY_LENGTH hour price vector, supplied as an np.array
+                sellprices: DAY_LENGTH hour price vector, supplied as an np.array
+                year: year of the day, keys the noise streams with day
+                dispatch_solver: name of the battery dispatch solver, defaults to the prosumer's solver
+                simulation_rng: streams the noise is drawn from, a SimulationRNG with fresh entropy when None
+        """
 
-        if not sol.success:
-            net = load - gen
-            # import pdb; pdb.set_trace()
-            x = sol["x"]
-            battery_discharged_capacity = np.sum(np.abs(x))
-            battery_discharged_times = np.sum(np.abs(x) > 0.1)
-            # v1: changing this so that it takes the same behavior if the solution is reached or not -- still dependent on the battery's behavior.
-            net = load - gen + (-eta + 1 / eta) * abs(x) / 2 + (eta + 1 / eta) * x / 2
-            upper_bound = (
-                load - gen + np.ones(DAY_LENGTH) * capacity * battery_num * c_rate
-            )
-            lower_bound = (
-                load - gen - np.ones(DAY_LENGTH) * capacity * battery_num * c_rate
-            )
-            net = np.minimum(net, upper_bound)  # upper bound
-            net = np.maximum(net, lower_bound)  # lower bound
-        else:
-            x = sol["x"]
-            # import pdb; pdb.set_trace()
-            battery_discharged_capacity = np.sum(np.abs(x))
-            battery_discharged_times = np.sum(np.abs(x) > 0.1)
-            net = load - gen + (-eta + 1 / eta) * abs(x) / 2 + (eta + 1 / eta) * x / 2
-            upper_bound = (
-                load - gen + np.ones(DAY_LENGTH) * capacity * battery_num * c_rate
-            )
-            lower_bound = (
-                load - gen - np.ones(DAY_LENGTH) * capacity * battery_num * c_rate
-            )
-            net = np.minimum(net, upper_bound)  # upper bound
-            net = np.maximum(net, lower_bound)  # lower bound
-        # sol['x'] = x
-        # sol['fun'] = dailyobjective(x)
+        net = self.get_optimal_net(day, buyprices, sellprices, num_optim_steps, dispatch_solver)
+        if simulation_rng is None:
+            simulation_rng = SimulationRNG()
 
         calculated_demand = np.array(net)
-        noise = np.random.normal(loc = 0, scale = np.abs(calculated_demand * self.noise_scale), size = DAY_LENGTH)
-        
-        with temp_seed(int(f"{day}{year}")):
-            generation_noise = np.random.normal(loc = 0, scale = np.abs(self.maxgeneration * self.generation_noise_scale), size = DAY_LENGTH) 
+        noise = np.abs(calculated_demand * self.noise_scale) * simulation_rng.get_demand_noise(day, year, [self.name])[0]
+        # generation noise is shared by every prosumer of the day, as they share the weather
+        generation_noise = np.abs(self.maxgeneration * self.generation_noise_scale) * simulation_rng.get_generation_noise(day, year)
         
         simulated_demand = calculated_demand + noise + generation_noise
 
-        return simulated_demand
\ No newline at end of file
+        return simulated_demand
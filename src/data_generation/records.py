@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterator, List
+from .real_prosumer import RealProsumer
+from .utils.constants import DAY_LENGTH
+
+# fields holding a value per hour, written as {field}_{hour} columns
+HOURLY_RECORD_FIELDS = ("agent_buy", "agent_sell", "prosumer_response")
+# remaining fields, in output column order
+STEP_RECORD_FIELDS = ("prosumer_name", "step", "year", "day", "battery_num", "pv_size", "reward")
+
+
+def get_simulation_record_dtype(prosumer_list: List[RealProsumer]) -> np.dtype:
+    """
+    Structured dtype holding one simulation row, sized for the names and battery/pv types of prosumer_list
+    """
+    name_length = max(len(prosumer.name) for prosumer in prosumer_list)
+    return np.dtype([
+        *[(field_name, np.float64, (DAY_LENGTH,)) for field_name in HOURLY_RECORD_FIELDS],
+        ("prosumer_name", f"U{name_length}"),
+        ("step", np.int64),
+        ("year", np.int64),
+        ("day", np.int64),
+        ("battery_num", np.asarray([prosumer.battery_num for prosumer in prosumer_list]).dtype),
+        ("pv_size", np.asarray([prosumer.pv_size for prosumer in prosumer_list]).dtype),
+        ("reward", np.float64),
+    ])
+
+
+def get_simulation_columns() -> List[str]:
+    return [
+        *[f"{field_name}_{hour}" for field_name in HOURLY_RECORD_FIELDS for hour in range(DAY_LENGTH)],
+        *STEP_RECORD_FIELDS,
+    ]
+
+
+def allocate_step_records(prosumer_list: List[RealProsumer], num_steps=None) -> np.ndarray:
+    """
+    Records for every prosumer with the per prosumer fields already filled in
+
+    Returns:
+        (num_prosumers,) records, or (num_steps, num_prosumers) when num_steps is given
+    """
+    shape = (len(prosumer_list),) if num_steps is None else (num_steps, len(prosumer_list))
+    records = np.zeros(shape, dtype=get_simulation_record_dtype(prosumer_list))
+    records["prosumer_name"] = [prosumer.name for prosumer in prosumer_list]
+    records["battery_num"] = [prosumer.battery_num for prosumer in prosumer_list]
+    records["pv_size"] = [prosumer.pv_size for prosumer in prosumer_list]
+    return records
+
+
+def fill_step_records(records: np.ndarray, step, year, day, buy_prices, sell_prices, prosumer_demand, reward):
+    """
+    Write one step into (num_prosumers,) records, prosumer_demand is (num_prosumers, DAY_LENGTH)
+    """
+    records["agent_buy"] = buy_prices
+    records["agent_sell"] = sell_prices
+    records["prosumer_response"] = prosumer_demand
+    records["step"] = step
+    records["year"] = year
+    records["day"] = day
+    records["reward"] = np.nan if reward is None else reward
+
+
+def records_to_dataframe(records: np.ndarray) -> pd.DataFrame:
+    """
+    Convert records to the wide column layout of the simulation data
+    """
+    records = np.asarray(records).reshape(-1)
+    hourly_values = np.concatenate([records[field_name] for field_name in HOURLY_RECORD_FIELDS], axis=1)
+    simulation_columns = get_simulation_columns()
+    records_df = pd.DataFrame(hourly_values, columns=simulation_columns[:len(HOURLY_RECORD_FIELDS) * DAY_LENGTH])
+    records_df["prosumer_name"] = records["prosumer_name"].astype(object)
+    for field_name in STEP_RECORD_FIELDS[1:]:
+        records_df[field_name] = records[field_name]
+    return records_df
+
+
+def iter_record_rows(records: np.ndarray) -> Iterator[Dict]:
+    """
+    Yield records as simulation row dicts, for write_data functions that take one row at a time
+    """
+    simulation_columns = get_simulation_columns()
+    num_hourly_fields = len(HOURLY_RECORD_FIELDS)
+    # tolist turns each record into a tuple of its fields, with hourly fields as arrays
+    for record in records.reshape(-1).tolist():
+        row_values = [value for hourly_values in record[:num_hourly_fields] for value in hourly_values]
+        yield dict(zip(simulation_columns, row_values + list(record[num_hourly_fields:])))
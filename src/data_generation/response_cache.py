@@ -0,0 +1,107 @@
+import hashlib
+import sqlite3
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+
+def hash_prices(buyprices, sellprices) -> str:
+    price_bytes = np.ascontiguousarray(buyprices, dtype=np.float64).tobytes() + np.ascontiguousarray(sellprices, dtype=np.float64).tobytes()
+    return hashlib.sha1(price_bytes).hexdigest()
+
+
+def hash_arrays(*arrays) -> str:
+    array_hash = hashlib.sha1()
+    for array in arrays:
+        array_hash.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+    return array_hash.hexdigest()
+
+
+class ResponseCache:
+    """
+    Content addressed cache of noise free prosumer net loads
+
+    Entries live in an in-memory LRU tier and, when disk_path is given, in an sqlite file
+    that survives across runs. Disk hits are promoted to memory. Keys hold a fingerprint of the
+    prosumer's demand data, so entries of changed building data or other prosumers are never returned.
+    """
+
+    def __init__(self, max_entries: int = 100000, disk_path: Optional[str] = None, commit_every: int = 1000):
+        self.max_entries = max_entries
+        self.memory: OrderedDict = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.commit_every = commit_every
+        self.pending_commits = 0
+        self.connection = None
+        if disk_path is not None:
+            Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(disk_path)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, net BLOB)")
+
+    @staticmethod
+    def make_key(prosumer_name, battery_num, pv_size, day, dispatch_solver, num_optim_steps, price_hash, data_fingerprint="") -> str:
+        return f"{data_fingerprint}|{prosumer_name}|{battery_num!r}|{pv_size!r}|{day}|{dispatch_solver}|{num_optim_steps}|{price_hash}"
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        net = self.memory.get(key)
+        if net is not None:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            return net.copy()
+        if self.connection is not None:
+            row = self.connection.execute("SELECT net FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                net = np.frombuffer(row[0], dtype=np.float64)
+                self.put_memory(key, net)
+                self.disk_hits += 1
+                return net.copy()
+        self.misses += 1
+        return None
+
+    def put_memory(self, key: str, net: np.ndarray):
+        self.memory[key] = net
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def put(self, key: str, net):
+        net = np.array(net, dtype=np.float64)
+        self.put_memory(key, net)
+        if self.connection is not None:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?)", (key, net.tobytes()))
+            self.pending_commits += 1
+            if self.pending_commits >= self.commit_every:
+                self.connection.commit()
+                self.pending_commits = 0
+
+    def get_stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def report(self) -> str:
+        stats = self.get_stats()
+        return (
+            f"Response cache: {stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, "
+            f"{stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)"
+        )
+
+    def __getstate__(self):
+        # worker processes never consult the cache, ship it without entries or the sqlite connection
+        state = self.__dict__.copy()
+        state["memory"] = OrderedDict()
+        state["connection"] = None
+        return state
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,88 @@
+import numpy as np
+from typing import Callable, Dict, Tuple
+from .utils.constants import UTILITY_SELL_RATIO
+
+# values returned by get_twoprices_rewards, in order
+REWARD_COMPONENTS = ("total_reward", "money_from_prosumers", "money_to_utility", "total_prosumer_cost")
+
+
+def get_twoprices_rewards(energy_consumptions, buyprice_grid, sellprice_grid, buy_prices, sell_prices, total_consumption=None) -> Tuple:
+    """
+    Purpose: Vectorized reward for one or many days given grid prices, transactive prices and prosumer energy consumption
+
+    Args:
+        energy_consumptions: (num_prosumers, DAY_LENGTH) demand matrix, or (steps, num_prosumers, DAY_LENGTH) for many days
+        buyprice_grid, sellprice_grid: (DAY_LENGTH,) utility prices, or (steps, DAY_LENGTH)
+        buy_prices, sell_prices: (DAY_LENGTH,) transactive prices, or (steps, DAY_LENGTH)
+        total_consumption: summed consumption, computed from energy_consumptions when None
+    Returns:
+        total_reward, money_from_prosumers, money_to_utility, total_prosumer_cost
+        each a float, or a (steps,) array when given many days
+    """
+    energy_consumptions = np.asarray(energy_consumptions, dtype=np.float64)
+    buy_prices = np.asarray(buy_prices, dtype=np.float64)
+    sell_prices = np.asarray(sell_prices, dtype=np.float64)
+
+    if total_consumption is None:
+        total_consumption = energy_consumptions.sum(axis=-2)
+
+    # Bool arrays containing when prosumers buy from / sell to the microgrid
+    # ! forcing agent to strictly be different than the utility price
+    test_buy_from_grid = buy_prices < buyprice_grid
+    test_sell_to_grid = sell_prices > sellprice_grid
+
+    # cost associated with net consumption of entire microgrid (from the perspective of the microgrid)
+    money_to_utility = np.sum(
+        np.maximum(0, total_consumption * test_buy_from_grid) * buyprice_grid
+        + np.minimum(0, total_consumption * test_sell_to_grid) * sellprice_grid,
+        axis=-1,
+    )
+
+    # every prosumer faces the same prices, so purchases and sales can be summed over prosumers first
+    prosumer_purchases = np.maximum(0, energy_consumptions).sum(axis=-2)
+    prosumer_sales = np.minimum(0, energy_consumptions).sum(axis=-2)
+    # Net money to microgrid from prosumers
+    money_from_prosumers = np.sum(
+        prosumer_purchases * test_buy_from_grid * buy_prices
+        + prosumer_sales * test_sell_to_grid * sell_prices,
+        axis=-1,
+    )
+    # Net money to external grid from prosumers (not including microgrid transactions w utility)
+    grid_money_from_prosumers = np.sum(
+        prosumer_purchases * np.logical_not(test_buy_from_grid) * buyprice_grid
+        + prosumer_sales * np.logical_not(test_sell_to_grid) * sellprice_grid,
+        axis=-1,
+    )
+
+    total_prosumer_cost = (
+        grid_money_from_prosumers + money_from_prosumers
+    )  # money leaving the prosumers
+
+    # profit maximizing
+    total_reward = money_from_prosumers - money_to_utility
+
+    return total_reward, money_from_prosumers, money_to_utility, total_prosumer_cost
+
+
+# reward formulas over the REWARD_COMPONENTS of get_twoprices_rewards, keyed by the name given on the command line
+REWARD_FORMULAS: Dict[str, Callable[..., np.ndarray]] = {
+    # microgrid profit, the reward simulations are run with
+    "twoprices": lambda total_reward, money_from_prosumers, money_to_utility, total_prosumer_cost: total_reward,
+    # minimizes what the microgrid pays the utility
+    "utility_cost": lambda total_reward, money_from_prosumers, money_to_utility, total_prosumer_cost: -money_to_utility,
+    # minimizes what prosumers pay the microgrid and the utility together
+    "prosumer_cost": lambda total_reward, money_from_prosumers, money_to_utility, total_prosumer_cost: -total_prosumer_cost,
+}
+
+
+def get_utility_tariff(utility_hourly_buy_prices, buy_price_multiplier: float = 1.0, sell_ratio: float = UTILITY_SELL_RATIO):
+    """
+    Utility buy and sell prices of a tariff derived from the building data's buy prices
+
+    Args:
+        utility_hourly_buy_prices: (..., DAY_LENGTH) buy prices of the building data
+        buy_price_multiplier: scales the buy prices
+        sell_ratio: sell prices as a share of the scaled buy prices
+    """
+    buyprice_grid = np.asarray(utility_hourly_buy_prices, dtype=np.float64) * buy_price_multiplier
+    return buyprice_grid, buyprice_grid * sell_ratio
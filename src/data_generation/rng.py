@@ -0,0 +1,53 @@
+import hashlib
+import numpy as np
+from typing import Optional, Sequence
+from .utils.constants import DAY_LENGTH
+
+# stream kinds, part of every spawn key so streams of different kinds never overlap
+PRICES_STREAM = 0
+DEMAND_NOISE_STREAM = 1
+GENERATION_NOISE_STREAM = 2
+
+
+def get_prosumer_key(prosumer_name: str) -> int:
+    """
+    Spawn key of a prosumer's streams, stable across processes and runs unlike hash()
+    """
+    return int.from_bytes(hashlib.blake2b(prosumer_name.encode(), digest_size=8).digest(), "little")
+
+
+class SimulationRNG:
+    """
+    Random streams of one simulation run, derived from a single seed with SeedSequence
+
+    Every (stream kind, year, day) pair gets its own Generator, and demand noise one per prosumer of the day
+    too, so what is drawn for a day does not depend on which days were simulated before it, on worker counts,
+    on the order of solves or on whether prosumers are simulated alone or as a fleet.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        # with seed None fresh entropy is used, kept in self.seed so the run can be reproduced
+        self.seed = np.random.SeedSequence(seed).entropy
+
+    def get_generator(self, stream: int, year: int, day: int, *keys: int) -> np.random.Generator:
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(stream, year, day, *keys)))
+
+    def get_demand_noise(self, day, year, prosumer_names: Sequence[str]) -> np.ndarray:
+        """
+        Returns:
+            (num_prosumers, DAY_LENGTH) standard normal draws, row i from the stream of prosumer_names[i]
+        """
+        demand_noise = np.empty((len(prosumer_names), DAY_LENGTH))
+        for prosumer_idx, prosumer_name in enumerate(prosumer_names):
+            demand_noise[prosumer_idx] = self.get_generator(DEMAND_NOISE_STREAM, year, day, get_prosumer_key(prosumer_name)).standard_normal(DAY_LENGTH)
+        return demand_noise
+
+    def get_generation_noise(self, day, year) -> np.ndarray:
+        """
+        Returns:
+            (DAY_LENGTH,) standard normal draws, shared by every prosumer as they share the weather
+        """
+        return self.get_generator(GENERATION_NOISE_STREAM, year, day).standard_normal(DAY_LENGTH)
+
+    def get_prices_generator(self, day, year) -> np.random.Generator:
+        return self.get_generator(PRICES_STREAM, year, day)
@@ -1,13 +1,22 @@
-import wandb
+import contextlib
+import inspect
 import pandas as pd
 import numpy as np
 from dataclasses import dataclass
-from typing import Callable, List, Dict
+from typing import Callable, Iterator, List, Dict, Optional
 
 from .convert_batch import BatchWriter
 
-from .utils.constants import DAY_LENGTH, YEAR_LENGTH
+from .utils.constants import DAY_LENGTH
+from .utils.dates import SimulationCalendar, get_simulation_calendar
 from .environment import MockEnvironment
+from .parallel import BACKENDS, ParallelFleetSolver
+from .rng import SimulationRNG
+from .profiling import NULL_PROFILER, Profiler
+from .step_logger import AsyncStepLogger, get_active_wandb
+from .checkpoint import SimulationCheckpointer
+from .price_generation_functions import generate_price_schedule
+from .records import allocate_step_records, fill_step_records, iter_record_rows, records_to_dataframe
 
 
 @dataclass
@@ -16,6 +25,9 @@ class SimulationConfig:
     day_start: int
     year_start: int
     prices_generation_function: Callable[[int, int, np.ndarray, np.ndarray], np.ndarray]
+    # seeds every random draw of the run, None seeds it from the global np.random state,
+    # price generation functions without an rng parameter always draw from the global np.random state
+    seed: Optional[int] = None
 
 def get_observation(daily_energy_consumption, daily_generation, daily_buy_prices):
         """Get today's observation."""
@@ -24,115 +36,257 @@ def get_observation(daily_energy_consumption, daily_generation, daily_buy_prices
             (daily_energy_consumption, daily_generation, daily_buy_prices)
         ).astype(np.float32)
 
-def simulate(mock_environment: MockEnvironment, simulation_config: SimulationConfig, write_data: Callable, batch_writer: BatchWriter = None) -> Dict[str, pd.DataFrame]:
+@dataclass
+class SimulationStep:
+    """
+    Result of one simulated day
+
+    Prices are (DAY_LENGTH,) arrays, prosumer_demand is (num_prosumers, DAY_LENGTH) in prosumer_list order
+    """
+    step: int
+    day: int
+    year: int
+    day_row: int
+    weekday: int # Monday 0
+    is_holiday: bool
+    buy_prices: np.ndarray
+    sell_prices: np.ndarray
+    utility_buy_prices: np.ndarray
+    utility_sell_prices: np.ndarray
+    prosumer_demand: np.ndarray
+    total_demand: np.ndarray
+    reward: float
+
+def get_run_calendar(mock_environment: MockEnvironment, simulation_config: SimulationConfig) -> SimulationCalendar:
+    """
+    Day, year, environment row, weekday and holiday flag of every step of the run
+    """
+    return get_simulation_calendar(
+        simulation_config.day_start,
+        simulation_config.year_start,
+        simulation_config.num_simulation_steps,
+        mock_environment.arrays.get_day_rows,
+    )
+
+def get_simulation_rng(simulation_config: SimulationConfig) -> SimulationRNG:
+    """
+    Random streams of a run, runs without a seed take theirs from np.random so that np.random.seed reproduces them
+    """
+    if simulation_config.seed is not None:
+        return SimulationRNG(simulation_config.seed)
+    return SimulationRNG(int(np.random.randint(2**63, dtype=np.uint64)))
+
+def get_price_schedule(mock_environment: MockEnvironment, simulation_config: SimulationConfig):
+    """
+    Prices of every step generated up front, using the batched form of the price generation function
+
+    With a seed, the prices equal those of the seeded simulation.
+
+    Returns:
+        days, years: (num_simulation_steps,) arrays
+        buy_prices, sell_prices: (num_simulation_steps, DAY_LENGTH) arrays
+    """
+    calendar = get_run_calendar(mock_environment, simulation_config)
+    buy_prices, sell_prices = generate_price_schedule(
+        simulation_config.prices_generation_function,
+        calendar.days,
+        calendar.years,
+        mock_environment.arrays.utility_hourly_buy_prices[calendar.day_rows],
+        mock_environment.arrays.utility_hourly_sell_prices[calendar.day_rows],
+        simulation_rng=SimulationRNG(simulation_config.seed) if simulation_config.seed is not None else None,
+    )
+    return calendar.days, calendar.years, buy_prices, sell_prices
+
+def iter_simulate(mock_environment: MockEnvironment, simulation_config: SimulationConfig, workers: int = 1, backend: str = "serial", profiler: Profiler = NULL_PROFILER, start_step: int = 0, simulation_rng: Optional[SimulationRNG] = None) -> Iterator[SimulationStep]:
+    """
+    Simulate mock environment with simulation config, yielding each step as it is computed
+
+    Nothing is retained between steps, so memory stays constant however many steps are simulated.
+    Closing the generator early shuts down the worker processes of the "process" backend.
+
+    :param mock_environment: Environement to simulate
+    :param simulation_config: Config to use in simulation
+    :param workers: number of worker processes solving prosumer dispatch when backend is "process"
+    :param backend: "serial" or "process", results are bit-identical for both as both solve the fleet's fixed dispatch chunks
+    :param profiler: times the price generation, dispatch, noise and reward phases of every step, the reward phase through mock_environment.use_profiler
+    :param start_step: first step to simulate, earlier steps are skipped
+    :param simulation_rng: random streams of the run, see get_simulation_rng
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+    if backend == "process" and workers > 1:
+        fleet_solver = ParallelFleetSolver(mock_environment.prosumer_fleet, workers)
+    else:
+        fleet_solver = contextlib.nullcontext(mock_environment.prosumer_fleet)
+    if simulation_rng is None:
+        simulation_rng = get_simulation_rng(simulation_config)
+    # price functions taking an rng draw from the day's price stream
+    prices_take_rng = "rng" in inspect.signature(simulation_config.prices_generation_function).parameters
+    # days, years and weekdays of every step, computed once rather than step by step
+    calendar = get_run_calendar(mock_environment, simulation_config)
+    with fleet_solver as fleet_solver, mock_environment.use_profiler(profiler):
+        for simulation_step_idx in range(start_step, simulation_config.num_simulation_steps):
+            profiler.start_step()
+
+            simulate_day = int(calendar.days[simulation_step_idx])
+            simulate_year = int(calendar.years[simulation_step_idx])
+            day_row = calendar.day_rows[simulation_step_idx]
+            utility_hourly_buy_price = mock_environment.arrays.utility_hourly_buy_prices[day_row]
+            utility_hourly_sell_price = mock_environment.arrays.utility_hourly_sell_prices[day_row]
+
+            with profiler.phase("price_generation"):
+                prices_kwargs = {"rng": simulation_rng.get_prices_generator(simulate_day, simulate_year)} if prices_take_rng else {}
+                microgrid_buy_prices, microgrid_sell_prices = simulation_config.prices_generation_function(
+                    simulate_day, 
+                    simulate_year, 
+                    utility_hourly_buy_price, 
+                    utility_hourly_sell_price,
+                    **prices_kwargs,
+                )
+
+            # Calculate prosumer demand
+            with profiler.phase("dispatch"):
+                optimal_nets = fleet_solver.get_optimal_nets(simulate_day, microgrid_buy_prices, microgrid_sell_prices)
+            with profiler.phase("noise"):
+                prosumer_demand_matrix = mock_environment.prosumer_fleet.add_noise(
+                    optimal_nets,
+                    simulate_day,
+                    simulate_year,
+                    simulation_rng,
+                )
+                total_demand = prosumer_demand_matrix.sum(axis=0)
+
+            # Calculate step reward, timed by the environment's profiler
+            step_reward, _, _, _ = mock_environment.get_rewards_twoprices(
+                prosumer_demand_matrix,
+                simulate_day,
+                microgrid_buy_prices,
+                microgrid_sell_prices,
+                total_consumption=total_demand,
+            )
+            yield SimulationStep(
+                step=simulation_step_idx,
+                day=simulate_day,
+                year=simulate_year,
+                day_row=day_row,
+                weekday=int(calendar.weekdays[simulation_step_idx]),
+                is_holiday=bool(calendar.is_holiday[simulation_step_idx]),
+                buy_prices=microgrid_buy_prices,
+                sell_prices=microgrid_sell_prices,
+                utility_buy_prices=utility_hourly_buy_price,
+                utility_sell_prices=utility_hourly_sell_price,
+                prosumer_demand=prosumer_demand_matrix,
+                total_demand=total_demand,
+                reward=step_reward,
+            )
+
+def simulate(mock_environment: MockEnvironment, simulation_config: SimulationConfig, write_data: Callable, batch_writer: BatchWriter = None, workers: int = 1, backend: str = "serial", accumulate: bool = True, profiler: Profiler = NULL_PROFILER, step_logger: Optional[AsyncStepLogger] = None, checkpointer: Optional[SimulationCheckpointer] = None) -> Optional[Dict[str, pd.DataFrame]]:
     """
     Simulate mock environment with simulation config
     
     :param mock_environment: Environement to simulate
     :param simulation_config: Config to use in simulation
-    :return: dataframe containing simulation data
+    :param workers: number of worker processes solving prosumer dispatch when backend is "process"
+    :param backend: "serial" or "process", results are bit-identical for both as both solve the fleet's fixed dispatch chunks
+    :param accumulate: whether to also keep every row in a record buffer of num_simulation_steps x num_prosumers rows and return it, False only passes rows to write_data and runs in constant memory
+    :param profiler: collects phase timings and dispatch counters of the run, logged per step to wandb when a run is active
+    :param step_logger: receives the metrics of every step, defaults to logging to wandb in the background when a run is active
+    :param checkpointer: checkpoints the run periodically, and resumes it from its last checkpoint when there is one
+    :return: dataframe of each prosumer's simulation data, None when accumulate is False
     """
     
-    simulation_data_by_prosumers : Dict[str, List[Dict]] = {}
-    total_reward = 0
-    for simulation_step_idx in range(simulation_config.num_simulation_steps):
-        
-        simulation_row_by_prosumers : Dict[str, Dict] = {prosumer.name : [] for prosumer in mock_environment.prosumer_list}
-
-        simulate_day = (((simulation_config.day_start - 1) + simulation_step_idx) % YEAR_LENGTH) + 1
-        simulate_year = simulation_config.year_start + (simulation_config.day_start + simulation_step_idx - 1) // YEAR_LENGTH
-
-        utility_hourly_buy_price = mock_environment.utility_hourly_buy_prices.loc[simulate_day, :] 
-        utility_hourly_sell_price = mock_environment.utility_hourly_sell_prices.loc[simulate_day, :]
-
-        microgrid_buy_prices, microgrid_sell_prices = simulation_config.prices_generation_function(
-            simulate_day, 
-            simulate_year, 
-            utility_hourly_buy_price, 
-            utility_hourly_sell_price,
-        )
-                
-        general_step_data = {
-            "step": simulation_step_idx,
-            "year" : simulate_year,
-            "day" : simulate_day,
-        }
-        
-        buy_price_step_data = {}
-        sell_price_step_data = {}
-        for hour in range(DAY_LENGTH):
-            buy_price_step_data[f"agent_buy_{hour}"] = microgrid_buy_prices[hour]
-            sell_price_step_data[f"agent_sell_{hour}"] = microgrid_sell_prices[hour]
+    prosumer_list = mock_environment.prosumer_list
+    # records are filled in place every step, either one row of a buffer for the whole run or a single reused step
+    if accumulate:
+        simulation_records = allocate_step_records(prosumer_list, simulation_config.num_simulation_steps)
+    else:
+        step_records = allocate_step_records(prosumer_list)
+    write_records = getattr(write_data, "write_records", None)
+    simulation_rng = get_simulation_rng(simulation_config)
+    if checkpointer is not None:
+        start_step, total_reward = checkpointer.restore(simulation_config.seed, mock_environment, write_data, batch_writer, simulation_rng)
+        if accumulate and start_step > 0:
+            raise ValueError("A resumed run cannot accumulate the steps simulated before it was resumed")
+    else:
+        start_step, total_reward = 0, 0
+    dispatch_stats_start = dict(mock_environment.prosumer_fleet.dispatch_stats)
+    # wandb steps are logged from a background thread, a step_logger passed in is left open for the caller to close
+    wandb = get_active_wandb()
+    if step_logger is None and wandb is not None:
+        step_logger_context = AsyncStepLogger(wandb.log)
+    else:
+        step_logger_context = contextlib.nullcontext(step_logger)
+    with step_logger_context as step_logger:
+        for simulation_step in iter_simulate(mock_environment, simulation_config, workers, backend, profiler, start_step, simulation_rng):
+            simulation_step_idx = simulation_step.step
+            step_reward = simulation_step.reward
+
+            with profiler.phase("records"):
+                if accumulate:
+                    step_records = simulation_records[simulation_step_idx]
+                fill_step_records(
+                    step_records,
+                    simulation_step_idx,
+                    simulation_step.year,
+                    simulation_step.day,
+                    simulation_step.buy_prices,
+                    simulation_step.sell_prices,
+                    simulation_step.prosumer_demand,
+                    step_reward,
+                )
         
-        # Calculate prosumer demand
-        prosumer_demand_dict = {"Total": np.zeros(DAY_LENGTH)}
-        for prosumer in mock_environment.prosumer_list:
-            prosumer_name = prosumer.name
-            
-            simulated_demand = prosumer.get_real_response_twoprices(simulate_day, microgrid_buy_prices, microgrid_sell_prices, simulate_year)
-            prosumer_demand_dict[prosumer_name] = simulated_demand
-            
+            if step_reward is np.nan or step_reward is None:
+                print(f"reward calculation failed on day {simulation_step.day}")
+            elif step_logger is not None:
+                with profiler.phase("wandb"):
+                    total_reward+=step_reward
+                    log_info = {
+                        "simulation_step": simulation_step_idx, 
+                        "step_reward": step_reward, 
+                        "simulation_day": simulation_step.day,
+                        "total_reward": total_reward,
+                        **profiler.get_step_metrics(),
+                    }
+                    # the weekday of the simulated year, not of the year the building data was recorded in
+                    if simulation_step.weekday <= 4:
+                        log_info["weekday_reward"] = step_reward
+                    else:
+                        log_info["weekend_reward"] = step_reward
+                    if simulation_step.is_holiday:
+                        log_info["holiday_reward"] = step_reward
+                    step_logger.log(log_info)
+
             # record step data for reporting
-            prosumer_step_data = {}
-            for hour in range(DAY_LENGTH):
-                prosumer_step_data[f"prosumer_response_{hour}"] = simulated_demand[hour]
-            simulation_row_by_prosumers[prosumer_name] = {
-                **buy_price_step_data,
-                **sell_price_step_data,
-                **prosumer_step_data,
-                "prosumer_name": prosumer_name,
-                **general_step_data,
-                "battery_num": prosumer.battery_num,
-                "pv_size": prosumer.pv_size,
-            }
-            
-            prosumer_demand_dict["Total"] = prosumer_demand_dict["Total"] + simulated_demand
-                    
-        # Calculate step reward
-        step_reward = mock_environment.get_reward_twoprices(
-            prosumer_demand_dict,
-            simulate_day,
-            microgrid_buy_prices,
-            microgrid_sell_prices,
-        )
-        if step_reward is np.nan or step_reward is None:
-            print(f"reward calculation failed on day {simulate_day}")
-        elif wandb.run is not None:
-            total_reward+=step_reward
-            log_info = {
-                "simulation_step": simulation_step_idx, 
-                "step_reward": step_reward, 
-                "simulation_day": simulate_day,
-                "total_reward": total_reward
-            }
-            if mock_environment.weekday_dict[simulate_day]:
-                log_info["weekday_reward"] = step_reward
-            else:
-                log_info["weekend_reward"] = step_reward
-            wandb.log(log_info)
-        for prosumer_name, simulation_row in simulation_row_by_prosumers.items():
-            simulation_row["reward"] = step_reward
-            write_data(simulation_row, prosumer_name, simulation_step_idx)
-            
-            # add row to cumulative dataframe
-            simulation_data_by_prosumers.setdefault(prosumer_name, []).append(simulation_row)
+            with profiler.phase("write_data"):
+                if write_records is not None:
+                    write_records(step_records)
+                else:
+                    for prosumer, simulation_row in zip(prosumer_list, iter_record_rows(step_records)):
+                        write_data(simulation_row, prosumer.name, simulation_step_idx)
         
-        if batch_writer is not None and simulation_step_idx > 1:
-            batch_writer.write_batch(
-                simulation_step_idx, 
-                np.concatenate([microgrid_buy_prices, microgrid_sell_prices]),
-                get_observation(
-                    prosumer_demand_dict["Total"],
-                    mock_environment.hourly_solar_constants.loc[simulate_day, :],
-                    utility_hourly_buy_price,  
-                ),
-                step_reward,
-            )
-            
-    
-    simulation_data_df_by_prosumers = {}
-    for prosumer_name, prosumer_data in simulation_data_by_prosumers.items():
-            simulation_data_df_by_prosumers[prosumer_name] = pd.DataFrame(prosumer_data)
-    return simulation_data_df_by_prosumers
+            if batch_writer is not None and simulation_step_idx > 1:
+                with profiler.phase("batch_writer"):
+                    batch_writer.write_batch(
+                        simulation_step_idx, 
+                        np.concatenate([simulation_step.buy_prices, simulation_step.sell_prices]),
+                        get_observation(
+                            simulation_step.total_demand,
+                            mock_environment.arrays.hourly_solar_constants[simulation_step.day_row],
+                            simulation_step.utility_buy_prices,  
+                        ),
+                        step_reward,
+                    )
+            profiler.count("steps")
 
-    
\ No newline at end of file
+            if checkpointer is not None and checkpointer.is_due(simulation_step_idx + 1, simulation_config.num_simulation_steps):
+                with profiler.phase("checkpoint"):
+                    checkpointer.save(simulation_step_idx + 1, simulation_config.seed, total_reward, mock_environment, write_data, batch_writer, simulation_rng)
+            
+    for stat_name, value in mock_environment.prosumer_fleet.dispatch_stats.items():
+        profiler.count(f"dispatch_{stat_name}", value - dispatch_stats_start[stat_name])
+    if not accumulate:
+        return None
+    return {
+        prosumer.name: records_to_dataframe(simulation_records[:, prosumer_idx])
+        for prosumer_idx, prosumer in enumerate(prosumer_list)
+    }
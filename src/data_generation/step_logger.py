@@ -0,0 +1,120 @@
+import queue
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+LOG_POLICIES = ("block", "drop")
+
+
+def get_active_wandb():
+    """
+    The wandb module when a wandb run is active, else None
+
+    wandb is only imported by runs that log to it, so without it in sys.modules no run can be active
+    and it is not imported here.
+    """
+    wandb = sys.modules.get("wandb")
+    if wandb is None or wandb.run is None:
+        return None
+    return wandb
+
+
+class AsyncStepLogger:
+    """
+    Hands step metrics to log_fn from a background thread, so logging does not slow down the step loop
+
+    Metrics are queued by log and passed to log_fn in order, one call per step. The thread collects up to
+    flush_every steps, or whatever arrived within flush_interval seconds, before calling log_fn on each of
+    them, so it wakes up once per flush rather than once per step. log_fn is typically wandb.log, which
+    takes a single step, any callable taking a dict works.
+
+    Args:
+        log_fn: called with the metrics dict of every step
+        max_queue_size: steps queued before the policy applies
+        policy: "block" waits for room in the queue, "drop" discards the step and counts it in dropped
+        flush_every: steps collected before they are passed to log_fn
+        flush_interval: seconds after which collected steps are passed to log_fn even if fewer than flush_every
+    """
+
+    def __init__(self, log_fn: Callable[[Dict], None], max_queue_size: int = 1024, policy: str = "block", flush_every: int = 64, flush_interval: float = 1.0):
+        if policy not in LOG_POLICIES:
+            raise ValueError(f"Unknown log policy {policy}, expected one of {LOG_POLICIES}")
+        self.log_fn = log_fn
+        self.policy = policy
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.log_queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self.logged = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.error: Optional[BaseException] = None
+        self.is_closed = False
+        self.thread = threading.Thread(target=self.run, name="AsyncStepLogger", daemon=True)
+        self.thread.start()
+
+    def log(self, metrics: Dict):
+        if self.is_closed:
+            raise ValueError("Logger is closed")
+        if self.error is not None:
+            raise RuntimeError("Step logging failed") from self.error
+        if self.policy == "block":
+            self.log_queue.put(metrics)
+            return
+        try:
+            self.log_queue.put_nowait(metrics)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        pending: List[Dict] = []
+        is_closing = False
+        flush_deadline = time.monotonic() + self.flush_interval
+        while not is_closing:
+            try:
+                metrics = self.log_queue.get(timeout=max(flush_deadline - time.monotonic(), 0))
+                if metrics is None:
+                    is_closing = True
+                else:
+                    pending.append(metrics)
+            except queue.Empty:
+                pass
+            if is_closing or len(pending) >= self.flush_every or time.monotonic() >= flush_deadline:
+                self.flush(pending)
+                pending = []
+                flush_deadline = time.monotonic() + self.flush_interval
+
+    def flush(self, pending: List[Dict]):
+        if not pending:
+            return
+        self.flushes += 1
+        for metrics in pending:
+            # after a failure the queue is still drained, so that log and close never block on it
+            if self.error is not None:
+                return
+            try:
+                self.log_fn(metrics)
+                self.logged += 1
+            except BaseException as log_error:
+                self.error = log_error
+
+    def close(self):
+        """
+        Pass every queued step to log_fn and stop the thread, raising if log_fn failed
+        """
+        if not self.is_closed:
+            self.is_closed = True
+            # the sentinel always waits for room, even under the "drop" policy
+            self.log_queue.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise RuntimeError("Step logging failed") from self.error
+
+    def report(self) -> str:
+        return f"Step logging: {self.logged} steps logged in {self.flushes} flushes, {self.dropped} dropped"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
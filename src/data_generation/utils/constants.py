@@ -2,6 +2,8 @@ START_HOUR = 0
 START_DAY = 15
 DAY_LENGTH = 24
 YEAR_LENGTH = 365
+# Utility sell prices as a share of its buy prices
+UTILITY_SELL_RATIO = 0.6
 # The installment area for generation of solar constants in square meters
 SOLAR_CONSTANT_INSTALLMENT_AREA = 112.281
 # Info for simulation
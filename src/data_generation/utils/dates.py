@@ -0,0 +1,108 @@
+import functools
+import numpy as np
+from dataclasses import dataclass
+from typing import Callable, Optional
+from .constants import YEAR_LENGTH
+
+# 1970-01-01, day 0 of datetime64[D], was a Thursday
+EPOCH_WEEKDAY = 3
+
+
+def get_simulation_dates(days, years) -> np.ndarray:
+    """
+    Calendar date (datetime64[D]) of each (day, year) pair, days and years broadcast against each other
+
+    Days count from January 1st. In leap years (year % 4 == 0) days from 59 on skip a date, as the
+    price generation functions always did, so that there are YEAR_LENGTH simulation days in every year
+    and every simulated year starts on January 1st.
+    """
+    days, years = np.broadcast_arrays(np.asarray(days, dtype=np.int64), np.asarray(years, dtype=np.int64))
+    offsets = days - 1 + ((years % 4 == 0) & (days >= 59))
+    year_starts = (years - 1970).astype("datetime64[Y]").astype("datetime64[D]")
+    return year_starts + offsets
+
+
+def get_date_weekdays(dates) -> np.ndarray:
+    """
+    Weekday (Monday 0) of datetime64[D] dates
+    """
+    return (np.asarray(dates, dtype="datetime64[D]").astype(np.int64) + EPOCH_WEEKDAY) % 7
+
+
+def get_holidays(dates) -> np.ndarray:
+    """
+    Whether each datetime64[D] date is a US federal holiday
+    """
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    if dates.size == 0:
+        return np.zeros(dates.shape, dtype=bool)
+    from pandas.tseries.holiday import USFederalHolidayCalendar
+    holidays = USFederalHolidayCalendar().holidays(str(dates.min()), str(dates.max())).to_numpy().astype("datetime64[D]")
+    return np.isin(dates, holidays)
+
+
+@functools.lru_cache(maxsize=None)
+def get_year_weekdays(year: int) -> np.ndarray:
+    """
+    Weekday (Monday 0) of every simulation day of year, indexed by day so entry 0 is unused
+    """
+    weekdays = get_date_weekdays(get_simulation_dates(np.arange(YEAR_LENGTH + 2), year))
+    weekdays.setflags(write=False)
+    return weekdays
+
+
+def get_weekdays(days, years) -> np.ndarray:
+    """
+    Weekday (Monday 0) of each (day, year) pair, days and years broadcast against each other
+    """
+    days, years = np.broadcast_arrays(np.asarray(days), np.asarray(years))
+    weekdays = np.empty(days.shape, dtype=np.int64)
+    for year in np.unique(years):
+        in_year = years == year
+        weekdays[in_year] = get_year_weekdays(int(year))[days[in_year]]
+    return weekdays
+
+
+def is_weekday(days, years) -> np.ndarray:
+    return get_weekdays(days, years) <= 4
+
+
+@dataclass(frozen=True)
+class SimulationCalendar:
+    """
+    Calendar of every step of a run, computed once for the whole run, entry i of every array belongs to step i
+    """
+    days: np.ndarray # (num_steps,) simulation day of the year, 1 to YEAR_LENGTH
+    years: np.ndarray # (num_steps,)
+    day_rows: Optional[np.ndarray] # (num_steps,) environment row of each day, None when built without an environment
+    dates: np.ndarray # (num_steps,) datetime64[D], see get_simulation_dates
+    weekdays: np.ndarray # (num_steps,) Monday 0
+    is_holiday: np.ndarray # (num_steps,) US federal holidays
+
+    @property
+    def is_weekday(self) -> np.ndarray:
+        return self.weekdays <= 4
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+
+def get_simulation_calendar(day_start: int, year_start: int, num_simulation_steps: int, get_day_rows: Optional[Callable] = None) -> SimulationCalendar:
+    """
+    Calendar of a run of num_simulation_steps days starting on day_start of year_start
+
+    Args:
+        get_day_rows: maps days to environment rows, such as EnvironmentArrays.get_day_rows
+    """
+    step_offsets = (day_start - 1) + np.arange(num_simulation_steps)
+    days = step_offsets % YEAR_LENGTH + 1
+    years = year_start + step_offsets // YEAR_LENGTH
+    dates = get_simulation_dates(days, years)
+    return SimulationCalendar(
+        days=days,
+        years=years,
+        day_rows=get_day_rows(days) if get_day_rows is not None else None,
+        dates=dates,
+        weekdays=get_date_weekdays(dates),
+        is_holiday=get_holidays(dates),
+    )
@@ -0,0 +1,208 @@
+import abc
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List
+from .records import records_to_dataframe
+
+
+class SimulationDataWriter(abc.ABC):
+    """
+    Collects simulation rows of every prosumer into one table per run
+
+    Rows are buffered in preallocated NumPy arrays and written every chunk_size rows.
+    Instances can be passed as simulate's write_data, which hands them whole steps of
+    structured records through write_records, and used as context managers so that
+    buffered rows are flushed even when a run fails. A writer takes either row dicts
+    or records, not both.
+    """
+
+    file_name = "simulation_data"
+    extension = ""
+    # whether a checkpointed run can truncate the file and continue appending to it
+    supports_resume = False
+
+    def __init__(self, folder_path: Path, chunk_size: int = 4096):
+        self.file_path = Path(folder_path).joinpath(f"{self.file_name}{self.extension}")
+        self.chunk_size = chunk_size
+        self.columns: List[str] = None
+        self.record_buffer: np.ndarray = None
+        self.num_buffered = 0
+        self.rows_written = 0
+
+    def allocate_buffers(self, simulation_row: Dict):
+        self.columns = list(simulation_row.keys())
+        self.int_columns = [col for col in self.columns if isinstance(simulation_row[col], (int, np.integer)) and not isinstance(simulation_row[col], bool)]
+        self.str_columns = [col for col in self.columns if isinstance(simulation_row[col], str)]
+        self.float_columns = [col for col in self.columns if col not in self.int_columns and col not in self.str_columns]
+        self.int_values = np.empty((self.chunk_size, len(self.int_columns)), dtype=np.int64)
+        self.str_values = np.empty((self.chunk_size, len(self.str_columns)), dtype=object)
+        self.float_values = np.empty((self.chunk_size, len(self.float_columns)), dtype=np.float64)
+
+    def __call__(self, simulation_row: Dict, prosumer_name: str, simulation_step_idx: int):
+        if self.record_buffer is not None:
+            raise ValueError("Writer already takes records, rows cannot be mixed in")
+        if self.columns is None:
+            self.allocate_buffers(simulation_row)
+        row_idx = self.num_buffered
+        self.int_values[row_idx] = [simulation_row[col] for col in self.int_columns]
+        self.str_values[row_idx] = [simulation_row[col] for col in self.str_columns]
+        self.float_values[row_idx] = [simulation_row[col] for col in self.float_columns]
+        self.num_buffered += 1
+        if self.num_buffered == self.chunk_size:
+            self.flush()
+
+    def write_records(self, records: np.ndarray):
+        """
+        Buffer structured simulation records, see records.get_simulation_record_dtype
+        """
+        if self.columns is not None:
+            raise ValueError("Writer already takes rows, records cannot be mixed in")
+        records = records.reshape(-1)
+        if self.record_buffer is None:
+            self.record_buffer = np.empty(self.chunk_size, dtype=records.dtype)
+        num_copied = 0
+        while num_copied < len(records):
+            num_rows = min(self.chunk_size - self.num_buffered, len(records) - num_copied)
+            self.record_buffer[self.num_buffered:self.num_buffered + num_rows] = records[num_copied:num_copied + num_rows]
+            self.num_buffered += num_rows
+            num_copied += num_rows
+            if self.num_buffered == self.chunk_size:
+                self.flush()
+
+    def get_buffered_df(self) -> pd.DataFrame:
+        num_rows = self.num_buffered
+        if self.record_buffer is not None:
+            return records_to_dataframe(self.record_buffer[:num_rows])
+        buffered_df = pd.concat([
+            pd.DataFrame(self.int_values[:num_rows], columns=self.int_columns),
+            pd.DataFrame(self.str_values[:num_rows], columns=self.str_columns),
+            pd.DataFrame(self.float_values[:num_rows], columns=self.float_columns),
+        ], axis=1)
+        return buffered_df[self.columns]
+
+    def flush(self):
+        if self.num_buffered == 0:
+            return
+        self.write_chunk(self.get_buffered_df())
+        self.rows_written += self.num_buffered
+        self.num_buffered = 0
+
+    @abc.abstractmethod
+    def write_chunk(self, chunk_df: pd.DataFrame):
+        """
+        Append chunk_df to file_path
+        """
+
+    def get_state(self) -> Dict:
+        """
+        Rows written so far and copies of the buffered rows, see set_state
+        """
+        state = {"rows_written": self.rows_written, "records": None, "rows": None}
+        if self.record_buffer is not None:
+            state["records"] = self.record_buffer[:self.num_buffered].copy()
+        elif self.columns is not None:
+            state["rows"] = self.get_buffered_df().to_dict("records")
+        return state
+
+    def set_state(self, state: Dict):
+        """
+        Restore a fresh writer to state, once its file is back to the size it had when state was taken
+        """
+        self.rows_written = state["rows_written"]
+        # fewer than chunk_size rows were buffered, so buffering them again does not flush
+        if state["records"] is not None:
+            self.write_records(state["records"])
+        for simulation_row in state["rows"] or []:
+            self(simulation_row, simulation_row.get("prosumer_name"), simulation_row.get("step"))
+
+    @property
+    def bytes_written(self) -> int:
+        # complete once the writer is closed, some backends only finish their file on close
+        return self.file_path.stat().st_size if self.file_path.is_file() else 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CSVSimulationDataWriter(SimulationDataWriter):
+    extension = ".csv"
+    supports_resume = True
+
+    def write_chunk(self, chunk_df: pd.DataFrame):
+        include_header = (not self.file_path.is_file())
+        chunk_df.to_csv(self.file_path, header=include_header, index=False, mode="a")
+
+
+class ParquetSimulationDataWriter(SimulationDataWriter):
+    extension = ".parquet"
+
+    def __init__(self, folder_path: Path, chunk_size: int = 4096):
+        super().__init__(folder_path, chunk_size)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("The parquet writer backend requires pyarrow to be installed") from e
+        self.pyarrow = pyarrow
+        self.writer = None
+
+    def write_chunk(self, chunk_df: pd.DataFrame):
+        table = self.pyarrow.Table.from_pandas(chunk_df, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.file_path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        super().close()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class HDF5SimulationDataWriter(SimulationDataWriter):
+    extension = ".h5"
+    key = "simulation_data"
+
+    def write_chunk(self, chunk_df: pd.DataFrame):
+        # one append per chunk, the file is only open while writing so partial runs stay readable
+        with pd.HDFStore(self.file_path, mode="a", complevel=5, complib="blosc") as store:
+            store.append(
+                self.key,
+                chunk_df,
+                format="table",
+                index=False,
+                data_columns=["prosumer_name", "step"],
+                min_itemsize={"prosumer_name": 64},
+            )
+
+
+WRITER_BACKENDS = {
+    "csv": CSVSimulationDataWriter,
+    "parquet": ParquetSimulationDataWriter,
+    "hdf5": HDF5SimulationDataWriter,
+}
+
+
+def get_simulation_data_writer(backend: str, folder_path: Path, chunk_size: int = 4096) -> SimulationDataWriter:
+    if backend not in WRITER_BACKENDS:
+        raise ValueError(f"Unknown writer backend {backend}, expected one of {list(WRITER_BACKENDS)}")
+    return WRITER_BACKENDS[backend](folder_path, chunk_size)
+
+
+def read_simulation_data(file_path: Path) -> pd.DataFrame:
+    """
+    Read back the consolidated table written by a SimulationDataWriter
+    """
+    file_path = Path(file_path)
+    if file_path.suffix == ParquetSimulationDataWriter.extension:
+        return pd.read_parquet(file_path)
+    if file_path.suffix == HDF5SimulationDataWriter.extension:
+        return pd.read_hdf(file_path, HDF5SimulationDataWriter.key)
+    return pd.read_csv(file_path)
@@ -0,0 +1,278 @@
+# Run many price generation configurations against one environment
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+from runner import explicit_bool, get_environment_data_descriptor, load_building_environment
+from src.data_generation.utils.constants import DAY_START, YEAR_START
+from src.data_generation.environment import MockEnvironment
+from src.data_generation.simulate import SimulationConfig, simulate
+from src.data_generation import price_generation_functions
+from src.data_generation.dispatch import DISPATCH_SOLVERS
+from src.data_generation.convert_batch import BatchWriter, SHARD_FORMATS
+from src.data_generation.response_cache import ResponseCache
+from src.data_generation.writers import WRITER_BACKENDS, get_simulation_data_writer
+
+# parameters of a sweep point, every parameter is also passed on to the price generation function
+SWEEP_DEFAULTS = {
+    "price_generation_function": "constant_prices_generation_function",
+    "offset_multiplier": 0.1,
+    "off_peak_offset_multiplier": 0,
+    "scale_multiplier": 0.1,
+    "prosumer_noise_scale": 0.1,
+    "generation_noise_scale": 0.1,
+    "num_simulation_steps": 1000,
+    "day_start": DAY_START,
+    "year_start": YEAR_START,
+    "seed": None,
+}
+MANIFEST_NAME = "sweep_manifest.json"
+
+
+def expand_sweep_spec(sweep_spec: Dict) -> List[Dict]:
+    """
+    Expand a sweep spec into the parameters of every point
+
+    The spec may contain "base" parameters shared by all points, a "grid" mapping parameter names
+    to lists of values whose cartesian product is swept, and a list of explicit "points".
+    Parameters missing from a point default to SWEEP_DEFAULTS.
+    """
+    unknown_keys = set(sweep_spec) - {"sweep_name", "base", "grid", "points"}
+    if unknown_keys:
+        raise ValueError(f"Unknown sweep spec keys {sorted(unknown_keys)}")
+    base_params = {**SWEEP_DEFAULTS, **sweep_spec.get("base", {})}
+    grid = sweep_spec.get("grid", {})
+    points = []
+    if grid:
+        grid_names = list(grid)
+        for grid_values in itertools.product(*(grid[grid_name] for grid_name in grid_names)):
+            points.append({**base_params, **dict(zip(grid_names, grid_values))})
+    for point_params in sweep_spec.get("points", []):
+        points.append({**base_params, **point_params})
+    if not points:
+        points.append(base_params)
+    return points
+
+
+def get_point_id(point_params: Dict) -> str:
+    # derived from the parameters only, so reordering or extending a sweep keeps completed points
+    params_hash = hashlib.sha1(json.dumps(point_params, sort_keys=True).encode()).hexdigest()[:10]
+    return f"{point_params['price_generation_function']}-{params_hash}"
+
+
+def load_manifest(manifest_path: Path, sweep_name: str) -> Dict:
+    if manifest_path.is_file():
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+    return {"sweep_name": sweep_name, "points": {}}
+
+
+def save_manifest(manifest_path: Path, manifest: Dict):
+    # replace atomically, an interrupted sweep must leave a readable manifest behind
+    tmp_path = manifest_path.with_name(f"{manifest_path.name}.tmp")
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def run_sweep_point(
+    mock_environment: MockEnvironment,
+    point_params: Dict,
+    simulation_folder: str,
+    batch_folder: Optional[str] = None,
+    writer_backend="csv",
+    writer_chunk_size=4096,
+    transitions_per_batch=1,
+    shard_format=None,
+) -> float:
+    """
+    Simulate one sweep point, replacing output left behind by an interrupted attempt
+
+    :return: seconds taken by the point
+    """
+    point_start = time.perf_counter()
+    for folder in (simulation_folder, batch_folder):
+        if folder is not None and Path(folder).exists():
+            shutil.rmtree(folder)
+    Path(simulation_folder).mkdir(parents=True)
+
+    mock_environment.set_noise_scales(point_params["prosumer_noise_scale"], point_params["generation_noise_scale"])
+    # workers run many points on one fleet, warm starts left by earlier points would make results depend on scheduling
+    mock_environment.prosumer_fleet.reset_warm_starts()
+    simulation_config = SimulationConfig(
+        num_simulation_steps=point_params["num_simulation_steps"],
+        day_start=point_params["day_start"],
+        year_start=point_params["year_start"],
+        prices_generation_function=getattr(price_generation_functions, f"get_{point_params['price_generation_function']}")(**point_params),
+        seed=point_params["seed"],
+    )
+    write_data = get_simulation_data_writer(writer_backend, simulation_folder, writer_chunk_size)
+    if batch_folder is not None:
+        batch_writer = BatchWriter(batch_folder, transitions_per_batch=transitions_per_batch, shard_format=shard_format)
+    else:
+        batch_writer = None
+    try:
+        simulate(
+            mock_environment=mock_environment,
+            simulation_config=simulation_config,
+            write_data=write_data,
+            batch_writer=batch_writer,
+            accumulate=False,
+        )
+    finally:
+        write_data.close()
+        if batch_writer is not None:
+            batch_writer.close()
+    return time.perf_counter() - point_start
+
+
+# environment of each worker process, shipped once through the pool initializer
+_worker_environment: MockEnvironment = None
+
+
+def _initialize_worker(mock_environment: MockEnvironment, response_cache_size: int):
+    global _worker_environment
+    _worker_environment = mock_environment
+    if response_cache_size > 0:
+        _worker_environment.prosumer_fleet.set_response_cache(ResponseCache(max_entries=response_cache_size))
+
+
+def _run_worker_point(*point_args) -> float:
+    return run_sweep_point(_worker_environment, *point_args)
+
+
+def run_sweep(
+    sweep_spec: Dict,
+    sweep_name: str,
+    workers=1,
+    generate_batch_data=False,
+    dispatch_solver="slsqp",
+    writer_backend="csv",
+    writer_chunk_size=4096,
+    transitions_per_batch=1,
+    shard_format=None,
+    response_cache_size=0,
+    environment_cache_dir="./building_data/compiled",
+) -> Dict:
+    """
+    Run every point of a sweep, skipping points the sweep manifest records as completed
+
+    Each point is written to ./simulated_data/{sweep_name}/{point_id} (and ./batch_data/{sweep_name}/{point_id}),
+    so points can be turned into batch data with create_batch.py --folder_name {sweep_name} --run_folder_name {point_id}.
+
+    :return: the sweep manifest
+    """
+    sweep_folder = Path(f"./simulated_data/{sweep_name}")
+    sweep_folder.mkdir(parents=True, exist_ok=True)
+    manifest_path = sweep_folder.joinpath(MANIFEST_NAME)
+    manifest = load_manifest(manifest_path, sweep_name)
+
+    pending_point_ids = []
+    for point_params in expand_sweep_spec(sweep_spec):
+        point_id = get_point_id(point_params)
+        point_entry = manifest["points"].setdefault(point_id, {
+            "params": point_params,
+            "status": "pending",
+            "simulation_folder": str(sweep_folder.joinpath(point_id)),
+            "batch_folder": f"./batch_data/{sweep_name}/{point_id}" if generate_batch_data else None,
+        })
+        if point_entry["status"] != "completed" and point_id not in pending_point_ids:
+            pending_point_ids.append(point_id)
+    save_manifest(manifest_path, manifest)
+    num_completed = len(manifest["points"]) - len(pending_point_ids)
+    print(f"Sweep {sweep_name}: {len(pending_point_ids)} points to run, {num_completed} already completed")
+    if not pending_point_ids:
+        return manifest
+
+    # the environment is built once, noise scales are applied per point
+    mock_environment = load_building_environment(get_environment_data_descriptor(dispatch_solver=dispatch_solver), environment_cache_dir)
+    print(mock_environment.timing_report())
+
+    def get_point_args(point_id):
+        point_entry = manifest["points"][point_id]
+        return (
+            point_entry["params"],
+            point_entry["simulation_folder"],
+            point_entry["batch_folder"],
+            writer_backend,
+            writer_chunk_size,
+            transitions_per_batch,
+            shard_format,
+        )
+
+    def record_point(point_id, seconds=None, error=None):
+        point_entry = manifest["points"][point_id]
+        point_entry["status"] = "failed" if error is not None else "completed"
+        point_entry["seconds"] = seconds
+        point_entry["error"] = error
+        save_manifest(manifest_path, manifest)
+        print(f"Point {point_id} {point_entry['status']}" + (f" in {seconds:.1f}s" if seconds is not None else f": {error}"))
+
+    if workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_initialize_worker,
+            initargs=(mock_environment, response_cache_size),
+        ) as executor:
+            point_futures = {executor.submit(_run_worker_point, *get_point_args(point_id)): point_id for point_id in pending_point_ids}
+            for point_future in as_completed(point_futures):
+                point_id = point_futures[point_future]
+                try:
+                    record_point(point_id, seconds=point_future.result())
+                except Exception as e:
+                    record_point(point_id, error=repr(e))
+    else:
+        if response_cache_size > 0:
+            mock_environment.prosumer_fleet.set_response_cache(ResponseCache(max_entries=response_cache_size))
+        for point_id in pending_point_ids:
+            try:
+                record_point(point_id, seconds=run_sweep_point(mock_environment, *get_point_args(point_id)))
+            except Exception as e:
+                traceback.print_exc()
+                record_point(point_id, error=repr(e))
+    return manifest
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sweep_spec", type=str, required=True, help="json file with base, grid and points of the sweep")
+    parser.add_argument("--sweep_name", type=str, default=None, help="Defaults to the spec's sweep_name, then to the spec file name")
+    parser.add_argument("--workers", type=int, default=1, help="Sweep points simulated in parallel")
+    parser.add_argument("--generate_batch_data", type=lambda bool_arg: explicit_bool(parser, bool_arg, nonable=False), default=False)
+    parser.add_argument("--dispatch_solver", type=str, default="slsqp", choices=list(DISPATCH_SOLVERS))
+    parser.add_argument("--writer_backend", type=str, default="csv", choices=list(WRITER_BACKENDS))
+    parser.add_argument("--writer_chunk_size", type=int, default=4096, help="Rows buffered before the writer flushes to disk")
+    parser.add_argument("--transitions_per_batch", type=int, default=1, help="Transitions per SampleBatch written as batch data")
+    parser.add_argument("--shard_format", type=str, default=None, choices=SHARD_FORMATS, help="Also write batch data as binary shards")
+    parser.add_argument("--response_cache_size", type=int, default=0, help="Entries kept in each worker's response cache, points sharing prices reuse solves")
+    parser.add_argument("--environment_cache_dir", type=lambda path: None if path == "None" else path, default="./building_data/compiled", help="Folder of compiled building data, None to always parse the CSVs")
+    args = parser.parse_args()
+
+    with open(args.sweep_spec) as sweep_spec_file:
+        sweep_spec = json.load(sweep_spec_file)
+    sweep_name = args.sweep_name or sweep_spec.get("sweep_name") or Path(args.sweep_spec).stem
+
+    manifest = run_sweep(
+        sweep_spec,
+        sweep_name,
+        args.workers,
+        args.generate_batch_data,
+        args.dispatch_solver,
+        args.writer_backend,
+        args.writer_chunk_size,
+        args.transitions_per_batch,
+        args.shard_format,
+        args.response_cache_size,
+        args.environment_cache_dir,
+    )
+    failed_point_ids = [point_id for point_id, point_entry in manifest["points"].items() if point_entry["status"] == "failed"]
+    if failed_point_ids:
+        print(f"{len(failed_point_ids)} points failed, rerun the sweep to retry them: {failed_point_ids}")
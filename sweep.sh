@@ -0,0 +1,5 @@
+which python3
+python3 sweep.py \
+	--sweep_spec sweep_example.json \
+	--workers 4 \
+	--generate_batch_data True
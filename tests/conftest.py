@@ -0,0 +1,22 @@
+import pytest
+from benchmarks.run_benchmarks import YEAR, load_benchmark_environment
+from benchmarks.synthetic_building_data import generate_building_data
+
+NUM_PROSUMERS = 4
+
+
+@pytest.fixture(scope="session")
+def building_data_folder(tmp_path_factory):
+    building_data_folder = tmp_path_factory.mktemp("building_data")
+    generate_building_data(building_data_folder, NUM_PROSUMERS, YEAR)
+    return building_data_folder
+
+
+@pytest.fixture
+def make_environment(building_data_folder):
+    """
+    Builds a fresh environment of the synthetic building data for a dispatch solver
+    """
+    def make_environment(dispatch_solver="lp", num_prosumers=NUM_PROSUMERS):
+        return load_benchmark_environment(building_data_folder, num_prosumers, dispatch_solver, cache_dir=None)
+    return make_environment
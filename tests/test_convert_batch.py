@@ -0,0 +1,13 @@
+import numpy as np
+
+from src.data_generation.convert_batch import BatchWriter
+
+
+def test_bytes_written_counts_only_own_files(tmp_path):
+    # files of an earlier run in the same folder
+    tmp_path.joinpath("shard-earlier.npz").write_bytes(b"0" * 1000)
+    with BatchWriter(tmp_path, shard_format="npz", write_json=False) as batch_writer:
+        for step in range(5):
+            batch_writer.write_batch(step, np.ones(24), np.ones(48), 1.0)
+    own_bytes = sum(file_path.stat().st_size for file_path in tmp_path.iterdir() if file_path.name != "shard-earlier.npz")
+    assert batch_writer.bytes_written == own_bytes > 0
@@ -0,0 +1,15 @@
+import pytest
+from src.data_generation.dispatch import check_dispatch_regression
+from src.data_generation.price_generation_functions import get_constant_peak_day_prices_generation_function
+
+DAYS = (2, 100, 200)
+
+
+@pytest.mark.parametrize("day", DAYS)
+def test_lp_cost_not_above_slsqp(make_environment, day):
+    mock_environment = make_environment("slsqp")
+    buy_prices, sell_prices = mock_environment.get_utility_prices(day)
+    buy_prices, sell_prices = get_constant_peak_day_prices_generation_function(offset_multiplier=0.1)(day, 2016, buy_prices, sell_prices)
+    for prosumer in mock_environment.prosumer_list:
+        lp_cost, slsqp_cost, passed = check_dispatch_regression(prosumer, day, buy_prices, sell_prices, tolerance=1e-3)
+        assert passed, f"{prosumer.name} on day {day}: lp cost {lp_cost} above slsqp cost {slsqp_cost}"
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("days, missing_days", [(-1, r"\[-1\]"), (400, r"\[400\]"), ([1, 2, 400], r"\[400\]")])
+def test_get_day_rows_names_missing_days(make_environment, days, missing_days):
+    mock_environment = make_environment()
+    with pytest.raises(KeyError, match=missing_days):
+        mock_environment.arrays.get_day_rows(days)
+
+
+def test_get_day_rows(make_environment):
+    mock_environment = make_environment()
+    day_rows = mock_environment.arrays.get_day_rows(np.array([1, 2, 3]))
+    np.testing.assert_array_equal(mock_environment.arrays.days[day_rows], [1, 2, 3])
+
+
+def test_use_profiler_times_rewards_and_prosumer_solves(make_environment):
+    from src.data_generation.profiling import NULL_PROFILER, Profiler
+    mock_environment = make_environment(dispatch_solver="slsqp")
+    prosumer = mock_environment.prosumer_list[0]
+    prices = np.full(24, 0.2)
+    profiler = Profiler()
+    with mock_environment.use_profiler(profiler):
+        net = prosumer.get_optimal_net(2, prices, prices)
+        mock_environment.get_rewards_twoprices(net[None], 2, prices, prices)
+    assert profiler.calls["reward"] == 1
+    assert profiler.calls["prosumer_solve"] == 1
+    assert profiler.counters["prosumer_solves"] == 1
+    assert prosumer.profiler is NULL_PROFILER
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from src.data_generation.population import generate_prosumer_population
+from src.data_generation.response_cache import ResponseCache
+from src.data_generation.simulate import SimulationConfig, iter_simulate
+from src.data_generation.price_generation_functions import get_random_prices_generation_function
+
+
+def get_time_of_use_prices(day, year, utility_buy_prices, utility_sell_prices):
+    # flat within the peak and off-peak hours, so the LP has many optimal schedules
+    buy_prices = np.where((np.arange(24) >= 16) & (np.arange(24) < 21), 0.4, 0.2)
+    return buy_prices, 0.5 * buy_prices
+
+
+def get_demand(mock_environment, day_start, num_simulation_steps, prices_generation_function=None, **simulate_kwargs):
+    simulation_config = SimulationConfig(
+        num_simulation_steps=num_simulation_steps,
+        day_start=day_start,
+        year_start=2016,
+        prices_generation_function=prices_generation_function or get_random_prices_generation_function(offset_multiplier=0.1, scale_multiplier=0.1),
+        seed=0,
+    )
+    return np.stack([simulation_step.prosumer_demand for simulation_step in iter_simulate(mock_environment, simulation_config, **simulate_kwargs)])
+
+
+@pytest.mark.parametrize("dispatch_solver", ["lp", "slsqp_warm"])
+def test_response_cache_does_not_change_results(make_environment, dispatch_solver):
+    response_cache = ResponseCache()
+    # fill the cache, then simulate overlapping and later days on fresh fleets
+    filling_environment = make_environment(dispatch_solver)
+    filling_environment.prosumer_fleet.set_response_cache(response_cache)
+    get_demand(filling_environment, 1, 3)
+
+    cached_environment = make_environment(dispatch_solver)
+    cached_environment.prosumer_fleet.set_response_cache(response_cache)
+    cached_demand = get_demand(cached_environment, 2, 4)
+    uncached_demand = get_demand(make_environment(dispatch_solver), 2, 4)
+    np.testing.assert_array_equal(cached_demand, uncached_demand)
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_process_backend_matches_serial_with_tied_prices(make_environment, workers):
+    # several chunks, so the number of workers could change how the fleet is split
+    population_environment = generate_prosumer_population(make_environment("lp"), 40, seed=0)
+    serial_demand = get_demand(population_environment, 1, 2, get_time_of_use_prices)
+    process_demand = get_demand(population_environment, 1, 2, get_time_of_use_prices, workers=workers, backend="process")
+    np.testing.assert_array_equal(process_demand, serial_demand)
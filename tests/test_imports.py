@@ -0,0 +1,11 @@
+import pytest
+
+from benchmarks.run_benchmarks import ENTRY_POINTS, IMPORT_BUDGET_SECONDS, benchmark_imports
+
+
+@pytest.mark.parametrize("module_name", ENTRY_POINTS)
+def test_entry_points_import_lazily(module_name):
+    # runs in fresh interpreters, raising BudgetExceeded when wandb, ray, gym or scipy is loaded or the budget is exceeded
+    metrics = benchmark_imports(module_name, repeats=3, budget_seconds=IMPORT_BUDGET_SECONDS)
+    assert metrics["heavy_modules_loaded"] == 0
+    assert metrics["import_seconds"] <= IMPORT_BUDGET_SECONDS
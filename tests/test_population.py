@@ -0,0 +1,26 @@
+import numpy as np
+
+from src.data_generation.population import generate_prosumer_population
+
+
+def test_week_shifts_keep_weekdays(make_environment):
+    population_environment = generate_prosumer_population(make_environment(), 40, seed=0, max_week_shift=2)
+    arrays = population_environment.arrays
+    population = population_environment.prosumer_fleet.population
+    assert np.any(population.day_shifts != 0)
+    num_days = arrays.prosumer_demand.shape[1]
+    day_rows = np.arange(num_days)
+    for population_idx in range(len(population_environment.prosumer_list)):
+        copied_day_rows = population.get_copied_day_rows(day_rows, num_days, population_idx)
+        np.testing.assert_array_equal(arrays.is_weekday[copied_day_rows], arrays.is_weekday)
+
+
+def test_population_loads_match_yearlongdemand(make_environment):
+    population_environment = generate_prosumer_population(make_environment(), 10, seed=0, max_week_shift=2)
+    arrays = population_environment.arrays
+    population = population_environment.prosumer_fleet.population
+    # the first and last rows are where shifts run out of data
+    for day_row in (0, 3, arrays.prosumer_demand.shape[1] - 1):
+        loads = population.get_loads(arrays.prosumer_demand, day_row)
+        for population_idx, prosumer in enumerate(population_environment.prosumer_list):
+            np.testing.assert_allclose(loads[population_idx], prosumer.yearlongdemand.iloc[day_row].to_numpy())
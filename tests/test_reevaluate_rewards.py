@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from create_batch import create_batch
+from reevaluate_rewards import get_run_tariff, reevaluate_rewards
+from src.data_generation.price_generation_functions import get_constant_peak_day_prices_generation_function
+from src.data_generation.simulate import SimulationConfig, simulate
+from src.data_generation.utils.constants import DAY_LENGTH
+
+
+class RecordingBatchWriter:
+    def write_batches(self, episode_and_steps, actions, observations, rewards):
+        self.observations = observations
+        self.rewards = rewards
+
+
+def test_batch_observations_use_reevaluated_tariff(make_environment):
+    mock_environment = make_environment()
+    simulation_config = SimulationConfig(
+        num_simulation_steps=3,
+        day_start=5,
+        year_start=2016,
+        prices_generation_function=get_constant_peak_day_prices_generation_function(offset_multiplier=0.1),
+    )
+    simulation_data = simulate(mock_environment, simulation_config, lambda *write_args: None)
+    simulation_data_df = pd.concat(simulation_data.values(), ignore_index=True)
+
+    rewards_df = reevaluate_rewards(simulation_data_df, mock_environment, utility_buy_price_multiplier=2.0)
+    buyprice_grid, _ = get_run_tariff(mock_environment, rewards_df["day"].to_numpy(), utility_buy_price_multiplier=2.0)
+    batch_writer = RecordingBatchWriter()
+    create_batch(simulation_data_df, mock_environment, batch_writer, rewards_df["reward"].to_numpy(), buyprice_grid)
+
+    day_rows = mock_environment.arrays.get_day_rows(rewards_df["day"].to_numpy())
+    np.testing.assert_allclose(
+        batch_writer.observations[:, 2 * DAY_LENGTH:],
+        2.0 * mock_environment.arrays.utility_hourly_buy_prices[day_rows],
+        rtol=1e-6,
+    )
+    np.testing.assert_array_equal(batch_writer.rewards, rewards_df["reward"].to_numpy())
@@ -0,0 +1,44 @@
+import shutil
+import numpy as np
+import pandas as pd
+from benchmarks.run_benchmarks import YEAR, load_benchmark_environment
+from src.data_generation.population import generate_prosumer_population
+from src.data_generation.response_cache import ResponseCache
+
+DAY = 40
+
+
+def get_nets(mock_environment, response_cache=None):
+    buy_prices, sell_prices = mock_environment.get_utility_prices(DAY)
+    mock_environment.prosumer_fleet.set_response_cache(response_cache)
+    return mock_environment.prosumer_fleet.get_optimal_nets(DAY, buy_prices, sell_prices)
+
+
+def test_changed_building_data_misses_persistent_cache(building_data_folder, tmp_path):
+    # the same buildings, sizes and prices with doubled demand
+    changed_data_folder = tmp_path.joinpath("building_data")
+    changed_data_folder.mkdir()
+    shutil.copy(building_data_folder.joinpath("building_metadata.csv"), changed_data_folder)
+    building_data_df = pd.read_csv(building_data_folder.joinpath(f"building_demand_{YEAR}.csv"))
+    demand_columns = [column for column in building_data_df.columns if column.endswith("(kWh)")]
+    building_data_df[demand_columns] *= 2
+    building_data_df.to_csv(changed_data_folder.joinpath(f"building_demand_{YEAR}.csv"), index=False)
+
+    disk_path = tmp_path.joinpath("responses.sqlite")
+    for data_folder in (building_data_folder, changed_data_folder):
+        mock_environment = load_benchmark_environment(data_folder, 2, "lp", cache_dir=tmp_path.joinpath("compiled"))
+        response_cache = ResponseCache(disk_path=disk_path, commit_every=1)
+        cached_nets = get_nets(mock_environment, response_cache)
+        assert response_cache.get_stats()["disk_hits"] == 0
+        np.testing.assert_array_equal(cached_nets, get_nets(mock_environment))
+
+
+def test_population_prosumers_do_not_share_entries(make_environment):
+    mock_environment = make_environment("lp")
+    response_cache = ResponseCache()
+    for day_shift in (0, 7):
+        # the real prosumers under their own names, with their demand shifted by day_shift
+        population_environment = generate_prosumer_population(mock_environment, len(mock_environment.prosumer_list), seed=0)
+        population_environment.prosumer_fleet.population.day_shifts[:] = day_shift
+        cached_nets = get_nets(population_environment, response_cache)
+        np.testing.assert_array_equal(cached_nets, get_nets(population_environment))
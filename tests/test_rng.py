@@ -0,0 +1,22 @@
+import numpy as np
+
+from src.data_generation.rng import SimulationRNG
+
+
+def test_fleet_noise_matches_single_prosumers(make_environment):
+    mock_environment = make_environment(dispatch_solver="slsqp")
+    prices = np.full(24, 0.2)
+    fleet_demand = mock_environment.prosumer_fleet.get_real_responses_twoprices(2, prices, prices, 2016, simulation_rng=SimulationRNG(0))
+    for prosumer_idx, prosumer in enumerate(mock_environment.prosumer_list):
+        prosumer_demand = prosumer.get_real_response_twoprices(2, prices, prices, 2016, simulation_rng=SimulationRNG(0))
+        np.testing.assert_array_equal(fleet_demand[prosumer_idx], prosumer_demand)
+
+
+def test_noise_leaves_global_state_alone(make_environment):
+    mock_environment = make_environment()
+    np.random.seed(0)
+    prices = np.full(24, 0.2)
+    mock_environment.prosumer_fleet.get_real_responses_twoprices(2, prices, prices, 2016)
+    mock_environment.prosumer_list[0].get_real_response_twoprices(2, prices, prices, 2016)
+    assert np.random.get_state()[2] == np.random.RandomState(0).get_state()[2]
+    np.testing.assert_array_equal(np.random.get_state()[1], np.random.RandomState(0).get_state()[1])
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from src.data_generation.step_logger import AsyncStepLogger
+
+
+def test_metrics_arrive_in_order():
+    logged = []
+    with AsyncStepLogger(logged.append, flush_every=4) as step_logger:
+        for step in range(10):
+            step_logger.log({"step": step})
+    assert logged == [{"step": step} for step in range(10)]
+    assert step_logger.logged == 10
+
+
+def test_block_policy_loses_nothing():
+    logged = []
+    with AsyncStepLogger(logged.append, max_queue_size=2, policy="block", flush_every=1) as step_logger:
+        for step in range(100):
+            step_logger.log({"step": step})
+    assert [metrics["step"] for metrics in logged] == list(range(100))
+    assert step_logger.dropped == 0
+
+
+def test_drop_policy_counts_dropped_steps():
+    logged = []
+    is_released = threading.Event()
+    def log_fn(metrics):
+        # hold the thread on the first step so the queue fills up
+        is_released.wait()
+        logged.append(metrics)
+
+    step_logger = AsyncStepLogger(log_fn, max_queue_size=2, policy="drop", flush_every=1)
+    for step in range(10):
+        step_logger.log({"step": step})
+    is_released.set()
+    step_logger.close()
+    assert step_logger.dropped > 0
+    assert len(logged) + step_logger.dropped == 10
+    assert [metrics["step"] for metrics in logged] == sorted(metrics["step"] for metrics in logged)
+
+
+def test_close_raises_log_fn_error():
+    def log_fn(metrics):
+        raise ValueError("log failed")
+
+    step_logger = AsyncStepLogger(log_fn, flush_every=1)
+    step_logger.log({"step": 0})
+    with pytest.raises(RuntimeError) as raised:
+        step_logger.close()
+    assert isinstance(raised.value.__cause__, ValueError)
@@ -0,0 +1,11 @@
+from sweep import SWEEP_DEFAULTS, run_sweep_point
+
+
+def test_sweep_points_do_not_depend_on_earlier_points(make_environment, tmp_path):
+    point_params = {**SWEEP_DEFAULTS, "num_simulation_steps": 3, "seed": 0}
+    earlier_point_params = {**point_params, "offset_multiplier": 0.3}
+    mock_environment = make_environment("slsqp_warm")
+    run_sweep_point(mock_environment, earlier_point_params, str(tmp_path / "earlier"))
+    run_sweep_point(mock_environment, point_params, str(tmp_path / "after_earlier"))
+    run_sweep_point(make_environment("slsqp_warm"), point_params, str(tmp_path / "alone"))
+    assert (tmp_path / "after_earlier" / "simulation_data.csv").read_bytes() == (tmp_path / "alone" / "simulation_data.csv").read_bytes()